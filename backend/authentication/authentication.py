@@ -0,0 +1,116 @@
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from authentication.models import User
+from shortener.instrumentation import record_cache_lookup
+
+UserState = namedtuple('UserState', ['is_active', 'is_staff', 'is_superuser', 'password_hash'])
+
+# Cached for user ids without a row, so tokens of deleted users do not query on every request either.
+MISSING_USER = 0
+
+
+class UserStateCache:
+  """
+  Short-TTL cache of the user columns that authentication checks on every request, and of revoked access tokens.
+  Entries are dropped when a user is saved or deleted, other processes see the change once their entry expires
+  unless the cache is shared.
+  """
+  user_prefix = 'auth:user:'
+  revoked_prefix = 'auth:revoked:'
+
+  def __init__(self, alias: str = 'default', ttl: int = 30):
+    self.alias = alias
+    self.ttl = ttl
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'AUTH_USER_CACHE', {})
+    return cls(alias=options.get('CACHE_ALIAS', 'default'), ttl=options.get('TTL', 30))
+
+  @property
+  def cache(self):
+    return caches[self.alias]
+
+  def get(self, user_id, jti=None):
+    """
+    Returns (user state, revoked) for a token, with one cache round trip when both are cached.
+    The user state is None if the user does not exist.
+    """
+    user_key = f'{self.user_prefix}{user_id}'
+    revoked_key = f'{self.revoked_prefix}{jti}'
+    cached = self.cache.get_many([user_key, revoked_key] if jti else [user_key])
+    state = cached.get(user_key)
+    record_cache_lookup('user_state', 'miss' if state is None else 'hit')
+    if state is None:
+      state = self.load(user_id)
+      self.cache.set(user_key, state or MISSING_USER, self.ttl)
+    return state or None, revoked_key in cached
+
+  def load(self, user_id):
+    row = User.objects.filter(pk=user_id).values_list('is_active', 'is_staff', 'is_superuser', 'password').first()
+    if row is None:
+      return None
+    is_active, is_staff, is_superuser, password = row
+    password_hash = get_md5_hash_password(password) if api_settings.CHECK_REVOKE_TOKEN else ''
+    return UserState(is_active, is_staff, is_superuser, password_hash)
+
+  def delete(self, user_id):
+    self.cache.delete(f'{self.user_prefix}{user_id}')
+
+  def revoke(self, token):
+    """
+    Marks an access token as revoked until it expires.
+    """
+    remaining = int(token['exp'] - time.time())
+    if remaining > 0:
+      self.cache.set(f'{self.revoked_prefix}{token[api_settings.JTI_CLAIM]}', 1, remaining)
+
+
+user_state_cache = UserStateCache.from_settings()
+
+
+class CachedTokenUser(TokenUser):
+  """
+  Authenticated user built from the access token claims and the cached user state, without loading the User row.
+  Views that only need the id use request.user.id, views that need the other fields call get_user().
+  """
+  def __init__(self, token, state: UserState):
+    super().__init__(token)
+    self.is_active = state.is_active
+    self.is_staff = state.is_staff
+    self.is_superuser = state.is_superuser
+
+  def get_user(self) -> User:
+    return User.objects.get(pk=self.id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+  """
+  JWT authentication that does not query the user table per request.
+  The user's active flag, the password hash used for token revocation and the revoked access tokens are read
+  from UserStateCache, so a request only reaches the database when the cached state of its user has expired.
+  """
+  def get_user(self, validated_token):
+    try:
+      user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+      raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    state, revoked = user_state_cache.get(user_id, validated_token.get(api_settings.JTI_CLAIM))
+    if state is None:
+      raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if api_settings.CHECK_USER_IS_ACTIVE and not state.is_active:
+      raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    if revoked:
+      raise AuthenticationFailed(_("Token is blacklisted"), code="token_not_valid")
+    if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != state.password_hash:
+      raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+    return CachedTokenUser(validated_token, state)
@@ -0,0 +1,146 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+class BloomFilter:
+  """
+  Fixed-size Bloom filter over strings.
+  It is sized for `capacity` keys at the given false positive rate, and never reports a false negative.
+  """
+  def __init__(self, capacity: int = 100000, error_rate: float = 0.01):
+    self.capacity = capacity
+    self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+    self.bits = bytearray((self.size + 7) // 8)
+    self.count = 0
+
+  def _positions(self, key: str):
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'big')
+    second = int.from_bytes(digest[8:], 'big') | 1
+    return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+  def add(self, key: str):
+    for position in self._positions(key):
+      self.bits[position >> 3] |= 1 << (position & 7)
+    self.count += 1
+
+  def __contains__(self, key: str) -> bool:
+    return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class TokenBlacklist:
+  """
+  Membership test for blacklisted refresh tokens, keyed by jti.
+  A per-process Bloom filter answers most lookups, usually for tokens that are not blacklisted, without a query,
+  and only a positive hit is confirmed against BlacklistedToken.
+  The filter is extended with the rows blacklisted since the last sync. With a shared cache it syncs when the
+  version key that every blacklist() bumps has changed, otherwise at most every `refresh_interval` seconds, so a
+  token blacklisted by another process may pass the lookup for that long. RefreshToken.blacklist() still refuses
+  to blacklist a token twice, so a rotated refresh token cannot be reused in that window.
+  Ids are assigned on insert rather than on commit, so a row can become visible after a higher id was already read.
+  Each refresh therefore reads the last `refresh_overlap` ids again and adds the jtis the filter does not hold yet.
+  It is rebuilt from the unexpired rows every `rebuild_interval` seconds or once it holds more than its capacity.
+  """
+  version_key = 'auth:blacklist:version'
+
+  def __init__(
+    self, capacity=100000, error_rate=0.01, cache_alias=None, refresh_interval=5, rebuild_interval=3600,
+    refresh_overlap=1000,
+  ):
+    self.capacity = capacity
+    self.error_rate = error_rate
+    self.cache_alias = cache_alias
+    self.refresh_interval = refresh_interval
+    self.rebuild_interval = rebuild_interval
+    self.refresh_overlap = refresh_overlap
+    self.filter = None
+    self.version = None
+    self.last_id = 0
+    self.built_at = 0
+    self.refreshed_at = 0
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'AUTH_TOKEN_BLACKLIST', {})
+    return cls(
+      capacity=options.get('CAPACITY', 100000),
+      error_rate=options.get('ERROR_RATE', 0.01),
+      cache_alias=options.get('CACHE_ALIAS'),
+      refresh_interval=options.get('REFRESH_INTERVAL', 5),
+      rebuild_interval=options.get('REBUILD_INTERVAL', 3600),
+      refresh_overlap=options.get('REFRESH_OVERLAP', 1000),
+    )
+
+  @property
+  def cache(self):
+    return caches[self.cache_alias] if self.cache_alias else None
+
+  def contains(self, jti: str) -> bool:
+    self.sync()
+    if jti not in self.filter:
+      return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+  def add(self, jti: str):
+    """
+    Records a jti that was just blacklisted in the database.
+    Other processes are told through the version key once the surrounding transaction commits.
+    """
+    with self._lock:
+      if self.filter is not None:
+        self.filter.add(jti)
+    if self.cache is not None:
+      transaction.on_commit(self.bump_version)
+
+  def bump_version(self):
+    self.cache.add(self.version_key, 0, timeout=None)
+    try:
+      self.cache.incr(self.version_key)
+    except ValueError:
+      self.cache.add(self.version_key, 1, timeout=None)
+
+  def sync(self):
+    with self._lock:
+      now = time.monotonic()
+      if self.filter is None or now - self.built_at > self.rebuild_interval or self.filter.count > self.capacity:
+        self.rebuild(now)
+      elif self.cache is not None:
+        if self.cache.get(self.version_key, 0) != self.version:
+          self.refresh(now)
+      elif now - self.refreshed_at >= self.refresh_interval:
+        self.refresh(now)
+
+  def rebuild(self, now):
+    # The version is read before the rows, so a concurrent blacklist() is picked up by the next sync at worst.
+    version = self.cache.get(self.version_key, 0) if self.cache is not None else None
+    rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('id', 'token__jti')
+    self.filter = BloomFilter(self.capacity, self.error_rate)
+    self.last_id = 0
+    for row_id, jti in rows.iterator():
+      self.filter.add(jti)
+      self.last_id = max(self.last_id, row_id)
+    self.version = version
+    self.built_at = self.refreshed_at = now
+
+  def refresh(self, now):
+    version = self.cache.get(self.version_key, 0) if self.cache is not None else None
+    # Rows already read are skipped by the membership test, so they do not count towards the capacity again.
+    since = max(self.last_id - self.refresh_overlap, 0)
+    rows = BlacklistedToken.objects.filter(id__gt=since).values_list('id', 'token__jti')
+    for row_id, jti in rows.iterator():
+      if jti not in self.filter:
+        self.filter.add(jti)
+      self.last_id = max(self.last_id, row_id)
+    self.version = version
+    self.refreshed_at = now
+
+
+token_blacklist = TokenBlacklist.from_settings()
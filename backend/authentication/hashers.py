@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password, verify_password
+from django.utils.crypto import get_random_string
+
+logger = logging.getLogger(__name__)
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+  """
+  PBKDF2-SHA256 hasher whose iteration count comes from AUTH_PASSWORD_ITERATIONS, defaulting to Django's.
+  It keeps the pbkdf2_sha256 algorithm name, so existing hashes verify with it, and a hash with a different
+  iteration count reports must_update, which makes check_password store the password again at the configured
+  cost on the user's next successful login.
+  """
+  @property
+  def iterations(self):
+    return getattr(settings, 'AUTH_PASSWORD_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
+
+
+class VerificationTimer:
+  """
+  Moving average of how long password verification takes in this process.
+  A login for an unknown email waits that long instead of hashing, so it takes about as long as a wrong password
+  for a known email without spending the CPU. The first wait in a process times one real hash to seed the average.
+  """
+  def __init__(self, weight: float = 0.1):
+    self.weight = weight
+    self.average = None
+    self._lock = threading.Lock()
+
+  def record(self, duration: float):
+    with self._lock:
+      if self.average is None:
+        self.average = duration
+      else:
+        self.average += self.weight * (duration - self.average)
+
+  @contextmanager
+  def measure(self):
+    # Only a verification that finished is recorded, a block that raised, like a PasswordPoolOverloaded after the
+    # queue timeout, did not verify anything and would skew the average.
+    started = time.perf_counter()
+    yield
+    self.record(time.perf_counter() - started)
+
+  def wait(self):
+    if self.average is None:
+      with self.measure():
+        make_password(get_random_string(32))
+      return
+    time.sleep(self.average)
+
+
+verification_timer = VerificationTimer()
+
+
+class PasswordPoolOverloaded(Exception):
+  """
+  Raised when the password pool has no free slot within its queue timeout.
+  """
+  retry_after = 1
+
+
+def _setup_worker():
+  django.setup()
+
+
+class PasswordHashingPool:
+  """
+  Runs password hashing and verification in a bounded pool of worker processes, so PBKDF2 does not compete with
+  the request workers for CPU. At most `max_queue` operations are in flight, a caller waits up to `queue_timeout`
+  seconds for a slot and gets PasswordPoolOverloaded after that, which the views turn into a 503 response.
+  With `enabled` off the operations run inline in the calling thread.
+  """
+  def __init__(self, enabled: bool = False, workers: int = 2, max_queue: int = 32, queue_timeout: float = 0.5):
+    self.enabled = enabled
+    self.workers = workers
+    self.max_queue = max_queue
+    self.queue_timeout = queue_timeout
+    self.in_flight = 0
+    self.rejected = 0
+    self.completed = 0
+    self._slots = threading.BoundedSemaphore(max_queue)
+    self._lock = threading.Lock()
+    self._executor = None
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'AUTH_PASSWORD_POOL', {})
+    return cls(
+      enabled=options.get('ENABLED', False),
+      workers=options.get('WORKERS', 2),
+      max_queue=options.get('MAX_QUEUE', 32),
+      queue_timeout=options.get('QUEUE_TIMEOUT', 0.5),
+    )
+
+  @property
+  def executor(self):
+    if self._executor is None:
+      with self._lock:
+        if self._executor is None:
+          # Spawned rather than forked, forking a process that already runs request threads is unsafe.
+          self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_setup_worker,
+          )
+    return self._executor
+
+  def run(self, function, *args):
+    if not self.enabled:
+      return function(*args)
+    if not self._slots.acquire(timeout=self.queue_timeout):
+      with self._lock:
+        self.rejected += 1
+      logger.warning("Password pool overloaded with %s operations in flight.", self.in_flight)
+      raise PasswordPoolOverloaded()
+    with self._lock:
+      self.in_flight += 1
+    try:
+      return self.executor.submit(function, *args).result()
+    finally:
+      with self._lock:
+        self.in_flight -= 1
+        self.completed += 1
+      self._slots.release()
+
+  def stats(self) -> dict:
+    return {
+      'enabled': self.enabled,
+      'workers': self.workers,
+      'max_queue': self.max_queue,
+      'queue_depth': self.in_flight,
+      'rejected': self.rejected,
+      'completed': self.completed,
+    }
+
+  def shutdown(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False, cancel_futures=True)
+      self._executor = None
+
+
+password_pool = PasswordHashingPool.from_settings()
+
+def hash_password(raw_password: str) -> str:
+  """
+  Hashes a password with the preferred hasher through the password pool.
+  """
+  return password_pool.run(make_password, raw_password)
+
+def check_user_password(user, raw_password: str) -> bool:
+  """
+  Verifies a user's password through the password pool.
+  Like User.check_password, a correct password stored with an outdated hasher or cost is hashed again and saved.
+  """
+  is_correct, must_update = password_pool.run(verify_password, raw_password, user.password)
+  if is_correct and must_update:
+    user.password = hash_password(raw_password)
+    user.save(update_fields=['password'])
+  return is_correct
+
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.authentication import CachedJWTAuthentication
+from authentication.models import User
+from shortener.benchmarking import benchmark_databases, format_table, measure
+from shortener.models import ShortenedUrl
+from shortener.views import delete_url, get_user_urls, shorten_url
+
+class Command(BaseCommand):
+  """
+  Benchmarks authenticated shortener endpoints with simplejwt's JWTAuthentication, which loads the user row on
+  every request, against CachedJWTAuthentication, which builds the user from the token and the cached user state.
+  The views are called directly with throttling disabled, against a throwaway test database.
+  """
+  help = 'Compare latency and queries per request of database-backed and cached JWT authentication.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=50)
+
+  def handle(self, *args, **options):
+    factory = APIRequestFactory()
+    with benchmark_databases():
+      user = User.objects.create_user(email='benchmark@example.com', username='benchmark', password='benchmark-password')
+      ShortenedUrl.objects.bulk_get_or_create_for_user(
+        [f'https://example.com/{index}' for index in range(options['links'])], user.id
+      )
+      headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+      endpoints = {
+        'user-urls': (get_user_urls, lambda: factory.get('/shortener/user-urls/', **headers)),
+        'shorten-url': (shorten_url, lambda: factory.post(
+          '/shortener/shorten-url/', {'original_url': 'https://example.com/0'}, format='json', **headers
+        )),
+        'delete-url': (delete_url, lambda: factory.delete('/shortener/delete-url/missing/', **headers), 'missing'),
+      }
+
+      results = {}
+      for label, endpoint in endpoints.items():
+        view, build_request, *view_args = endpoint
+        default_classes = (view.cls.authentication_classes, view.cls.throttle_classes)
+        view.cls.throttle_classes = []
+        try:
+          for authentication_class in (JWTAuthentication, CachedJWTAuthentication):
+            view.cls.authentication_classes = [authentication_class]
+            results[f'{label} {authentication_class.__name__}'] = measure(
+              lambda index: view(build_request(), *view_args),
+              options['requests']
+            )
+        finally:
+          view.cls.authentication_classes, view.cls.throttle_classes = default_classes
+
+    self.stdout.write(format_table(results))
@@ -0,0 +1,62 @@
+import threading
+from django.core.management.base import BaseCommand
+from authentication.hashers import PasswordPoolOverloaded, hash_password, password_pool
+from shortener.benchmarking import benchmark_databases, format_table, measure, wsgi_get
+from shortener.clicks import click_aggregator
+from shortener.models import ShortenedUrl
+from shortener.ratelimit import rate_limiter
+
+class Command(BaseCommand):
+  """
+  Measures redirect latency while a signup storm hashes passwords in the same process, once with hashing inline
+  in the storm threads and once through the password pool, next to a baseline without a storm.
+  Redirects go through backend.wsgi.application against a throwaway test database.
+  """
+  help = 'Compare redirect latency during password hashing storms with and without the password pool.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--storm-threads', type=int, default=8)
+
+  def handle(self, *args, **options):
+    from backend.wsgi import application
+
+    click_aggregator.background = False
+    rate_limiter.enabled = False
+    with benchmark_databases():
+      links = ShortenedUrl.objects.bulk_get_or_create_for_user([f'https://example.com/{index}' for index in range(100)])
+      paths = ['/' + shortened_url.short_code for shortened_url, created in links]
+      redirect = lambda index: wsgi_get(application, paths[index % len(paths)])
+
+      results = {'no storm': measure(redirect, options['requests'])}
+      enabled = password_pool.enabled
+      try:
+        for label, use_pool in (('storm inline', False), ('storm pooled', True)):
+          password_pool.enabled = use_pool
+          stopped = threading.Event()
+          hashed = []
+          threads = [
+            threading.Thread(target=self.storm, args=(stopped, hashed), daemon=True)
+            for _ in range(options['storm_threads'])
+          ]
+          for thread in threads:
+            thread.start()
+          results[label] = measure(redirect, options['requests'])
+          stopped.set()
+          for thread in threads:
+            thread.join()
+          self.stdout.write(f'{label}: {len(hashed)} passwords hashed during the run.')
+      finally:
+        password_pool.enabled = enabled
+        password_pool.shutdown()
+      click_aggregator.flush()
+
+    self.stdout.write(format_table(results))
+    self.stdout.write(f'Password pool: {password_pool.stats()}')
+
+  def storm(self, stopped, hashed):
+    while not stopped.is_set():
+      try:
+        hashed.append(hash_password('storm-password'))
+      except PasswordPoolOverloaded:
+        pass
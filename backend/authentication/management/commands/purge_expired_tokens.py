@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+class Command(BaseCommand):
+  """
+  Deletes expired outstanding tokens and their blacklist entries in primary key batches, one transaction per batch,
+  so a large backlog never holds long locks on the token tables. Meant to run on a schedule, e.g. daily from cron.
+  An expired token fails verification on its own, so dropping its blacklist entry changes nothing.
+  """
+  help = 'Delete expired outstanding and blacklisted tokens in batches.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+
+  def handle(self, *args, **options):
+    now = timezone.now()
+    expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by('pk')
+    last_pk = 0
+    outstanding = blacklisted = 0
+    while True:
+      pks = list(expired.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+      if not pks:
+        break
+      last_pk = pks[-1]
+      with transaction.atomic():
+        blacklisted += BlacklistedToken.objects.filter(token_id__in=pks).delete()[0]
+        outstanding += OutstandingToken.objects.filter(pk__in=pks).delete()[0]
+      self.stdout.write(f'Purged up to id {last_pk}: {outstanding} outstanding, {blacklisted} blacklisted.')
+      if options['sleep']:
+        time.sleep(options['sleep'])
+    self.stdout.write(self.style.SUCCESS(f'Purged {outstanding} expired tokens and {blacklisted} blacklist entries.'))
@@ -1,5 +1,8 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
+from authentication.hashers import check_user_password, hash_password, verification_timer
 from authentication.models import User
+from authentication.tokens import RefreshToken
 
 class CustomUserSerializer(serializers.ModelSerializer):
   """
@@ -18,6 +21,7 @@ class RegisterSerializer(serializers.ModelSerializer):
   Serializer for user registration.
   It validates the email, username and password fields.
   It ensures that the password is at least 8 characters long and matches the confirmation password.
+  The password is hashed through the password pool.
   """
   password1 = serializers.CharField(write_only=True)
   password2 = serializers.CharField(write_only=True)
@@ -42,14 +46,19 @@ class RegisterSerializer(serializers.ModelSerializer):
   def create(self, validated_data):
     password = validated_data.pop('password1')
     validated_data.pop('password2')
-    user = User.objects.create_user(**validated_data, password=password)
+    user = User(**validated_data)
+    user.email = User.objects.normalize_email(user.email)
+    user.username = User.normalize_username(user.username)
+    user.password = hash_password(password)
+    user.save()
     return user
 
 class LoginSerializer(serializers.ModelSerializer):
   """
   Serializer for user login.
-  It validates the email and password fields.
-  It ensures that the email exists and the password is correct.
+  It validates the email and password fields with a single query for the user.
+  It returns the same error for an unknown email and a wrong password, and an unknown email waits about as long
+  as a password verification, so neither the response nor its timing tells whether the email is registered.
   It returns the user object if the credentials are valid.
   """
   class Meta:
@@ -66,14 +75,24 @@ class LoginSerializer(serializers.ModelSerializer):
     email = attrs.get('email')
     password = attrs.get('password')
 
-    if not User.objects.filter(email=email).exists():
-      raise serializers.ValidationError("Email does not exist.")
+    user = User.objects.filter(email=email).first()
 
-    user = User.objects.get(email=email)
+    if user is None:
+      verification_timer.wait()
+      raise serializers.ValidationError("Invalid email or password.")
 
-    if not user.check_password(password):
-      raise serializers.ValidationError("Incorrect password.")
+    with verification_timer.measure():
+      is_correct = check_user_password(user, password)
+
+    if not is_correct:
+      raise serializers.ValidationError("Invalid email or password.")
 
     attrs['user'] = user
     return attrs
 
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+  """
+  Serializer for refreshing tokens.
+  It checks and updates the blacklist through the RefreshToken with the cached blacklist lookup.
+  """
+  token_class = RefreshToken
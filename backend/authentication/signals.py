@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import user_state_cache
+from .models import User
+
+"""
+Drops the cached authentication state of a user when the user is saved or deleted,
+so deactivations and password changes apply to the next request served by this process.
+"""
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_state(sender, instance, **kwargs):
+  user_state_cache.delete(instance.pk)
@@ -1,3 +1,200 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+from shortener.ratelimit import rate_limiter
+from .authentication import user_state_cache
+from .blacklist import BloomFilter, TokenBlacklist, token_blacklist
+from .hashers import password_pool, verification_timer
+from .models import User
+from .tokens import RefreshToken
 
-# Create your tests here.
+class TokenRefreshTests(TestCase):
+  """
+  Refresh tokens are rotated, and a rotated token is refused even while the blacklist lookup has not caught up.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='user@example.com', username='user', password='password')
+
+  def setUp(self):
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def refresh(self, token):
+    return self.client.post(
+      '/authentication/token/refresh/', {'refresh': token}, content_type='application/json', secure=True
+    )
+
+  def test_rotated_token_cannot_be_reused(self):
+    token = str(RefreshToken.for_user(self.user))
+    response = self.refresh(token)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+    self.assertEqual(self.refresh(token).status_code, 401)
+
+  def test_rotated_token_is_refused_before_the_blacklist_syncs(self):
+    token = str(RefreshToken.for_user(self.user))
+    self.assertEqual(self.refresh(token).status_code, 200)
+    # A filter synced just now without the token, as in a process that has not seen the blacklisting yet.
+    token_blacklist.sync()
+    token_blacklist.filter = BloomFilter(token_blacklist.capacity, token_blacklist.error_rate)
+    token_blacklist.refreshed_at = time.monotonic()
+    self.addCleanup(setattr, token_blacklist, 'filter', None)
+
+    self.assertEqual(self.refresh(token).status_code, 401)
+
+  def test_refresh_picks_up_a_lower_id_committed_late(self):
+    earlier, later = (RefreshToken.for_user(self.user) for _ in range(2))
+    BlacklistedToken.objects.create(id=20, token=OutstandingToken.objects.get(jti=later['jti']))
+    blacklist = TokenBlacklist(refresh_overlap=10)
+    blacklist.filter = BloomFilter(blacklist.capacity, blacklist.error_rate)
+    blacklist.refresh(time.monotonic())
+    # A transaction that took id 15 before the sync but committed after it.
+    BlacklistedToken.objects.create(id=15, token=OutstandingToken.objects.get(jti=earlier['jti']))
+
+    blacklist.refresh(time.monotonic())
+
+    self.assertIn(earlier['jti'], blacklist.filter)
+    self.assertEqual(blacklist.filter.count, 2)
+    self.assertEqual(blacklist.last_id, 20)
+
+
+class AccessTokenTests(TestCase):
+  """
+  Access tokens are checked against the cached user state, so authenticated requests do not load the user row.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='user@example.com', username='user', password='password')
+
+  def setUp(self):
+    user_state_cache.delete(self.user.pk)
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def stats(self):
+    return self.client.get('/shortener/stats/', secure=True, **self.headers)
+
+  def test_user_row_is_only_read_when_its_state_is_not_cached(self):
+    self.assertEqual(self.stats().status_code, 200)
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.stats().status_code, 200)
+    self.assertFalse([query for query in queries if User._meta.db_table in query['sql']])
+
+    # Saving the user drops the cached state, so a deactivation applies to the next request.
+    self.user.is_active = False
+    self.user.save(update_fields=['is_active'])
+    self.assertEqual(self.stats().status_code, 401)
+
+
+class LoginTests(TestCase):
+  """
+  A login reads the user once, updates a hash stored at another cost, and fails the same way for an unknown email.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='user@example.com', username='user', password='password')
+
+  def setUp(self):
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def login(self, email, password):
+    return self.client.post(
+      '/authentication/login/', {'email': email, 'password': password}, content_type='application/json', secure=True
+    )
+
+  @override_settings(AUTH_PASSWORD_ITERATIONS=1000)
+  def test_login_reads_the_user_once_and_updates_the_hash_cost(self):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.login('user@example.com', 'password')
+    selects = [query for query in queries if query['sql'].startswith('SELECT') and User._meta.db_table in query['sql']]
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(len(selects), 1)
+    self.user.refresh_from_db()
+    self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+    self.assertEqual(self.login('user@example.com', 'password').status_code, 200)
+
+  def test_unknown_email_fails_like_a_wrong_password_without_hashing(self):
+    wrong_password = self.login('user@example.com', 'wrong')
+    with mock.patch.object(verification_timer, 'average', 0.001), \
+        mock.patch('authentication.serializers.check_user_password') as check_user_password:
+      unknown_email = self.login('nobody@example.com', 'password')
+    check_user_password.assert_not_called()
+    self.assertEqual(unknown_email.status_code, 400)
+    self.assertEqual(unknown_email.json(), wrong_password.json())
+
+
+class PasswordPoolTests(TestCase):
+  """
+  With the password pool enabled, hashing runs in its worker processes and a full pool is answered with a 503.
+  A login that finds the pool full leaves the verification timing alone.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='user@example.com', username='user', password='password')
+
+  def setUp(self):
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def login(self):
+    return self.client.post(
+      '/authentication/login/', {'email': 'user@example.com', 'password': 'password'},
+      content_type='application/json', secure=True,
+    )
+
+  def register(self, email):
+    return self.client.post('/authentication/register/', {
+      'email': email, 'username': email.split('@')[0], 'password1': 'password', 'password2': 'password'
+    }, content_type='application/json', secure=True)
+
+  def test_registration_hashes_in_the_pool_and_is_refused_when_it_is_full(self):
+    slots = threading.BoundedSemaphore(1)
+    for patcher in (
+      mock.patch.object(password_pool, 'enabled', True),
+      mock.patch.object(password_pool, 'workers', 1),
+      mock.patch.object(password_pool, 'queue_timeout', 0.01),
+      mock.patch.object(password_pool, '_slots', slots),
+      mock.patch.object(password_pool, 'rejected', 0),
+      mock.patch.object(password_pool, 'completed', 0),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.addCleanup(password_pool.shutdown)
+
+    self.assertEqual(self.register('pooled@example.com').status_code, 201)
+    self.assertIsNotNone(password_pool._executor)
+    self.assertTrue(User.objects.get(email='pooled@example.com').check_password('password'))
+    # Another request holds the only slot.
+    slots.acquire()
+    response = self.register('refused@example.com')
+    slots.release()
+
+    self.assertEqual(response.status_code, 503)
+    self.assertFalse(User.objects.filter(email='refused@example.com').exists())
+    self.assertEqual(
+      {key: password_pool.stats()[key] for key in ('queue_depth', 'rejected', 'completed')},
+      {'queue_depth': 0, 'rejected': 1, 'completed': 1}
+    )
+
+  def test_overloaded_pool_returns_503_without_recording_a_verification(self):
+    with mock.patch.object(verification_timer, 'average', 0.25), \
+        mock.patch.object(password_pool, 'enabled', True), \
+        mock.patch.object(password_pool, 'queue_timeout', 0), \
+        mock.patch.object(password_pool, '_slots', mock.Mock(**{'acquire.return_value': False})):
+      response = self.login()
+      self.assertEqual(verification_timer.average, 0.25)
+
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response['Retry-After'], '1')
@@ -0,0 +1,23 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from authentication.blacklist import token_blacklist
+
+class RefreshToken(BaseRefreshToken):
+  """
+  Refresh token that checks the blacklist through TokenBlacklist, so a token that was never blacklisted
+  is usually verified without a query.
+  The lookup can lag behind other processes by the blacklist's refresh interval, so blacklisting a token that another
+  request already blacklisted fails, which keeps a rotated refresh token from being used twice.
+  """
+  def check_blacklist(self):
+    if token_blacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+      raise TokenError(_("Token is blacklisted"))
+
+  def blacklist(self):
+    blacklisted_token, created = super().blacklist()
+    if not created:
+      raise TokenError(_("Token is blacklisted"))
+    token_blacklist.add(self.payload[api_settings.JTI_CLAIM])
+    return blacklisted_token, created
@@ -1,10 +1,12 @@
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from authentication.authentication import user_state_cache
+from authentication.hashers import PasswordPoolOverloaded
 from authentication.models import User
 from authentication.serializers import RegisterSerializer, LoginSerializer, CustomUserSerializer
+from authentication.tokens import RefreshToken
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,6 +18,7 @@ def register_view(request):
   Register view for creating a new user.
   It validates the data using the RegisterSerializer.
   If valid, it creates a new user.
+  If the password pool is overloaded, it returns a 503 status code.
   If invalid or an unexpected error occurs, it returns an appropriate status code.
   """
   try:
@@ -32,6 +35,12 @@ def register_view(request):
         {'errors': serializer.errors, 'message': 'Registration failed.'},
         status=status.HTTP_400_BAD_REQUEST
       )
+  except PasswordPoolOverloaded as error:
+    return Response(
+      {'error': 'The server is busy. Please try again shortly.', 'message': 'Registration failed.'},
+      status=status.HTTP_503_SERVICE_UNAVAILABLE,
+      headers={'Retry-After': str(error.retry_after)}
+    )
   except Exception as error:
     logger.exception("Unexpected error during registration.")
     return Response(
@@ -47,6 +56,7 @@ def login_view(request):
   Login view for authenticating a user.
   It validates the data using the LoginSerializer.
   If valid, it returns the user data along with tokens.
+  If the password pool is overloaded, it returns a 503 status code.
   If invalid or an unexpected error occurs, it returns an appropriate status code.
   """
   try:
@@ -70,6 +80,12 @@ def login_view(request):
         {'errors': serializer.errors, 'message': 'Login failed.'},
         status=status.HTTP_400_BAD_REQUEST
       )
+  except PasswordPoolOverloaded as error:
+    return Response(
+      {'error': 'The server is busy. Please try again shortly.', 'message': 'Login failed.'},
+      status=status.HTTP_503_SERVICE_UNAVAILABLE,
+      headers={'Retry-After': str(error.retry_after)}
+    )
   except Exception as error:
     logger.exception("Unexpected error during login.")
     return Response(
@@ -83,7 +99,7 @@ def login_view(request):
 def logout_view(request):
   """
   Logout view for logging out a user.
-  It blacklists the refresh token to prevent further access.
+  It blacklists the refresh token and revokes the access token of the request to prevent further access.
   It returns a 205 status code if successful.
   If invalid or an unexpected error occurs, it returns an appropriate status code.
   """
@@ -91,6 +107,8 @@ def logout_view(request):
     refresh_token = request.data['refresh']
     token = RefreshToken(refresh_token)
     token.blacklist()
+    if request.auth is not None:
+      user_state_cache.revoke(request.auth)
     return Response(
       {'message': 'Logout successful.'},
       status=status.HTTP_205_RESET_CONTENT
@@ -138,11 +156,11 @@ def get_user_view(request):
   """
   Get view for retrieving user information.
   It checks if the user is authenticated and has the required permissions.
-  It returns the user data.
+  It loads the full user row, which token authentication does not, and returns the user data.
   If invalid or an unexpected error occurs, it returns an appropriate status code.
   """
   try:
-    user = request.user
+    user = request.user.get_user()
     serializer = CustomUserSerializer(user)
     return Response(
       {'user': serializer.data, 'message': 'User retrieval successful.'},
@@ -4,4 +4,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from shortener.asgi import RedirectASGIApplication  # noqa: E402
+
+application = RedirectASGIApplication(django_application)
@@ -25,7 +25,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+  'shortener.instrumentation.InstrumentationMiddleware',
   'django.middleware.security.SecurityMiddleware',
+  'shortener.middleware.RedirectMiddleware',
   'corsheaders.middleware.CorsMiddleware',
   'django.contrib.sessions.middleware.SessionMiddleware',
   'django.middleware.common.CommonMiddleware',
@@ -58,9 +60,53 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database configuration
 
 DATABASES = {
-  'default': dj_database_url.config(conn_max_age=600)
+  'default': dj_database_url.config(conn_max_age=600, conn_health_checks=True)
 }
 
+# Connection pool settings (PostgreSQL with psycopg[pool] only, checked out connections are verified first, a request
+# waits at most DATABASE_POOL_TIMEOUT seconds for one, persistent connections are replaced by the pool)
+
+if (
+  os.environ.get('DATABASE_POOL_ENABLED', 'false').lower() == 'true'
+  and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+):
+  from psycopg_pool import ConnectionPool
+
+  DATABASES['default']['CONN_MAX_AGE'] = 0
+  DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+    'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', '2')),
+    'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', '10')),
+    'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', '10')),
+    'max_idle': float(os.environ.get('DATABASE_POOL_MAX_IDLE', '600')),
+    'max_lifetime': float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', '3600')),
+    'check': ConnectionPool.check_connection,
+  }
+
+# Read replica configuration (DATABASE_REPLICA_URLS is a comma separated list of database URLs, each added as a
+# replicaN alias that mirrors the default database in tests, and redirect and listing reads are routed to them)
+
+for index, replica_url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+  DATABASES[f'replica{index}'] = {
+    **dj_database_url.parse(replica_url.strip(), conn_max_age=600, conn_health_checks=True),
+    'TEST': {'MIRROR': 'default'},
+  }
+
+DATABASE_ROUTERS = ['shortener.replicas.ReplicaRouter'] if len(DATABASES) > 1 else []
+
+# Cache configuration
+
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+  },
+}
+
+if os.environ.get('REDIS_URL'):
+  CACHES['shared'] = {
+    'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    'LOCATION': os.environ['REDIS_URL'],
+  }
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -78,6 +124,28 @@ AUTH_PASSWORD_VALIDATORS = [
   },
 ]
 
+# Password hashing (AUTH_PASSWORD_ITERATIONS sets the PBKDF2 cost, hashes at another cost are updated on login)
+
+PASSWORD_HASHERS = [
+  'authentication.hashers.ConfigurablePBKDF2PasswordHasher',
+  'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+  'django.contrib.auth.hashers.Argon2PasswordHasher',
+  'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+  'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+AUTH_PASSWORD_ITERATIONS = int(os.environ['AUTH_PASSWORD_ITERATIONS']) if os.environ.get('AUTH_PASSWORD_ITERATIONS') else None
+
+# Password pool settings (hashing runs in WORKERS processes when enabled, beyond MAX_QUEUE operations callers
+# wait QUEUE_TIMEOUT seconds for a slot before getting a 503)
+
+AUTH_PASSWORD_POOL = {
+  'ENABLED': os.environ.get('AUTH_PASSWORD_POOL_ENABLED', 'false').lower() == 'true',
+  'WORKERS': int(os.environ.get('AUTH_PASSWORD_POOL_WORKERS', '2')),
+  'MAX_QUEUE': int(os.environ.get('AUTH_PASSWORD_POOL_MAX_QUEUE', '32')),
+  'QUEUE_TIMEOUT': float(os.environ.get('AUTH_PASSWORD_POOL_QUEUE_TIMEOUT', '0.5')),
+}
+
 # Internationalization
 
 LANGUAGE_CODE = 'en-us'
@@ -127,14 +195,32 @@ CSRF_TRUSTED_ORIGINS = os.environ.get(
 
 REST_FRAMEWORK = {
   'DEFAULT_AUTHENTICATION_CLASSES': [
-    'rest_framework_simplejwt.authentication.JWTAuthentication',
+    'authentication.authentication.CachedJWTAuthentication',
   ],
   'DEFAULT_THROTTLE_CLASSES': [
-    'rest_framework.throttling.UserRateThrottle',
+    'shortener.ratelimit.RateLimitThrottle',
   ],
-  'DEFAULT_THROTTLE_RATES': {
-    'user': '1000/day',
-  },
+}
+
+# Cached user state for JWT authentication (TTL bounds how long another process may accept a deactivated user)
+
+AUTH_USER_CACHE = {
+  'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+  'TTL': int(os.environ.get('AUTH_USER_CACHE_TTL', '30')),
+}
+
+# Refresh token blacklist lookups (with a shared CACHE_ALIAS every process syncs on each blacklist, without one
+# at most every REFRESH_INTERVAL seconds, 0 syncs on every lookup at the cost of a query, each sync reads the last
+# REFRESH_OVERLAP ids again to catch rows committed out of id order, run purge_expired_tokens on a schedule to keep
+# the tables bounded)
+
+AUTH_TOKEN_BLACKLIST = {
+  'CACHE_ALIAS': 'shared' if 'shared' in CACHES else None,
+  'CAPACITY': int(os.environ.get('AUTH_TOKEN_BLACKLIST_CAPACITY', '100000')),
+  'ERROR_RATE': 0.01,
+  'REFRESH_INTERVAL': int(os.environ.get('AUTH_TOKEN_BLACKLIST_REFRESH_INTERVAL', '5')),
+  'REBUILD_INTERVAL': 3600,
+  'REFRESH_OVERLAP': int(os.environ.get('AUTH_TOKEN_BLACKLIST_REFRESH_OVERLAP', '1000')),
 }
 
 # JWT settings
@@ -166,7 +252,7 @@ SIMPLE_JWT = {
   "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=30),
 
   "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-  "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+  "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.TokenRefreshSerializer",
   "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
   "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
   "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
@@ -184,6 +270,12 @@ LOGGING = {
       'class': 'logging.FileHandler',
       'filename': BASE_DIR / 'logs' / 'errors.log',
     },
+    'slow_requests': {
+      'level': 'WARNING',
+      'class': 'logging.FileHandler',
+      'filename': BASE_DIR / 'logs' / 'slow_requests.log',
+      'delay': True,
+    },
   },
   'loggers': {
     'django': {
@@ -191,6 +283,11 @@ LOGGING = {
       'level': 'ERROR',
       'propagate': True,
     },
+    'shortener.instrumentation': {
+      'handlers': ['slow_requests'],
+      'level': 'WARNING',
+      'propagate': False,
+    },
   },
 }
 
@@ -198,6 +295,122 @@ LOGGING = {
 
 DEFAULT_DOMAIN = os.getenv('DEFAULT_DOMAIN', 'http://127.0.0.1:8000')
 
+# Redirect cache settings (SHARED_ALIAS must name an entry in CACHES, the PINNED_SIZE hottest of the HOT_CAPACITY
+# tracked codes are pinned in memory by a background thread every PIN_INTERVAL seconds, a PINNED_SIZE of 0 disables
+# pinning, unknown codes are remembered for NEGATIVE_TTL seconds)
+
+SHORTENER_URL_CACHE = {
+  'LOCAL_MAX_SIZE': int(os.environ.get('SHORTENER_CACHE_LOCAL_MAX_SIZE', '10000')),
+  'LOCAL_TTL': int(os.environ.get('SHORTENER_CACHE_LOCAL_TTL', '60')),
+  'SHARED_ALIAS': 'shared' if 'shared' in CACHES else None,
+  'SHARED_TTL': int(os.environ.get('SHORTENER_CACHE_SHARED_TTL', '3600')),
+  'HOT_CAPACITY': int(os.environ.get('SHORTENER_CACHE_HOT_CAPACITY', '1000')),
+  'PINNED_SIZE': int(os.environ.get('SHORTENER_CACHE_PINNED_SIZE', '100')),
+  'PIN_INTERVAL': int(os.environ.get('SHORTENER_CACHE_PIN_INTERVAL', '30')),
+  'NEGATIVE_MAX_SIZE': int(os.environ.get('SHORTENER_CACHE_NEGATIVE_MAX_SIZE', '100000')),
+  'NEGATIVE_TTL': int(os.environ.get('SHORTENER_CACHE_NEGATIVE_TTL', '30')),
+}
+
+# Click counting settings (BACKEND is 'local' or 'cache', CACHE_ALIAS names an entry in CACHES)
+
+SHORTENER_CLICKS = {
+  'BACKEND': 'cache' if 'shared' in CACHES else 'local',
+  'CACHE_ALIAS': 'shared',
+  'FLUSH_INTERVAL': int(os.environ.get('SHORTENER_CLICKS_FLUSH_INTERVAL', '5')),
+  'MAX_PENDING': int(os.environ.get('SHORTENER_CLICKS_MAX_PENDING', '1000')),
+}
+
+# Click analytics settings (COUNTRY_HEADERS are request headers set by the CDN or proxy, checked in order)
+
+SHORTENER_ANALYTICS = {
+  'ENABLED': os.environ.get('SHORTENER_ANALYTICS_ENABLED', 'true').lower() == 'true',
+  'COUNTRY_HEADERS': ['CF-IPCountry', 'X-Country-Code'],
+  'MAX_BUFFERED_EVENTS': int(os.environ.get('SHORTENER_ANALYTICS_MAX_BUFFERED_EVENTS', '100000')),
+}
+
+# Short code allocation settings (STRATEGY is 'random', 'sequence' or 'block')
+
+SHORTENER_CODE_ALLOCATOR = {
+  'STRATEGY': os.environ.get('SHORTENER_CODE_ALLOCATOR', 'random'),
+  'BLOCK_SIZE': int(os.environ['SHORTENER_CODE_BLOCK_SIZE']) if os.environ.get('SHORTENER_CODE_BLOCK_SIZE') else None,
+  'MAX_ATTEMPTS': int(os.environ.get('SHORTENER_CODE_MAX_ATTEMPTS', '5')),
+}
+
+# Link expiration settings (links without a user expire ANONYMOUS_TTL seconds after creation, 0 disables it)
+# Code recycling is opt-in: a recycled code redirects to someone else's URL, so anyone still following the purged link
+# lands there. Codes freed by purge_expired_urls are quarantined for RECYCLE_AFTER seconds (a year by default) before
+# the allocator hands them out again, set it longer than old links are expected to keep circulating.
+
+SHORTENER_EXPIRATION = {
+  'ANONYMOUS_TTL': int(os.environ.get('SHORTENER_ANONYMOUS_TTL', str(90 * 24 * 3600))),
+  'RECYCLE_CODES': os.environ.get('SHORTENER_RECYCLE_CODES', 'false').lower() == 'true',
+  'RECYCLE_AFTER': int(os.environ.get('SHORTENER_RECYCLE_AFTER', str(365 * 24 * 3600))),
+  'RECYCLE_BLOCK_SIZE': int(os.environ.get('SHORTENER_RECYCLE_BLOCK_SIZE', '100')),
+}
+
+# Redirect settings (a permanent redirect is cached by browsers, which then skip click counting)
+
+SHORTENER_LEAN_REDIRECT = os.environ.get('SHORTENER_LEAN_REDIRECT', 'true').lower() == 'true'
+SHORTENER_REDIRECT_PERMANENT = os.environ.get('SHORTENER_REDIRECT_PERMANENT', 'false').lower() == 'true'
+
+# URL canonicalization settings (equivalent URLs share one digest, rerun backfill_url_hashes --rehash after changing them)
+
+SHORTENER_CANONICALIZATION = {
+  'STRIP_TRAILING_SLASH': os.environ.get('SHORTENER_CANONICAL_STRIP_TRAILING_SLASH', 'true').lower() == 'true',
+  'SORT_QUERY': os.environ.get('SHORTENER_CANONICAL_SORT_QUERY', 'true').lower() == 'true',
+  'DROP_FRAGMENT': os.environ.get('SHORTENER_CANONICAL_DROP_FRAGMENT', 'false').lower() == 'true',
+  'STRIP_PARAMS': ['fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'yclid'],
+  'STRIP_PARAM_PREFIXES': ['utm_'],
+}
+
+# Rate limiting settings (sliding windows per client and scope, BACKEND is 'local' or 'cache', RATES are
+# requests per s/m/h/d, IP_HEADER names the proxy header holding the client address)
+# Behind a proxy or load balancer IP_HEADER is required, otherwise every visitor shares the proxy's REMOTE_ADDR bucket,
+# so limits are only on by default once it is set, and enabling them without it is reported by shortener.W001.
+# TRUSTED_PROXIES is the number of proxies appending to that header, the client address is read that many entries from
+# the right since everything to its left is sent by the client.
+
+SHORTENER_RATE_LIMITS = {
+  'ENABLED': os.environ.get(
+    'SHORTENER_RATE_LIMITS_ENABLED', 'true' if os.environ.get('SHORTENER_RATE_LIMIT_IP_HEADER') else 'false'
+  ).lower() == 'true',
+  'BACKEND': 'cache' if 'shared' in CACHES else 'local',
+  'CACHE_ALIAS': 'shared',
+  'IP_HEADER': os.environ.get('SHORTENER_RATE_LIMIT_IP_HEADER') or None,
+  'TRUSTED_PROXIES': int(os.environ.get('SHORTENER_RATE_LIMIT_TRUSTED_PROXIES', '1')),
+  'RATES': {
+    'redirect': os.environ.get('SHORTENER_RATE_LIMIT_REDIRECT', '600/m'),
+    'shorten': os.environ.get('SHORTENER_RATE_LIMIT_SHORTEN', '60/m'),
+    'api': os.environ.get('SHORTENER_RATE_LIMIT_API', '1000/d'),
+  },
+}
+
+# Maximum number of URLs accepted by the bulk shorten endpoint
+
+SHORTENER_BULK_MAX_URLS = int(os.environ.get('SHORTENER_BULK_MAX_URLS', '10000'))
+
+# Request instrumentation settings (off by default, METRICS_PATH serves Prometheus metrics to requests with
+# METRICS_TOKEN as a bearer token and is not served without one, a SAMPLE_RATE share of requests keeps its SQL and is
+# logged to logs/slow_requests.log when slower than SLOW_REQUEST_MS)
+
+SHORTENER_INSTRUMENTATION = {
+  'ENABLED': os.environ.get('SHORTENER_INSTRUMENTATION_ENABLED', 'false').lower() == 'true',
+  'METRICS_PATH': os.environ.get('SHORTENER_METRICS_PATH', '/metrics'),
+  'METRICS_TOKEN': os.environ.get('SHORTENER_METRICS_TOKEN') or None,
+  'SLOW_REQUEST_MS': int(os.environ.get('SHORTENER_SLOW_REQUEST_MS', '500')),
+  'SAMPLE_RATE': float(os.environ.get('SHORTENER_INSTRUMENTATION_SAMPLE_RATE', '0.1')),
+}
+
+# Read replica settings (replicas more than MAX_LAG seconds behind are skipped until a check every CHECK_INTERVAL
+# seconds finds them caught up, users who wrote links read from the primary for STICKY_SECONDS)
+
+SHORTENER_REPLICAS = {
+  'MAX_LAG': float(os.environ.get('SHORTENER_REPLICA_MAX_LAG', '5')),
+  'CHECK_INTERVAL': float(os.environ.get('SHORTENER_REPLICA_CHECK_INTERVAL', '5')),
+  'STICKY_SECONDS': int(os.environ.get('SHORTENER_REPLICA_STICKY_SECONDS', '10')),
+  'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+
 # Security settings
 
 SECURE_HSTS_SECONDS = 31536000  # 1 year
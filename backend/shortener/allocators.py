@@ -0,0 +1,226 @@
+import random
+import string
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+CODE_ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 6
+# Matches the max_length of ShortenedUrl.short_code.
+MAX_CODE_LENGTH = 10
+BASE = len(CODE_ALPHABET)
+
+# Odd and not a multiple of 31, so it is coprime with every power of 62 and
+# multiplying by it permutes each fixed-width code space.
+SCRAMBLE_MULTIPLIER = 25214903917
+SCRAMBLE_OFFSET = 11
+
+def encode_base62(number: int, width: int) -> str:
+  """
+  Encodes a non-negative integer as a zero-padded base62 string of the given width.
+  """
+  chars = []
+  for _ in range(width):
+    number, remainder = divmod(number, BASE)
+    chars.append(CODE_ALPHABET[remainder])
+  return ''.join(reversed(chars))
+
+def is_valid_short_code(code: str) -> bool:
+  """
+  Checks that a string could be a code produced by any allocator: CODE_LENGTH to MAX_CODE_LENGTH characters of the code alphabet.
+  """
+  return CODE_LENGTH <= len(code) <= MAX_CODE_LENGTH and code.isascii() and code.isalnum()
+
+def sequence_to_code(value: int) -> str:
+  """
+  Maps a sequence value to a short code, bijectively.
+  The first 62^6 values fill the 6 character space in scrambled order, the next 62^7 the 7 character space, and so on.
+  """
+  width = CODE_LENGTH
+  space = BASE ** width
+  while value >= space:
+    value -= space
+    width += 1
+    space = BASE ** width
+  return encode_base62((value * SCRAMBLE_MULTIPLIER + SCRAMBLE_OFFSET) % space, width)
+
+
+class CodeAllocator:
+  """
+  Base class for short code allocation strategies.
+  The model inserts with the allocated code and relies on the unique constraint on short_code,
+  retrying with a fresh code on IntegrityError up to `max_attempts` times.
+  """
+  def __init__(self, max_attempts: int = 5, **kwargs):
+    self.max_attempts = max_attempts
+
+  def allocate(self) -> str:
+    raise NotImplementedError
+
+  def allocate_many(self, count: int) -> list:
+    return [self.allocate() for _ in range(count)]
+
+
+class RandomCodeAllocator(CodeAllocator):
+  """
+  Draws 6 random characters from the code alphabet.
+  Throughput: no query besides the INSERT itself and no shared state, so it scales with the database.
+  Collisions: a new code collides with probability (existing codes / 62^6), and each collision costs one failed INSERT and a retry.
+  """
+  def allocate(self) -> str:
+    return ''.join(random.choices(CODE_ALPHABET, k=CODE_LENGTH))
+
+
+class SequenceCodeAllocator(CodeAllocator):
+  """
+  Encodes values of a database-backed sequence with bijective base62.
+  Throughput: one UPDATE and one SELECT on the sequence row per lease of `block_size` values (one per create here).
+  Collisions: none between sequence codes. A sequence code can only collide with a code that was created by another strategy,
+  which is retried like any other collision.
+  """
+  block_size = 1
+  sequence_name = 'short_code'
+
+  def __init__(self, block_size: int = None, **kwargs):
+    super().__init__(**kwargs)
+    if block_size is not None:
+      self.block_size = block_size
+    self._next = 0
+    self._end = 0
+    self._lock = threading.Lock()
+
+  def lease(self, count: int) -> range:
+    """
+    Reserves `count` consecutive sequence values and returns them as a range.
+    """
+    from .models import CodeSequence
+
+    with transaction.atomic():
+      updated = CodeSequence.objects.filter(name=self.sequence_name).update(value=F('value') + count)
+      if not updated:
+        CodeSequence.objects.get_or_create(name=self.sequence_name)
+        CodeSequence.objects.filter(name=self.sequence_name).update(value=F('value') + count)
+      end = CodeSequence.objects.values_list('value', flat=True).get(name=self.sequence_name)
+    return range(end - count, end)
+
+  def allocate(self) -> str:
+    with self._lock:
+      if self._next >= self._end:
+        values = self.lease(self.block_size)
+        self._next, self._end = values.start, values.stop
+      value = self._next
+      self._next += 1
+    return sequence_to_code(value)
+
+  def allocate_many(self, count: int) -> list:
+    with self._lock:
+      available = self._end - self._next
+      values = list(range(self._next, self._next + min(available, count)))
+      self._next += len(values)
+      if len(values) < count:
+        values.extend(self.lease(count - len(values)))
+    return [sequence_to_code(value) for value in values]
+
+
+class BlockLeaseCodeAllocator(SequenceCodeAllocator):
+  """
+  Leases blocks of sequence values per worker and hands codes out from memory.
+  Throughput: one lease query per `block_size` creates, so allocation is effectively free.
+  Collisions: same as the sequence strategy. Values left in a block when a worker stops are skipped, never reused.
+  """
+  block_size = 1000
+
+
+class RecyclingCodeAllocator(CodeAllocator):
+  """
+  Hands out the codes of purged links once they have been free for `recycle_after` seconds, and codes of the wrapped
+  allocator when none are ready.
+  A recycled code sends whoever still has the purged link to the new link's URL, so the quarantine has to outlast the
+  old links in circulation. It is only used when SHORTENER_EXPIRATION['RECYCLE_CODES'] is set.
+  Throughput: free codes are claimed in blocks of `block_size` per worker with one SELECT and one DELETE, and an empty
+  pool is checked again only after `retry_interval` seconds, so most creates cost no extra query.
+  Collisions: a claimed code is removed from the pool, so two workers never claim the same one. It can still collide
+  with a random code drawn while it was free, which is retried like any other collision.
+  Claimed codes left in memory when a worker stops are not reused.
+  """
+  def __init__(self, allocator: CodeAllocator, recycle_after: float = 31536000, block_size: int = 100,
+               retry_interval: float = 60, **kwargs):
+    super().__init__(max_attempts=allocator.max_attempts)
+    self.allocator = allocator
+    self.recycle_after = recycle_after
+    self.block_size = block_size
+    self.retry_interval = retry_interval
+    self._codes = []
+    self._retry_at = 0
+    self._lock = threading.Lock()
+
+  def claim(self, count: int) -> list:
+    """
+    Removes up to `count` codes that have been free long enough from the pool and returns them, oldest first.
+    Rows locked by a concurrent claim are skipped on databases that support it.
+    """
+    from .models import FreeShortCode
+
+    cutoff = timezone.now() - timedelta(seconds=self.recycle_after)
+    with transaction.atomic():
+      rows = list(
+        FreeShortCode.objects.select_for_update(skip_locked=True).filter(freed_at__lte=cutoff)
+        .order_by('freed_at').values_list('pk', 'code')[:count]
+      )
+      FreeShortCode.objects.filter(pk__in=[pk for pk, code in rows]).delete()
+    return [code for pk, code in rows]
+
+  def allocate(self) -> str:
+    return self.allocate_many(1)[0]
+
+  def allocate_many(self, count: int) -> list:
+    with self._lock:
+      if len(self._codes) < count and time.monotonic() >= self._retry_at:
+        claimed = self.claim(max(self.block_size, count - len(self._codes)))
+        self._codes.extend(claimed)
+        if len(claimed) < self.block_size:
+          self._retry_at = time.monotonic() + self.retry_interval
+      codes = self._codes[:count]
+      del self._codes[:count]
+    if len(codes) < count:
+      codes.extend(self.allocator.allocate_many(count - len(codes)))
+    return codes
+
+
+ALLOCATORS = {
+  'random': 'shortener.allocators.RandomCodeAllocator',
+  'sequence': 'shortener.allocators.SequenceCodeAllocator',
+  'block': 'shortener.allocators.BlockLeaseCodeAllocator',
+}
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+def get_code_allocator() -> CodeAllocator:
+  """
+  Returns the allocator selected by SHORTENER_CODE_ALLOCATOR, creating it on first use.
+  STRATEGY is one of the ALLOCATORS names or a dotted path to a CodeAllocator subclass.
+  With SHORTENER_EXPIRATION['RECYCLE_CODES'] it is wrapped in a RecyclingCodeAllocator.
+  """
+  global _allocator
+  if _allocator is None:
+    with _allocator_lock:
+      if _allocator is None:
+        options = dict(getattr(settings, 'SHORTENER_CODE_ALLOCATOR', {}))
+        strategy = options.pop('STRATEGY', 'random')
+        allocator_class = import_string(ALLOCATORS.get(strategy, strategy))
+        allocator = allocator_class(**{key.lower(): value for key, value in options.items()})
+        expiration = getattr(settings, 'SHORTENER_EXPIRATION', {})
+        if expiration.get('RECYCLE_CODES', False):
+          allocator = RecyclingCodeAllocator(
+            allocator,
+            recycle_after=expiration.get('RECYCLE_AFTER', 31536000),
+            block_size=expiration.get('RECYCLE_BLOCK_SIZE', 100),
+          )
+        _allocator = allocator
+  return _allocator
@@ -0,0 +1,173 @@
+import threading
+from collections import Counter, defaultdict, deque, namedtuple
+from datetime import timezone as dt_timezone
+from functools import reduce
+from operator import or_
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import ClickEvent, DailyClickRollup, HourlyClickRollup, ShortenedUrl
+
+Click = namedtuple('Click', ['short_code', 'clicked_at', 'referrer', 'user_agent', 'country'])
+
+ROLLUP_CHUNK_SIZE = 200
+BOT_MARKERS = ('bot', 'crawl', 'spider', 'slurp', 'preview', 'curl', 'wget', 'python-requests', 'httpclient')
+TABLET_MARKERS = ('ipad', 'tablet', 'kindle', 'silk')
+MOBILE_MARKERS = ('mobi', 'iphone', 'android', 'windows phone')
+DESKTOP_MARKERS = ('windows', 'macintosh', 'x11', 'linux', 'cros')
+
+def analytics_options() -> dict:
+  return getattr(settings, 'SHORTENER_ANALYTICS', {})
+
+def country_headers() -> list:
+  return [header.lower() for header in analytics_options().get('COUNTRY_HEADERS', [])]
+
+def click_from_request(short_code: str, request) -> Click:
+  """
+  Captures the raw click attributes of a Django request. Parsing is left to the flush.
+  """
+  meta = request.META
+  country = ''
+  for header in country_headers():
+    country = meta.get('HTTP_' + header.upper().replace('-', '_'), '')
+    if country:
+      break
+  return Click(short_code, timezone.now(), meta.get('HTTP_REFERER', ''), meta.get('HTTP_USER_AGENT', ''), country)
+
+def click_from_scope(short_code: str, scope) -> Click:
+  """
+  Captures the raw click attributes of an ASGI HTTP scope. Parsing is left to the flush.
+  """
+  headers = dict(scope.get('headers', ()))
+  country = ''
+  for header in country_headers():
+    country = headers.get(header.encode(), b'').decode('latin-1')
+    if country:
+      break
+  return Click(
+    short_code,
+    timezone.now(),
+    headers.get(b'referer', b'').decode('latin-1'),
+    headers.get(b'user-agent', b'').decode('latin-1'),
+    country,
+  )
+
+def classify_user_agent(user_agent: str) -> str:
+  user_agent = user_agent.lower()
+  if not user_agent:
+    return 'other'
+  if any(marker in user_agent for marker in BOT_MARKERS):
+    return 'bot'
+  if any(marker in user_agent for marker in TABLET_MARKERS):
+    return 'tablet'
+  if any(marker in user_agent for marker in MOBILE_MARKERS):
+    return 'mobile'
+  if any(marker in user_agent for marker in DESKTOP_MARKERS):
+    return 'desktop'
+  return 'other'
+
+def referrer_host(referrer: str) -> str:
+  try:
+    return (urlsplit(referrer).hostname or '')[:255]
+  except ValueError:
+    return ''
+
+def normalize_country(country: str) -> str:
+  country = country.strip().upper()
+  return country if len(country) == 2 and country.isalpha() else ''
+
+
+class ClickEventBuffer:
+  """
+  Append-only, bounded in-process buffer of click events.
+  Once `max_events` are waiting, the oldest events are dropped and counted in `dropped`,
+  so a stalled database cannot exhaust memory. Click counts are buffered separately and never dropped.
+  """
+  def __init__(self, max_events: int = 100000):
+    self._events = deque(maxlen=max_events)
+    self._lock = threading.Lock()
+    self.dropped = 0
+
+  def append(self, click: Click):
+    with self._lock:
+      if len(self._events) == self._events.maxlen:
+        self.dropped += 1
+      self._events.append(click)
+
+  def drain(self) -> list:
+    with self._lock:
+      events = list(self._events)
+      self._events.clear()
+    return events
+
+  def __len__(self):
+    return len(self._events)
+
+
+def bucket_start(clicked_at, granularity: str):
+  clicked_at = clicked_at.astimezone(dt_timezone.utc)
+  if granularity == 'day':
+    return clicked_at.replace(hour=0, minute=0, second=0, microsecond=0)
+  return clicked_at.replace(minute=0, second=0, microsecond=0)
+
+def increment_rollups(model, counts: dict):
+  """
+  Adds {(shortened_url_id, bucket): clicks} to a rollup table.
+  Missing rows are created with one ignore-conflicts INSERT, then rows that received the same
+  number of clicks are incremented together with one UPDATE per chunk.
+  """
+  model.objects.bulk_create(
+    [model(shortened_url_id=link_id, bucket=bucket) for link_id, bucket in counts],
+    ignore_conflicts=True,
+  )
+  by_increment = defaultdict(list)
+  for key, clicks in counts.items():
+    by_increment[clicks].append(key)
+  for clicks, keys in by_increment.items():
+    for start in range(0, len(keys), ROLLUP_CHUNK_SIZE):
+      condition = reduce(or_, (
+        Q(shortened_url_id=link_id, bucket=bucket) for link_id, bucket in keys[start:start + ROLLUP_CHUNK_SIZE]
+      ))
+      model.objects.filter(condition).update(clicks=F('clicks') + clicks)
+
+def write_click_events(clicks: list) -> int:
+  """
+  Writes buffered clicks as ClickEvent rows with bulk_create and folds them into the hourly and daily rollups.
+  Clicks for codes that no longer exist are discarded. Returns the number of events written.
+  """
+  if not clicks:
+    return 0
+  link_ids = dict(
+    ShortenedUrl.objects.filter(short_code__in={click.short_code for click in clicks}).values_list('short_code', 'id')
+  )
+  events = [
+    ClickEvent(
+      shortened_url_id=link_ids[click.short_code],
+      clicked_at=click.clicked_at,
+      referrer=referrer_host(click.referrer),
+      agent_class=classify_user_agent(click.user_agent),
+      country=normalize_country(click.country),
+    )
+    for click in clicks if click.short_code in link_ids
+  ]
+  hourly = Counter((event.shortened_url_id, bucket_start(event.clicked_at, 'hour')) for event in events)
+  daily = Counter((event.shortened_url_id, bucket_start(event.clicked_at, 'day')) for event in events)
+  with transaction.atomic():
+    ClickEvent.objects.bulk_create(events, batch_size=1000)
+    increment_rollups(HourlyClickRollup, hourly)
+    increment_rollups(DailyClickRollup, daily)
+  return len(events)
+
+def click_series(shortened_url, granularity: str = 'day', since=None, until=None) -> list:
+  """
+  Returns [(bucket, clicks)] for a shortened URL from the hourly or daily rollup table, oldest first.
+  """
+  model = DailyClickRollup if granularity == 'day' else HourlyClickRollup
+  rollups = model.objects.filter(shortened_url=shortened_url)
+  if since is not None:
+    rollups = rollups.filter(bucket__gte=since)
+  if until is not None:
+    rollups = rollups.filter(bucket__lt=until)
+  return list(rollups.order_by('bucket').values_list('bucket', 'clicks'))
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from django.utils.encoding import iri_to_uri
+from .analytics import click_from_scope
+from .cache import url_cache
+from .clicks import click_aggregator
+from .instrumentation import served_metrics_path
+from .middleware import SHORT_CODE_PATH
+from .ratelimit import rate_limiter
+
+class RedirectASGIApplication:
+  """
+  ASGI application that answers redirects for cached short codes before Django's request handling runs.
+  A hit costs a cache lookup and a buffered click on the event loop, with no request object, no signals
+  and no thread hop. Shared cache calls go through AsyncCache, on redis.asyncio for Redis and in the default executor
+  for other sync backends, instead of all waiting on the one thread Django would use outside a request.
+  Everything else, including cache misses and plain HTTP requests that SecurityMiddleware has to upgrade, is passed
+  to the wrapped Django application, where RedirectMiddleware loads the code.
+  The security headers SecurityMiddleware would add are added here as well, HSTS only on HTTPS as it does.
+  Requests for a host outside ALLOWED_HOSTS are passed to Django, which rejects them.
+  Redirect rate limits are enforced here too, a limited client gets a 429 without any lookup.
+  The metrics path looks like a short code, so it is passed to Django before any matching or rate limiting.
+  """
+  def __init__(self, application):
+    self.application = application
+    self.enabled = getattr(settings, 'SHORTENER_LEAN_REDIRECT', True)
+    self.status = 301 if getattr(settings, 'SHORTENER_REDIRECT_PERMANENT', False) else 302
+    self.headers = self.security_headers()
+    self.hsts_headers = self.hsts_header()
+    self.metrics_path = served_metrics_path()
+    self.allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not self.allowed_hosts:
+      self.allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+
+  def hsts_header(self):
+    if not settings.SECURE_HSTS_SECONDS:
+      return []
+    hsts = f'max-age={settings.SECURE_HSTS_SECONDS}'
+    if settings.SECURE_HSTS_INCLUDE_SUBDOMAINS:
+      hsts += '; includeSubDomains'
+    if settings.SECURE_HSTS_PRELOAD:
+      hsts += '; preload'
+    return [(b'strict-transport-security', hsts.encode())]
+
+  def security_headers(self):
+    headers = [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', b'0')]
+    if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+      headers.append((b'x-content-type-options', b'nosniff'))
+    if settings.SECURE_REFERRER_POLICY:
+      policy = settings.SECURE_REFERRER_POLICY
+      policy = policy if isinstance(policy, str) else ','.join(policy)
+      headers.append((b'referrer-policy', policy.encode()))
+    if settings.SECURE_CROSS_ORIGIN_OPENER_POLICY:
+      headers.append((b'cross-origin-opener-policy', settings.SECURE_CROSS_ORIGIN_OPENER_POLICY.encode()))
+    return headers
+
+  def response_headers(self, scope):
+    return self.headers + self.hsts_headers if scope.get('scheme') == 'https' else self.headers
+
+  def host_allowed(self, scope) -> bool:
+    """
+    Checks the request's host against ALLOWED_HOSTS the way HttpRequest.get_host() does.
+    """
+    headers = dict(scope.get('headers', ()))
+    host = headers.get(b'x-forwarded-host') if settings.USE_X_FORWARDED_HOST else None
+    host = (host or headers.get(b'host', b'')).decode('latin-1')
+    if not host and scope.get('server'):
+      server_host, server_port = scope['server']
+      host = f'{server_host}:{server_port}'
+    domain, port = split_domain_port(host)
+    return bool(domain) and validate_host(domain, self.allowed_hosts)
+
+  async def __call__(self, scope, receive, send):
+    if (
+      self.enabled
+      and scope['type'] == 'http'
+      and scope['method'] in ('GET', 'HEAD')
+      and (scope.get('scheme') == 'https' or not settings.SECURE_SSL_REDIRECT)
+      and scope['path'] != self.metrics_path
+    ):
+      match = SHORT_CODE_PATH.match(scope['path'])
+      if match is not None and self.host_allowed(scope):
+        retry_after = await rate_limiter.ahit('redirect', rate_limiter.scope_client_ip(scope))
+        if retry_after:
+          await self.send_rate_limited(scope, send, retry_after)
+          return
+        original_url = await url_cache.aget(match.group(1))
+        if original_url is not None:
+          await click_aggregator.arecord(match.group(1), event=click_from_scope(match.group(1), scope))
+          await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': self.response_headers(scope) + [(b'location', iri_to_uri(original_url).encode())],
+          })
+          await send({'type': 'http.response.body', 'body': b''})
+          return
+    await self.application(scope, receive, send)
+
+  async def send_rate_limited(self, scope, send, retry_after):
+    body = b'{"error": "Too many requests"}'
+    await send({
+      'type': 'http.response.start',
+      'status': 429,
+      'headers': self.response_headers(scope)[2:] + [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        (b'retry-after', str(retry_after).encode()),
+      ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,113 @@
+import asyncio
+import weakref
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.db import BaseDatabaseCache
+from django.core.cache.backends.redis import RedisCache
+
+# redis.asyncio clients per event loop and server URL, a client's connections belong to the loop that opened them.
+_redis_clients = weakref.WeakKeyDictionary()
+
+def redis_client(url: str, max_connections: int):
+  """
+  Returns the redis.asyncio client for `url` on the running loop. Its pool holds at most `max_connections`
+  connections, and callers wait for a free one rather than failing once they are all in use.
+  """
+  import redis.asyncio
+
+  clients = _redis_clients.setdefault(asyncio.get_running_loop(), {})
+  if url not in clients:
+    pool = redis.asyncio.BlockingConnectionPool.from_url(url, max_connections=max_connections)
+    clients[url] = redis.asyncio.Redis(connection_pool=pool)
+  return clients[url]
+
+
+class AsyncRedisCacheClient:
+  """
+  The operations of Django's RedisCacheClient on redis.asyncio, reading and writing the same keys and values, so
+  the async callers share entries with the sync ones.
+  """
+  def __init__(self, cache: RedisCache):
+    self.cache = cache
+    self.url = cache._servers[0]
+    self.serializer = cache._cache._serializer
+    self.max_connections = cache._options.get('max_connections') or 50
+
+  @property
+  def client(self):
+    return redis_client(self.url, self.max_connections)
+
+  def key(self, key):
+    return self.cache.make_and_validate_key(key)
+
+  async def aget(self, key, default=None):
+    value = await self.client.get(self.key(key))
+    return default if value is None else self.serializer.loads(value)
+
+  async def aset(self, key, value, timeout=DEFAULT_TIMEOUT):
+    client, key, timeout = self.client, self.key(key), self.cache.get_backend_timeout(timeout)
+    if timeout == 0:
+      await client.delete(key)
+    else:
+      await client.set(key, self.serializer.dumps(value), ex=timeout)
+
+  async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT):
+    client, key, timeout = self.client, self.key(key), self.cache.get_backend_timeout(timeout)
+    if timeout == 0:
+      added = bool(await client.set(key, self.serializer.dumps(value), nx=True))
+      if added:
+        await client.delete(key)
+      return added
+    return bool(await client.set(key, self.serializer.dumps(value), ex=timeout, nx=True))
+
+  async def adelete(self, key):
+    return bool(await self.client.delete(self.key(key)))
+
+  async def aincr(self, key, delta=1):
+    client, key = self.client, self.key(key)
+    if not await client.exists(key):
+      raise ValueError(f"Key '{key}' not found.")
+    return await client.incr(key, delta)
+
+
+class AsyncCache:
+  """
+  Async access to a Django cache that does not queue every call of the process on one thread.
+  Django's cache backends, RedisCache included, inherit BaseCache's async methods, which run the sync method through
+  sync_to_async(thread_sensitive=True). Outside a request that Django's handler runs, as in RedirectASGIApplication,
+  there is no thread-sensitive context and all of those calls share a single thread, so concurrent redirects wait on
+  each other's cache round trips.
+  A RedisCache is called through redis.asyncio on the event loop itself. Other backends run their sync methods in
+  the loop's default executor, except database caches, whose connections opened in executor threads would never be
+  closed, and backends with async methods of their own, which both keep Django's behaviour.
+  """
+  def __init__(self, cache):
+    self.cache = cache
+    self.client = None
+    self.threaded = False
+    if isinstance(cache, RedisCache) and len(cache._servers) == 1:
+      self.client = AsyncRedisCacheClient(cache)
+    elif not isinstance(cache, BaseDatabaseCache) and type(cache).aget is BaseCache.aget:
+      self.threaded = True
+
+  def _call(self, name, *args, **kwargs):
+    if self.client is not None:
+      return getattr(self.client, 'a' + name)(*args, **kwargs)
+    if self.threaded:
+      return sync_to_async(getattr(self.cache, name), thread_sensitive=False)(*args, **kwargs)
+    return getattr(self.cache, 'a' + name)(*args, **kwargs)
+
+  async def aget(self, key, default=None):
+    return await self._call('get', key, default)
+
+  async def aset(self, key, value, timeout=DEFAULT_TIMEOUT):
+    return await self._call('set', key, value, timeout=timeout)
+
+  async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT):
+    return await self._call('add', key, value, timeout=timeout)
+
+  async def adelete(self, key):
+    return await self._call('delete', key)
+
+  async def aincr(self, key, delta=1):
+    return await self._call('incr', key, delta)
@@ -0,0 +1,229 @@
+import asyncio
+import io
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+from django.test.utils import (
+  setup_databases,
+  setup_test_environment,
+  teardown_databases,
+  teardown_test_environment,
+)
+
+def percentile(samples, pct: float) -> float:
+  """
+  Returns the nearest-rank percentile of the samples.
+  """
+  ordered = sorted(samples)
+  index = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+  return ordered[index]
+
+def summarize(samples, queries: int = None, elapsed: float = None) -> dict:
+  """
+  Summarizes request durations in seconds as throughput, mean and p50/p95/p99 latency in milliseconds,
+  plus the average number of queries per request when they were counted.
+  Throughput is computed over `elapsed` wall time for concurrent runs, and over the summed durations otherwise.
+  """
+  total = sum(samples)
+  elapsed = elapsed or total
+  return {
+    'requests': len(samples),
+    'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+    'mean_ms': round(total / len(samples) * 1000, 3),
+    'p50_ms': round(percentile(samples, 50) * 1000, 3),
+    'p95_ms': round(percentile(samples, 95) * 1000, 3),
+    'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    'queries_per_request': round(queries / len(samples), 2) if queries is not None else '-',
+  }
+
+class QueryCounter:
+  """
+  Execute wrapper that counts queries. Unlike CaptureQueriesContext it keeps no log, so long runs are not cut off
+  at the 9000 entries of a connection's queries_log.
+  """
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, execute, sql, params, many, context):
+    self.count += 1
+    return execute(sql, params, many, context)
+
+
+def measure(call, requests: int, warmup: int = 50) -> dict:
+  """
+  Calls `call(index)` `requests` times after a warmup and summarizes the durations and queries.
+  Queries are counted on every configured database, so reads routed to replicas are included.
+  """
+  for index in range(warmup):
+    call(index)
+  samples = []
+  counter = QueryCounter()
+  with ExitStack() as stack:
+    for alias in connections:
+      stack.enter_context(connections[alias].execute_wrapper(counter))
+    for index in range(requests):
+      started = time.perf_counter()
+      call(index)
+      samples.append(time.perf_counter() - started)
+  return summarize(samples, counter.count)
+
+def measure_threaded(call, requests: int, concurrency: int) -> dict:
+  """
+  Runs `call(index)` `requests` times from `concurrency` threads and summarizes durations and wall-clock throughput.
+  """
+  def timed(index):
+    started = time.perf_counter()
+    call(index)
+    return time.perf_counter() - started
+
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    started = time.perf_counter()
+    samples = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+  return summarize(samples, elapsed=elapsed)
+
+def measure_async(call, requests: int, concurrency: int) -> dict:
+  """
+  Awaits `call(index)` `requests` times with at most `concurrency` calls in flight on a single event loop,
+  and summarizes durations and wall-clock throughput.
+  """
+  async def run():
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(index):
+      async with semaphore:
+        started = time.perf_counter()
+        await call(index)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    samples = await asyncio.gather(*(timed(index) for index in range(requests)))
+    return samples, time.perf_counter() - started
+
+  samples, elapsed = asyncio.run(run())
+  return summarize(samples, elapsed=elapsed)
+
+def wsgi_request(application, method: str, path: str, body=None, content_type: str = '', headers: dict = None,
+                 host: str = 'testserver') -> tuple:
+  """
+  Sends a request straight to a WSGI application and returns the status code and the number of body bytes received.
+  `body` is a binary file object and is read by the application as the request stream, `headers` are WSGI environ keys.
+  """
+  statuses = []
+  content_length = 0
+  if body is not None:
+    content_length = body.seek(0, io.SEEK_END)
+    body.seek(0)
+  environ = {
+    'REQUEST_METHOD': method,
+    'PATH_INFO': path,
+    'QUERY_STRING': '',
+    'SERVER_NAME': host,
+    'SERVER_PORT': '443',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'HTTP_HOST': host,
+    'REMOTE_ADDR': '127.0.0.1',
+    'CONTENT_TYPE': content_type,
+    'CONTENT_LENGTH': str(content_length),
+    'wsgi.url_scheme': 'https',
+    'wsgi.input': body if body is not None else io.BytesIO(),
+    'wsgi.errors': sys.stderr,
+    **(headers or {}),
+  }
+  response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+  received = 0
+  for chunk in response:
+    received += len(chunk)
+  response.close()
+  return int(statuses[0].split()[0]), received
+
+def wsgi_get(application, path: str, host: str = 'testserver') -> int:
+  """
+  Sends a GET request for `path` straight to a WSGI application and returns the status code.
+  """
+  return wsgi_request(application, 'GET', path, host=host)[0]
+
+async def asgi_get(application, path: str, host: str = 'testserver') -> int:
+  """
+  Sends a GET request for `path` straight to an ASGI application and returns the status code.
+  """
+  scope = {
+    'type': 'http',
+    'asgi': {'version': '3.0'},
+    'http_version': '1.1',
+    'method': 'GET',
+    'scheme': 'https',
+    'path': path,
+    'raw_path': path.encode(),
+    'query_string': b'',
+    'root_path': '',
+    'headers': [(b'host', host.encode())],
+    'client': ('127.0.0.1', 0),
+    'server': (host, 443),
+  }
+  body_sent = False
+  disconnected = asyncio.Event()
+  messages = []
+
+  async def receive():
+    nonlocal body_sent
+    if not body_sent:
+      body_sent = True
+      return {'type': 'http.request', 'body': b'', 'more_body': False}
+    await disconnected.wait()
+    return {'type': 'http.disconnect'}
+
+  async def send(message):
+    messages.append(message)
+
+  await application(scope, receive, send)
+  return messages[0]['status']
+
+@contextmanager
+def benchmark_databases(keepdb: bool = False):
+  """
+  Runs the block against freshly created test databases, so benchmarks never write to the configured ones.
+  """
+  setup_test_environment()
+  old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+  try:
+    yield
+  finally:
+    teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+    teardown_test_environment()
+
+def format_table(rows: dict) -> str:
+  """
+  Formats {label: summary} as a fixed-width text table.
+  """
+  columns = ['throughput_rps', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+  width = max([len(label) for label in rows] + [10])
+  lines = [' '.join([''.ljust(width)] + [column.rjust(19) for column in columns])]
+  for label, summary in rows.items():
+    lines.append(' '.join([label.ljust(width)] + [str(summary[column]).rjust(19) for column in columns]))
+  return '\n'.join(lines)
+
+def compare_results(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+  """
+  Compares {label: summary} results against a baseline of the same shape and returns a line per regression.
+  Latency percentiles and throughput regress when they are worse than the baseline by more than `tolerance`,
+  queries per request regress on any increase, since they do not depend on the machine.
+  Labels missing from either side are skipped.
+  """
+  regressions = []
+  for label, expected in baseline.items():
+    actual = results.get(label)
+    if actual is None:
+      continue
+    for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+      if actual[metric] > expected[metric] * (1 + tolerance):
+        regressions.append(f'{label}: {metric} {actual[metric]} > baseline {expected[metric]}')
+    if actual['throughput_rps'] < expected['throughput_rps'] * (1 - tolerance):
+      regressions.append(f'{label}: throughput_rps {actual["throughput_rps"]} < baseline {expected["throughput_rps"]}')
+    queries, expected_queries = actual['queries_per_request'], expected['queries_per_request']
+    if isinstance(queries, (int, float)) and isinstance(expected_queries, (int, float)) and queries > expected_queries:
+      regressions.append(f'{label}: queries_per_request {queries} > baseline {expected_queries}')
+  return regressions
@@ -0,0 +1,347 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from .allocators import is_valid_short_code
+from .asynccache import AsyncCache
+from .hotkeys import SpaceSaving
+from .instrumentation import record_cache_lookup
+from .models import ShortenedUrl
+from .replicas import aread_from_replica, read_from_replica
+
+logger = logging.getLogger(__name__)
+
+def cache_entry(original_url: str, expires_at=None):
+  """
+  Returns the cached form of a link: the original URL itself, or (original URL, expiry timestamp) for expiring links,
+  so links without an expiry cost nothing extra in the cache.
+  """
+  return original_url if expires_at is None else (original_url, expires_at.timestamp())
+
+def live_url(entry):
+  """
+  Returns the original URL of a cache entry, or None once it has expired.
+  """
+  if type(entry) is tuple:
+    original_url, expires_at = entry
+    return original_url if expires_at > time.time() else None
+  return entry
+
+class LocalLRUCache:
+  """
+  Thread-safe in-process LRU cache.
+  Every entry expires after `ttl` seconds and the least recently used entry is evicted once `max_size` is reached.
+  """
+  def __init__(self, max_size: int = 10000, ttl: float = 60):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return None
+      value, expires_at = entry
+      if expires_at < time.monotonic():
+        del self._data[key]
+        return None
+      self._data.move_to_end(key)
+      return value
+
+  def set(self, key, value):
+    if self.max_size <= 0:
+      return
+    with self._lock:
+      self._data[key] = (value, time.monotonic() + self.ttl)
+      self._data.move_to_end(key)
+      while len(self._data) > self.max_size:
+        self._data.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def __len__(self):
+    return len(self._data)
+
+
+class UrlCache:
+  """
+  Two-tier short_code -> original_url cache.
+  The local tier lives in the worker process and is bounded in size and age.
+  The optional shared tier goes through Django's cache framework, so a link loaded by one worker is served by every other worker without a query.
+  Local entries in other workers are not invalidated on delete, they age out after the local TTL.
+  Hits are counted by a Space-Saving tracker, and every `pin_interval` seconds the `pinned_size` hottest codes are
+  checked against the database and pinned in a map in front of the LRU, which long-tail codes can never evict.
+  The check runs in a daemon thread woken by the hit that finds the map due, so no request waits on it. With
+  `background` off no thread is started and refresh_pinned() has to be called explicitly.
+  A pinned code deleted in another worker stops being served there at the next pin refresh.
+  Codes that were looked up and do not exist are remembered in a bounded local negative cache for `negative_ttl`
+  seconds. Creating a code clears its entry in this worker, other workers may answer 404 for it until the entry expires.
+  Entries of expiring links carry their expiry time and are dropped on the first read after it. Click-limited links are
+  never cached, see lookup_short_code.
+  """
+  key_prefix = 'shortener:url:'
+
+  def __init__(self, local_max_size=10000, local_ttl=60, shared_alias=None, shared_ttl=3600,
+               hot_capacity=1000, pinned_size=100, pin_interval=30, negative_max_size=100000, negative_ttl=30,
+               background=True):
+    self.local = LocalLRUCache(max_size=local_max_size, ttl=local_ttl)
+    self.missing = LocalLRUCache(max_size=negative_max_size, ttl=negative_ttl)
+    self.shared_alias = shared_alias
+    self.shared_ttl = shared_ttl
+    self.hot = SpaceSaving(hot_capacity) if hot_capacity and pinned_size else None
+    self.pinned_size = pinned_size
+    self.pin_interval = pin_interval
+    self.pinned = {}
+    self._pinned_at = time.monotonic()
+    self._pin_lock = threading.Lock()
+    self.background = background
+    self._refresh_due = threading.Event()
+    self._refresher = None
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'SHORTENER_URL_CACHE', {})
+    return cls(
+      local_max_size=options.get('LOCAL_MAX_SIZE', 10000),
+      local_ttl=options.get('LOCAL_TTL', 60),
+      shared_alias=options.get('SHARED_ALIAS'),
+      shared_ttl=options.get('SHARED_TTL', 3600),
+      hot_capacity=options.get('HOT_CAPACITY', 1000),
+      pinned_size=options.get('PINNED_SIZE', 100),
+      pin_interval=options.get('PIN_INTERVAL', 30),
+      negative_max_size=options.get('NEGATIVE_MAX_SIZE', 100000),
+      negative_ttl=options.get('NEGATIVE_TTL', 30),
+    )
+
+  @property
+  def shared(self):
+    return caches[self.shared_alias] if self.shared_alias else None
+
+  @property
+  def ashared(self):
+    return AsyncCache(caches[self.shared_alias]) if self.shared_alias else None
+
+  def get(self, short_code: str):
+    entry = self.pinned.get(short_code) or self.local.get(short_code)
+    if entry is None and self.shared is not None:
+      entry = self.shared.get(self.key_prefix + short_code)
+      if entry is not None:
+        self.local.set(short_code, entry)
+    if entry is None:
+      return None
+    original_url = live_url(entry)
+    if original_url is None:
+      self.delete(short_code)
+    elif self.record_hit(short_code, original_url):
+      self.request_refresh()
+    return original_url
+
+  async def aget(self, short_code: str):
+    entry = self.pinned.get(short_code) or self.local.get(short_code)
+    if entry is None and self.shared_alias:
+      entry = await self.ashared.aget(self.key_prefix + short_code)
+      if entry is not None:
+        self.local.set(short_code, entry)
+    if entry is None:
+      return None
+    original_url = live_url(entry)
+    if original_url is None:
+      self.local.delete(short_code)
+      self.pinned.pop(short_code, None)
+      if self.shared_alias:
+        await self.ashared.adelete(self.key_prefix + short_code)
+    elif self.record_hit(short_code, original_url):
+      self.request_refresh()
+    return original_url
+
+  def record_hit(self, short_code: str, original_url: str) -> bool:
+    """
+    Counts a cache hit and returns True for the one caller that should refresh the pinned map.
+    """
+    if self.hot is None:
+      return False
+    self.hot.add(short_code, original_url)
+    if time.monotonic() - self._pinned_at < self.pin_interval:
+      return False
+    with self._pin_lock:
+      if time.monotonic() - self._pinned_at < self.pin_interval:
+        return False
+      self._pinned_at = time.monotonic()
+      return True
+
+  def hottest_codes(self) -> list:
+    return [short_code for short_code, *counter in self.hot.top(self.pinned_size)]
+
+  def pin(self, current_urls: dict, short_codes: list):
+    """
+    Replaces the pinned map with the given codes that are still live, and decays the hit counts.
+    `current_urls` maps the live codes to their cache entries.
+    """
+    for short_code in short_codes:
+      if short_code not in current_urls:
+        self.hot.discard(short_code)
+    self.pinned = {short_code: current_urls[short_code] for short_code in short_codes if short_code in current_urls}
+    self.hot.decay()
+
+  def refresh_pinned(self):
+    short_codes = self.hottest_codes()
+    try:
+      current_urls = {
+        short_code: cache_entry(original_url, expires_at)
+        for short_code, original_url, expires_at in ShortenedUrl.objects.live().filter(
+          short_code__in=short_codes, max_clicks__isnull=True
+        ).values_list('short_code', 'original_url', 'expires_at')
+      }
+    except Exception:
+      logger.exception("Refreshing the pinned short codes failed, keeping the current ones.")
+      return
+    self.pin(current_urls, short_codes)
+
+  def request_refresh(self):
+    """
+    Wakes the refresher thread, starting it on first use.
+    """
+    if not self.background:
+      return
+    if self._refresher is None:
+      with self._pin_lock:
+        if self._refresher is None:
+          self._refresher = threading.Thread(target=self._run_refresher, name='pin-refresher', daemon=True)
+          self._refresher.start()
+    self._refresh_due.set()
+
+  def _run_refresher(self):
+    while True:
+      self._refresh_due.wait()
+      self._refresh_due.clear()
+      try:
+        close_old_connections()
+        self.refresh_pinned()
+      except Exception:
+        logger.exception("Pin refresher iteration failed.")
+
+  def is_missing(self, short_code: str) -> bool:
+    return self.missing.get(short_code) is not None
+
+  def set_missing(self, short_code: str):
+    self.missing.set(short_code, True)
+
+  def forget_missing(self, short_code: str):
+    self.missing.delete(short_code)
+
+  def shared_timeout(self, expires_at) -> float:
+    if expires_at is None:
+      return self.shared_ttl
+    return max(min(self.shared_ttl, expires_at.timestamp() - time.time()), 1)
+
+  def set(self, short_code: str, original_url: str, expires_at=None):
+    self.missing.delete(short_code)
+    entry = cache_entry(original_url, expires_at)
+    self.local.set(short_code, entry)
+    if self.shared is not None:
+      self.shared.set(self.key_prefix + short_code, entry, self.shared_timeout(expires_at))
+
+  async def aset(self, short_code: str, original_url: str, expires_at=None):
+    self.missing.delete(short_code)
+    entry = cache_entry(original_url, expires_at)
+    self.local.set(short_code, entry)
+    if self.shared_alias:
+      await self.ashared.aset(self.key_prefix + short_code, entry, self.shared_timeout(expires_at))
+
+  def delete(self, short_code: str):
+    self.pinned.pop(short_code, None)
+    if self.hot is not None:
+      self.hot.discard(short_code)
+    self.local.delete(short_code)
+    if self.shared is not None:
+      self.shared.delete(self.key_prefix + short_code)
+
+  def delete_many(self, short_codes: list):
+    for short_code in short_codes:
+      self.pinned.pop(short_code, None)
+      if self.hot is not None:
+        self.hot.discard(short_code)
+      self.local.delete(short_code)
+    if self.shared is not None:
+      self.shared.delete_many([self.key_prefix + short_code for short_code in short_codes])
+
+  def clear(self):
+    self.pinned = {}
+    self.local.clear()
+    self.missing.clear()
+
+
+url_cache = UrlCache.from_settings()
+
+"""
+Returns (original URL, limited) for the given short code, or (None, False) if it does not exist.
+Strings that no allocator could have produced are rejected without a lookup.
+The cache is consulted first, then the negative cache, and only a miss in both reaches the database.
+The lookup goes to a read replica when there is one, and a code the replica does not have yet is looked up on the primary.
+Expired links are treated as missing, they stop redirecting before purge_expired_urls deletes them.
+Click-limited links are never cached, since a cached entry would keep redirecting after the last click. `limited` is
+True for them and the caller has to claim the click with claim_click before redirecting.
+"""
+def lookup_short_code(short_code: str):
+  if not is_valid_short_code(short_code):
+    return None, False
+  original_url = url_cache.get(short_code)
+  if original_url is not None:
+    record_cache_lookup('url', 'hit')
+    return original_url, False
+  if url_cache.is_missing(short_code):
+    record_cache_lookup('url', 'negative_hit')
+    return None, False
+  record_cache_lookup('url', 'miss')
+  row = read_from_replica(
+    ShortenedUrl.objects.live().filter(short_code=short_code).values_list(
+      'original_url', 'expires_at', 'max_clicks'
+    ).first,
+    retry_empty=True
+  )
+  if row is None:
+    url_cache.set_missing(short_code)
+    return None, False
+  original_url, expires_at, max_clicks = row
+  if max_clicks is None:
+    url_cache.set(short_code, original_url, expires_at)
+  return original_url, max_clicks is not None
+
+"""
+Async variant of lookup_short_code, using the async cache and ORM APIs.
+"""
+async def alookup_short_code(short_code: str):
+  if not is_valid_short_code(short_code):
+    return None, False
+  original_url = await url_cache.aget(short_code)
+  if original_url is not None:
+    record_cache_lookup('url', 'hit')
+    return original_url, False
+  if url_cache.is_missing(short_code):
+    record_cache_lookup('url', 'negative_hit')
+    return None, False
+  record_cache_lookup('url', 'miss')
+  row = await aread_from_replica(
+    ShortenedUrl.objects.live().filter(short_code=short_code).values_list(
+      'original_url', 'expires_at', 'max_clicks'
+    ).afirst,
+    retry_empty=True
+  )
+  if row is None:
+    url_cache.set_missing(short_code)
+    return None, False
+  original_url, expires_at, max_clicks = row
+  if max_clicks is None:
+    await url_cache.aset(short_code, original_url, expires_at)
+  return original_url, max_clicks is not None
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+@register()
+def check_rate_limit_client_ip(app_configs, **kwargs):
+  """
+  Warns when redirects or shortening are rate limited per client address without IP_HEADER. Behind a load balancer or
+  reverse proxy REMOTE_ADDR is the proxy's address, so every visitor would share one bucket and the whole site would be
+  throttled at the per-client rate.
+  """
+  options = getattr(settings, 'SHORTENER_RATE_LIMITS', {})
+  if not options.get('ENABLED', True) or options.get('IP_HEADER') or not any(options.get('RATES', {}).values()):
+    return []
+  return [Warning(
+    'Rate limits are keyed on REMOTE_ADDR because SHORTENER_RATE_LIMITS has no IP_HEADER.',
+    hint=(
+      'Behind a proxy or load balancer set SHORTENER_RATE_LIMIT_IP_HEADER (e.g. X-Forwarded-For) and '
+      'SHORTENER_RATE_LIMIT_TRUSTED_PROXIES, or unset SHORTENER_RATE_LIMITS_ENABLED. Silence shortener.W001 only '
+      'when clients connect directly.'
+    ),
+    id='shortener.W001',
+  )]
+
+PROCESS_LOCAL_CACHES = (
+  'django.core.cache.backends.locmem.LocMemCache',
+  'django.core.cache.backends.dummy.DummyCache',
+)
+
+@register()
+def check_replica_stickiness_cache(app_configs, **kwargs):
+  """
+  Warns when read replicas are configured but users are pinned to the primary through a per-process cache. A pin set
+  by the worker that handled a write is then invisible to the other workers, which can serve that user stale reads.
+  """
+  if not any(alias.startswith('replica') for alias in settings.DATABASES):
+    return []
+  alias = getattr(settings, 'SHORTENER_REPLICAS', {}).get('CACHE_ALIAS', 'default')
+  if settings.CACHES.get(alias, {}).get('BACKEND') not in PROCESS_LOCAL_CACHES:
+    return []
+  return [Warning(
+    f"Read replicas pin users who just wrote to the primary in the per-process cache '{alias}'.",
+    hint='Set REDIS_URL or point SHORTENER_REPLICAS CACHE_ALIAS at a shared cache, so every worker sees the pins.',
+    id='shortener.W002',
+  )]
@@ -0,0 +1,300 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from .analytics import ClickEventBuffer, analytics_options, write_click_events
+from .asynccache import AsyncCache
+from .models import ShortenedUrl
+from .stats import add_clicks_to_user_stats
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CHUNK_SIZE = 500
+
+"""
+Applies buffered click increments to the database.
+Codes that received the same number of clicks share one `click_count = click_count + n` UPDATE,
+so a flush costs one query per distinct increment rather than one per redirect.
+The owners' stats rows are updated in the same transaction.
+"""
+def apply_click_counts(counts: dict):
+  by_increment = defaultdict(list)
+  for short_code, clicks in counts.items():
+    if clicks > 0:
+      by_increment[clicks].append(short_code)
+  with transaction.atomic():
+    for clicks, short_codes in by_increment.items():
+      for start in range(0, len(short_codes), UPDATE_CHUNK_SIZE):
+        ShortenedUrl.objects.filter(
+          short_code__in=short_codes[start:start + UPDATE_CHUNK_SIZE]
+        ).update(click_count=F('click_count') + clicks)
+    add_clicks_to_user_stats(counts)
+
+"""
+Counts one click of a click-limited link on the primary right away, instead of buffering it.
+The UPDATE only matches while the link is live, so concurrent redirects on any number of workers can never use more
+than max_clicks clicks, and the owner's stats row is updated in the same transaction.
+Returns False once the link has expired or used up its clicks.
+"""
+def claim_click(short_code: str) -> bool:
+  with transaction.atomic():
+    claimed = ShortenedUrl.objects.live().filter(short_code=short_code, max_clicks__isnull=False).update(
+      click_count=F('click_count') + 1
+    )
+    if claimed:
+      add_clicks_to_user_stats({short_code: 1})
+  return bool(claimed)
+
+async def aclaim_click(short_code: str) -> bool:
+  return await sync_to_async(claim_click)(short_code)
+
+
+class LocalClickBuffer:
+  """
+  Buffers click increments in the memory of the current process.
+  Each worker flushes its own buffer, so nothing is shared and nothing is lost between workers.
+  """
+  def __init__(self):
+    self._counts = Counter()
+    self._lock = threading.Lock()
+
+  def record(self, short_code: str, clicks: int = 1):
+    with self._lock:
+      self._counts[short_code] += clicks
+
+  async def arecord(self, short_code: str, clicks: int = 1):
+    self.record(short_code, clicks)
+
+  def drain(self) -> dict:
+    with self._lock:
+      counts, self._counts = self._counts, Counter()
+    return dict(counts)
+
+  def pending(self) -> int:
+    return len(self._counts)
+
+
+class CacheClickBuffer:
+  """
+  Buffers click increments in a shared Django cache, so any process can drain them.
+  Counters are updated with atomic incr/decr, and every code that becomes dirty is appended
+  to a registry through an atomic sequence, which lets a drain find the codes without scanning keys.
+  Only one drain runs at a time, guarded by an add() lock.
+  A registry slot that is still empty after `slot_grace` seconds is skipped, its writer died between reserving and
+  filling it or the cache evicted it. The dirty flag of that code expires after `dirty_timeout` seconds, and its
+  next click registers it again, so its buffered count is drained late rather than lost.
+  """
+  key_prefix = 'shortener:clicks:'
+  lock_timeout = 60
+  slot_grace = 60
+  dirty_timeout = 300
+
+  def __init__(self, alias: str = 'default'):
+    self.alias = alias
+    self._missing_since = {}
+
+  @property
+  def cache(self):
+    return caches[self.alias]
+
+  @property
+  def acache(self):
+    return AsyncCache(self.cache)
+
+  def _key(self, *parts) -> str:
+    return self.key_prefix + ':'.join(str(part) for part in parts)
+
+  def _incr(self, key: str, delta: int) -> int:
+    self.cache.add(key, 0, timeout=None)
+    try:
+      return self.cache.incr(key, delta)
+    except ValueError:
+      self.cache.add(key, 0, timeout=None)
+      return self.cache.incr(key, delta)
+
+  def record(self, short_code: str, clicks: int = 1):
+    self._incr(self._key('count', short_code), clicks)
+    if self.cache.add(self._key('dirty', short_code), 1, timeout=self.dirty_timeout):
+      slot = self._incr(self._key('registry', 'size'), 1)
+      self.cache.set(self._key('registry', slot), short_code, timeout=None)
+
+  async def _aincr(self, cache, key: str, delta: int) -> int:
+    await cache.aadd(key, 0, timeout=None)
+    try:
+      return await cache.aincr(key, delta)
+    except ValueError:
+      await cache.aadd(key, 0, timeout=None)
+      return await cache.aincr(key, delta)
+
+  async def arecord(self, short_code: str, clicks: int = 1):
+    cache = self.acache
+    await self._aincr(cache, self._key('count', short_code), clicks)
+    if await cache.aadd(self._key('dirty', short_code), 1, timeout=self.dirty_timeout):
+      slot = await self._aincr(cache, self._key('registry', 'size'), 1)
+      await cache.aset(self._key('registry', slot), short_code, timeout=None)
+
+  def drain(self) -> dict:
+    lock_key = self._key('lock')
+    if not self.cache.add(lock_key, 1, timeout=self.lock_timeout):
+      return {}
+    try:
+      start = self.cache.get(self._key('registry', 'cursor'), 0)
+      size = self.cache.get(self._key('registry', 'size'), 0)
+      slot_keys = {slot: self._key('registry', slot) for slot in range(start + 1, size + 1)}
+      slots = self.cache.get_many(list(slot_keys.values()))
+      short_codes = []
+      cursor = start
+      now = time.monotonic()
+      for slot, slot_key in slot_keys.items():
+        if slot_key not in slots:
+          # A writer has reserved this slot but not filled it yet, resume from here next time unless it stayed empty.
+          if now - self._missing_since.setdefault(slot, now) < self.slot_grace:
+            break
+          logger.warning('Click registry slot %s stayed empty, skipping it.', slot)
+        else:
+          short_codes.append(slots[slot_key])
+        self._missing_since.pop(slot, None)
+        cursor = slot
+      if cursor == start:
+        return {}
+
+      self.cache.delete_many([self._key('dirty', short_code) for short_code in short_codes])
+      count_keys = {self._key('count', short_code): short_code for short_code in set(short_codes)}
+      counts = {}
+      for count_key, clicks in self.cache.get_many(list(count_keys)).items():
+        if clicks:
+          self.cache.decr(count_key, clicks)
+          counts[count_keys[count_key]] = clicks
+
+      self.cache.delete_many([slot_keys[slot] for slot in range(start + 1, cursor + 1)])
+      self.cache.set(self._key('registry', 'cursor'), cursor, timeout=None)
+      return counts
+    finally:
+      self.cache.delete(lock_key)
+
+  def pending(self) -> int:
+    size = self.cache.get(self._key('registry', 'size'), 0)
+    return size - self.cache.get(self._key('registry', 'cursor'), 0)
+
+
+class ClickAggregator:
+  """
+  Records redirect clicks into a buffer and flushes them to the database in bulk.
+  When analytics are enabled, each click's raw attributes also go to an in-process event buffer that is
+  written to ClickEvent and the rollup tables by the same flush.
+  A daemon thread flushes at least every `flush_interval` seconds, earlier once `max_pending`
+  clicks have been recorded by this process, and once more when the process exits.
+  With `background` off no thread is started and flush() has to be called explicitly.
+  """
+  def __init__(self, buffer, flush_interval: float = 5, max_pending: int = 1000, background: bool = True, events=None):
+    self.buffer = buffer
+    self.events = events
+    self.background = background
+    self.flush_interval = flush_interval
+    self.max_pending = max_pending
+    self._recorded = 0
+    self._wake = threading.Event()
+    self._stopped = threading.Event()
+    self._thread = None
+    self._thread_lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'SHORTENER_CLICKS', {})
+    if options.get('BACKEND', 'local') == 'cache':
+      buffer = CacheClickBuffer(alias=options.get('CACHE_ALIAS', 'default'))
+    else:
+      buffer = LocalClickBuffer()
+    analytics = analytics_options()
+    return cls(
+      buffer,
+      flush_interval=options.get('FLUSH_INTERVAL', 5),
+      max_pending=options.get('MAX_PENDING', 1000),
+      events=ClickEventBuffer(analytics.get('MAX_BUFFERED_EVENTS', 100000)) if analytics.get('ENABLED', True) else None,
+    )
+
+  def record(self, short_code: str, clicks: int = 1, event=None):
+    self.buffer.record(short_code, clicks)
+    self._recorded_clicks(clicks, event)
+
+  async def arecord(self, short_code: str, clicks: int = 1, event=None):
+    await self.buffer.arecord(short_code, clicks)
+    self._recorded_clicks(clicks, event)
+
+  def record_event(self, event):
+    """
+    Buffers only the analytics event of a click that claim_click already counted.
+    """
+    self._recorded_clicks(0, event)
+
+  def _recorded_clicks(self, clicks: int, event):
+    if event is not None and self.events is not None:
+      self.events.append(event)
+    self._recorded += clicks
+    if self._thread is None and self.background:
+      self._start()
+    if self._recorded >= self.max_pending:
+      self._wake.set()
+
+  def flush(self) -> int:
+    self._recorded = 0
+    self.flush_events()
+    counts = self.buffer.drain()
+    if not counts:
+      return 0
+    try:
+      apply_click_counts(counts)
+    except Exception:
+      logger.exception("Flushing %s buffered click counts failed, re-buffering them.", len(counts))
+      for short_code, clicks in counts.items():
+        self.buffer.record(short_code, clicks)
+      return 0
+    return sum(counts.values())
+
+  def flush_events(self) -> int:
+    if self.events is None:
+      return 0
+    events = self.events.drain()
+    try:
+      return write_click_events(events)
+    except Exception:
+      logger.exception("Writing %s buffered click events failed, re-buffering them.", len(events))
+      for event in events:
+        self.events.append(event)
+      return 0
+
+  def shutdown(self):
+    self._stopped.set()
+    self._wake.set()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join(timeout=self.flush_interval)
+    self.flush()
+
+  def _start(self):
+    with self._thread_lock:
+      if self._thread is not None:
+        return
+      self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+      self._thread.start()
+      atexit.register(self.shutdown)
+
+  def _run(self):
+    while not self._stopped.is_set():
+      self._wake.wait(self.flush_interval)
+      self._wake.clear()
+      if self._stopped.is_set():
+        break
+      try:
+        close_old_connections()
+        self.flush()
+      except Exception:
+        logger.exception("Click flusher iteration failed.")
+
+
+click_aggregator = ClickAggregator.from_settings()
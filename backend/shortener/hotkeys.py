@@ -0,0 +1,66 @@
+import heapq
+import threading
+
+class SpaceSaving:
+  """
+  Space-Saving top-K counter over a stream of keys, holding at most `capacity` counters.
+  A key that is not tracked while the table is full replaces the key with the smallest count and inherits that
+  count as its error, so every count overestimates by at most its error and any key seen more than
+  (stream length / capacity) times is guaranteed to be tracked.
+  Each counter also keeps the last value recorded with its key.
+  The smallest counter is found through a heap of lower bounds that is corrected lazily, so increments stay O(1).
+  """
+  def __init__(self, capacity: int = 1000):
+    self.capacity = capacity
+    self.counters = {}
+    self._heap = []
+    self._lock = threading.Lock()
+
+  def add(self, key, value=None):
+    with self._lock:
+      counter = self.counters.get(key)
+      if counter is not None:
+        counter[0] += 1
+        counter[2] = value
+        return
+      if len(self.counters) < self.capacity:
+        self.counters[key] = [1, 0, value]
+        heapq.heappush(self._heap, (1, key))
+        return
+      while True:
+        count, victim = heapq.heappop(self._heap)
+        victim_counter = self.counters.get(victim)
+        if victim_counter is None:
+          continue
+        if victim_counter[0] == count:
+          break
+        heapq.heappush(self._heap, (victim_counter[0], victim))
+      del self.counters[victim]
+      self.counters[key] = [count + 1, count, value]
+      heapq.heappush(self._heap, (count + 1, key))
+
+  def discard(self, key):
+    with self._lock:
+      self.counters.pop(key, None)
+
+  def top(self, count: int) -> list:
+    """
+    Returns up to `count` (key, count, error, value) tuples, highest count first.
+    """
+    with self._lock:
+      items = [(key, *counter) for key, counter in self.counters.items()]
+    return heapq.nlargest(count, items, key=lambda item: item[1])
+
+  def decay(self, factor: float = 0.5):
+    """
+    Scales every count down, so keys that stop being requested give way to new ones.
+    """
+    with self._lock:
+      for counter in self.counters.values():
+        counter[0] = int(counter[0] * factor)
+        counter[1] = int(counter[1] * factor)
+      self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+      heapq.heapify(self._heap)
+
+  def __len__(self):
+    return len(self.counters)
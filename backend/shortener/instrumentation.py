@@ -0,0 +1,307 @@
+import bisect
+import contextvars
+import hmac
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+MAX_LOGGED_QUERIES = 50
+
+# The stats of the request being handled, None outside of an instrumented request.
+current_stats = contextvars.ContextVar('instrumentation_stats', default=None)
+
+def served_metrics_path():
+  """
+  Returns the path InstrumentationMiddleware serves the metrics at, or None when they are not served.
+  """
+  options = getattr(settings, 'SHORTENER_INSTRUMENTATION', {})
+  if not options.get('ENABLED', False) or not options.get('METRICS_TOKEN'):
+    return None
+  return options.get('METRICS_PATH', '/metrics')
+
+def record_cache_lookup(cache: str, result: str):
+  """
+  Counts a lookup in one of the application caches, such as ('url', 'hit'), on the current request.
+  Outside of an instrumented request, or with instrumentation disabled, it is a context variable read.
+  """
+  stats = current_stats.get()
+  if stats is not None:
+    stats.cache[(cache, result)] += 1
+
+def record_query(execute, sql, params, many, context):
+  """
+  Database execute wrapper that counts and times the queries of the current request, and keeps their SQL when the
+  request is sampled. It is installed on every connection while instrumentation is enabled.
+  """
+  stats = current_stats.get()
+  if stats is None:
+    return execute(sql, params, many, context)
+  started = time.perf_counter()
+  try:
+    return execute(sql, params, many, context)
+  finally:
+    duration = time.perf_counter() - started
+    stats.queries += 1
+    stats.query_seconds += duration
+    if stats.sql is not None and len(stats.sql) < MAX_LOGGED_QUERIES:
+      stats.sql.append((round(duration * 1000, 3), sql))
+
+def install_query_recorder(sender=None, connection=None, **kwargs):
+  if record_query not in connection.execute_wrappers:
+    connection.execute_wrappers.append(record_query)
+
+
+class RequestStats:
+  __slots__ = ('queries', 'query_seconds', 'cache', 'sql')
+
+  def __init__(self, capture_sql: bool):
+    self.queries = 0
+    self.query_seconds = 0.0
+    self.cache = Counter()
+    self.sql = [] if capture_sql else None
+
+
+class Histogram:
+  """
+  Cumulative histogram with fixed upper bounds, in the shape of a Prometheus histogram.
+  """
+  def __init__(self, buckets: tuple):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+
+  def samples(self):
+    """
+    Yields (le, cumulative count) pairs, ending with '+Inf'.
+    """
+    total = 0
+    for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+      total += count
+      yield bound, total
+
+
+class MetricsRegistry:
+  """
+  In-process store of the request metrics, rendered in the Prometheus text exposition format.
+  Histograms and counters are keyed by metric name and a tuple of label pairs.
+  Every worker process keeps its own metrics, so each worker has to be scraped, or the series summed by the scraper.
+  """
+  histograms = {
+    'http_request_duration_seconds': ('Request latency by view.', LATENCY_BUCKETS),
+    'http_request_queries': ('Database queries per request by view.', QUERY_BUCKETS),
+    'http_request_query_duration_seconds': ('Database time per request by view.', LATENCY_BUCKETS),
+    'http_request_size_bytes': ('Request body size by view.', SIZE_BUCKETS),
+    'http_response_size_bytes': ('Response body size by view, streaming responses excluded.', SIZE_BUCKETS),
+  }
+  counters = {
+    'http_requests_total': 'Requests by view, method and status.',
+    'cache_lookups_total': 'Application cache lookups by view, cache and result.',
+    'slow_requests_total': 'Requests slower than the slow request threshold by view.',
+  }
+
+  def __init__(self):
+    self._histograms = {}
+    self._counters = Counter()
+    self._lock = threading.Lock()
+
+  def observe(self, name: str, labels: tuple, value: float):
+    with self._lock:
+      histogram = self._histograms.get((name, labels))
+      if histogram is None:
+        histogram = self._histograms[(name, labels)] = Histogram(self.histograms[name][1])
+      histogram.observe(value)
+
+  def increment(self, name: str, labels: tuple, amount: int = 1):
+    with self._lock:
+      self._counters[(name, labels)] += amount
+
+  def clear(self):
+    with self._lock:
+      self._histograms.clear()
+      self._counters.clear()
+
+  def render(self, gauges: dict = None) -> str:
+    """
+    Returns every metric in the Prometheus text format, followed by `gauges`, a {name: (help, value)} dict.
+    """
+    lines = []
+    with self._lock:
+      histograms = sorted(self._histograms.items())
+      counters = sorted(self._counters.items())
+    for name, (help_text, buckets) in self.histograms.items():
+      series = [(labels, histogram) for (metric, labels), histogram in histograms if metric == name]
+      if not series:
+        continue
+      lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+      for labels, histogram in series:
+        for bound, count in histogram.samples():
+          lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {sum(histogram.counts)}')
+    for name, help_text in self.counters.items():
+      series = [(labels, count) for (metric, labels), count in counters if metric == name]
+      if not series:
+        continue
+      lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+      lines += [f'{name}{format_labels(labels)} {count}' for labels, count in series]
+    for name, (help_text, value) in (gauges or {}).items():
+      lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+  if not labels:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+  return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def database_pool_stats(alias: str = 'default') -> dict:
+  """
+  Returns the psycopg pool statistics of a database, or an empty dict when it does not use a connection pool.
+  """
+  connection = connections[alias]
+  if connection.vendor != 'postgresql' or not connection.settings_dict['OPTIONS'].get('pool'):
+    return {}
+  return connection.pool.get_stats()
+
+def application_gauges() -> dict:
+  """
+  Returns the state of the password pool, the database connection pool, the redirect cache and the click buffer
+  as Prometheus gauges.
+  """
+  from authentication.hashers import password_pool
+  from shortener.cache import url_cache
+  from shortener.clicks import click_aggregator
+
+  pool = password_pool.stats()
+  gauges = {
+    'password_pool_enabled': ('Whether passwords are hashed in the process pool.', int(pool['enabled'])),
+    'password_pool_workers': ('Worker processes of the password pool.', pool['workers']),
+    'password_pool_max_queue': ('Password hashes allowed in flight before new ones are rejected.', pool['max_queue']),
+    'password_pool_queue_depth': ('Password hashes in flight.', pool['queue_depth']),
+    'password_pool_rejected': ('Password hashes rejected because the pool was full.', pool['rejected']),
+    'password_pool_completed': ('Password hashes completed by the pool.', pool['completed']),
+    'url_cache_local_entries': ('Entries in the local redirect cache.', len(url_cache.local)),
+    'url_cache_pinned_entries': ('Hot codes pinned in front of the local redirect cache.', len(url_cache.pinned)),
+    'url_cache_negative_entries': ('Unknown codes in the negative redirect cache.', len(url_cache.missing)),
+    'click_buffer_pending': ('Clicks buffered and not flushed yet.', click_aggregator.buffer.pending()),
+  }
+  for name, value in database_pool_stats().items():
+    gauges[f'database_pool_{name}'] = (f'{name} of the default database connection pool, as reported by psycopg.', value)
+  return gauges
+
+
+metrics = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+  """
+  Opt-in middleware that records latency, database queries and time, application cache lookups and payload sizes
+  of every request, labelled by view, and serves them in the Prometheus text format at METRICS_PATH to requests
+  bearing METRICS_TOKEN. Without a token the metrics are not served at all, since they expose pool statistics and
+  per-view timings.
+  Django drops it at startup unless SHORTENER_INSTRUMENTATION['ENABLED'] is true, and then only the context variable
+  read in record_cache_lookup remains on the request path.
+  A SAMPLE_RATE share of the requests also keeps the SQL that ran, and a sampled request slower than SLOW_REQUEST_MS
+  is logged with it. It goes first in MIDDLEWARE so lean redirects are measured too, redirects answered by
+  RedirectASGIApplication never reach Django and are not. Queries run while a streaming response is consumed happen
+  after the request is recorded and are not counted.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    options = getattr(settings, 'SHORTENER_INSTRUMENTATION', {})
+    if not options.get('ENABLED', False):
+      raise MiddlewareNotUsed
+    self.get_response = get_response
+    self.metrics_token = options.get('METRICS_TOKEN')
+    self.metrics_path = served_metrics_path()
+    if not self.metrics_token:
+      logger.warning('SHORTENER_INSTRUMENTATION has no METRICS_TOKEN, metrics are recorded but not served.')
+    self.slow_request_seconds = options.get('SLOW_REQUEST_MS', 500) / 1000
+    self.sample_rate = options.get('SAMPLE_RATE', 0.1)
+    connection_created.connect(install_query_recorder, dispatch_uid='shortener.instrumentation')
+    for connection in connections.all(initialized_only=True):
+      install_query_recorder(connection=connection)
+    if iscoroutinefunction(self.get_response):
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+    if request.path_info == self.metrics_path:
+      return self.metrics_response(request, application_gauges())
+    stats, token, started = self.start()
+    try:
+      response = self.get_response(request)
+    finally:
+      current_stats.reset(token)
+    self.finish(request, response, stats, time.perf_counter() - started)
+    return response
+
+  async def __acall__(self, request):
+    if request.path_info == self.metrics_path:
+      return self.metrics_response(request, await sync_to_async(application_gauges)())
+    stats, token, started = self.start()
+    try:
+      response = await self.get_response(request)
+    finally:
+      current_stats.reset(token)
+    self.finish(request, response, stats, time.perf_counter() - started)
+    return response
+
+  def start(self):
+    stats = RequestStats(capture_sql=random.random() < self.sample_rate)
+    return stats, current_stats.set(stats), time.perf_counter()
+
+  def metrics_response(self, request, gauges):
+    expected = f'Bearer {self.metrics_token}'
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+      return HttpResponseForbidden()
+    return HttpResponse(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+  def view_name(self, request):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+      return match.view_name
+    # Lean redirects are answered before URL resolution.
+    from .middleware import SHORT_CODE_PATH
+    return 'redirect_url' if SHORT_CODE_PATH.match(request.path_info) else 'unresolved'
+
+  def finish(self, request, response, stats, duration):
+    view = (('view', self.view_name(request)),)
+    metrics.increment('http_requests_total', view + (('method', request.method), ('status', response.status_code)))
+    metrics.observe('http_request_duration_seconds', view, duration)
+    metrics.observe('http_request_queries', view, stats.queries)
+    metrics.observe('http_request_query_duration_seconds', view, stats.query_seconds)
+    metrics.observe('http_request_size_bytes', view, int(request.META.get('CONTENT_LENGTH') or 0))
+    if not response.streaming:
+      metrics.observe('http_response_size_bytes', view, len(response.content))
+    for (cache, result), count in stats.cache.items():
+      metrics.increment('cache_lookups_total', view + (('cache', cache), ('result', result)), count)
+    if duration >= self.slow_request_seconds:
+      metrics.increment('slow_requests_total', view)
+      if stats.sql is not None:
+        logger.warning(
+          'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms%s',
+          request.method, request.path, view[0][1], duration * 1000, stats.queries, stats.query_seconds * 1000,
+          ''.join(f'\n  {milliseconds} ms: {sql}' for milliseconds, sql in stats.sql),
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shortener.models import ShortenedUrl
+from shortener.utils import hash_url
+
+class Command(BaseCommand):
+  """
+  Fills in the url_hash of existing shortened URLs in primary key order, one batch per transaction.
+  A row whose digest is already taken by another link of the same user is a duplicate of that link, it keeps an
+  empty digest so the unique (user, url_hash) index stays valid, and it is reported at the end.
+  With --rehash every row is recomputed, for when the URL normalization changes.
+  """
+  help = 'Backfill the URL digests used to deduplicate shortened URLs.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--rehash', action='store_true', help='Recompute the digest of every row, not only empty ones.')
+
+  def handle(self, *args, **options):
+    batch_size = options['batch_size']
+    rows = ShortenedUrl.objects.all() if options['rehash'] else ShortenedUrl.objects.filter(url_hash='')
+    last_pk = 0
+    updated = duplicates = 0
+    while True:
+      batch = list(rows.filter(pk__gt=last_pk).order_by('pk').only('id', 'original_url', 'url_hash', 'user_id')[:batch_size])
+      if not batch:
+        break
+      last_pk = batch[-1].pk
+      with transaction.atomic():
+        changed, skipped = self.hash_batch(batch)
+        ShortenedUrl.objects.bulk_update(changed, ['url_hash'])
+      updated += len(changed)
+      duplicates += skipped
+      self.stdout.write(f'Processed up to id {last_pk}: {updated} updated, {duplicates} duplicates.')
+    self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} URL digests, {duplicates} duplicates left empty.'))
+
+  def hash_batch(self, batch):
+    new_hashes = {shortened_url.pk: hash_url(shortened_url.original_url) for shortened_url in batch}
+    batch_pks = set(new_hashes)
+    taken = set(
+      ShortenedUrl.objects.filter(
+        user_id__in={shortened_url.user_id for shortened_url in batch if shortened_url.user_id},
+        url_hash__in=set(new_hashes.values())
+      ).exclude(pk__in=batch_pks).exclude(url_hash='').values_list('user_id', 'url_hash')
+    )
+    changed = []
+    skipped = 0
+    for shortened_url in batch:
+      url_hash = new_hashes[shortened_url.pk]
+      if shortened_url.user_id:
+        key = (shortened_url.user_id, url_hash)
+        if key in taken:
+          url_hash = ''
+          skipped += 1
+        else:
+          taken.add(key)
+      if shortened_url.url_hash != url_hash:
+        shortened_url.url_hash = url_hash
+        changed.append(shortened_url)
+    return changed, skipped
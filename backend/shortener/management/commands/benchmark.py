@@ -0,0 +1,170 @@
+import itertools
+import json
+import platform
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.hashers import password_pool
+from authentication.models import User
+from authentication.tokens import RefreshToken
+from shortener.allocators import get_code_allocator
+from shortener.benchmarking import benchmark_databases, compare_results, format_table, measure
+from shortener.cache import url_cache
+from shortener.clicks import click_aggregator
+from shortener.models import ShortenedUrl
+from shortener.ratelimit import rate_limiter
+from shortener.utils import build_short_url, hash_url
+
+SEED_BATCH_SIZE = 5000
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+def generate_users(count: int):
+  """
+  Yields `count` unsaved users sharing one password hash, so seeding does not pay for a hash per user.
+  """
+  password = make_password(BENCHMARK_PASSWORD)
+  for index in range(count):
+    yield User(email=f'user{index}@example.com', username=f'user{index}', password=password)
+
+def generate_links(user_ids: list, count: int):
+  """
+  Yields `count` unsaved links spread round robin over `user_ids`, with short codes from the configured allocator.
+  """
+  allocator = get_code_allocator()
+  for start in range(0, count, SEED_BATCH_SIZE):
+    indexes = range(start, min(start + SEED_BATCH_SIZE, count))
+    for index, short_code in zip(indexes, allocator.allocate_many(len(indexes))):
+      original_url = f'https://seed.example.com/{index}'
+      yield ShortenedUrl(
+        original_url=original_url,
+        url_hash=hash_url(original_url),
+        short_code=short_code,
+        shortened_url=build_short_url(short_code),
+        user_id=user_ids[index % len(user_ids)],
+      )
+
+def save_in_batches(model, objects):
+  for batch in iter(lambda: list(itertools.islice(objects, SEED_BATCH_SIZE)), []):
+    with transaction.atomic():
+      model.objects.bulk_create(batch)
+
+
+class Command(BaseCommand):
+  """
+  Benchmarks the main endpoints through the full middleware stack with Django's test client: redirects, anonymous and
+  authenticated shortening, the first page of a user's links, login and token refresh.
+  It seeds --users users and --links links into a throwaway test database created from the configured one, so the
+  same run works on SQLite and on a local Postgres, and reports throughput, p50/p95/p99 latency and queries per request.
+  Rate limiting is off and clicks are flushed after the run, login and refresh use --auth-requests since every login
+  hashes a password.
+  With --output the results are written as JSON, and with --baseline they are compared against such a file and the
+  command fails on any regression beyond --tolerance, which makes it usable as a CI gate.
+  """
+  help = 'Seed users and links and measure latency, throughput and queries per request of the main endpoints.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--auth-requests', type=int, default=100, help='Requests for login and token refresh.')
+    parser.add_argument('--output', help='Write the results as JSON to this file, - for standard output.')
+    parser.add_argument('--baseline', help='Compare the results against a JSON file written with --output.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed latency and throughput regression.')
+
+  def handle(self, *args, **options):
+    if options['users'] < 1:
+      raise CommandError('--users must be at least 1.')
+    baseline = None
+    if options['baseline']:
+      with open(options['baseline']) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+
+    click_aggregator.background = False
+    rate_limiter.enabled = False
+    try:
+      with benchmark_databases():
+        results = self.run_benchmarks(options)
+    finally:
+      password_pool.shutdown()
+
+    report = {
+      'created_at': timezone.now().isoformat(),
+      'database': connection.vendor,
+      'python': platform.python_version(),
+      'options': {name: options[name] for name in ('users', 'links', 'requests', 'auth_requests')},
+      'results': results,
+    }
+    if options['output'] == '-':
+      self.stdout.write(json.dumps(report, indent=2))
+    else:
+      self.stdout.write(format_table(results))
+      if options['output']:
+        with open(options['output'], 'w') as output_file:
+          json.dump(report, output_file, indent=2)
+
+    if baseline is not None:
+      regressions = compare_results(results, baseline, options['tolerance'])
+      if regressions:
+        raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+      self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+  def run_benchmarks(self, options):
+    save_in_batches(User, generate_users(options['users']))
+    users = list(User.objects.order_by('pk'))
+    save_in_batches(ShortenedUrl, generate_links([user.pk for user in users], options['links']))
+    short_codes = list(ShortenedUrl.objects.order_by('?').values_list('short_code', flat=True)[:1000])
+    if not short_codes:
+      raise CommandError('--links must be at least 1.')
+
+    client = Client()
+    headers = [{'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} for user in users]
+    # Refresh tokens are rotated and blacklisted after use, so each user refreshes with the token of its last refresh.
+    refresh_tokens = [str(RefreshToken.for_user(user)) for user in users]
+    new_urls = itertools.count()
+
+    def refresh(index):
+      position = index % len(users)
+      response = client.post(
+        '/authentication/token/refresh/', {'refresh': refresh_tokens[position]},
+        content_type='application/json', secure=True
+      )
+      if response.status_code == 200:
+        refresh_tokens[position] = response.json()['refresh']
+      return response
+
+    endpoints = {
+      'redirect': (options['requests'], lambda index: client.get(
+        '/' + short_codes[index % len(short_codes)], secure=True
+      )),
+      'shorten anonymous': (options['requests'], lambda index: client.post(
+        '/shortener/shorten-url/', {'original_url': f'https://new.example.com/{next(new_urls)}'},
+        content_type='application/json', secure=True
+      )),
+      'shorten user': (options['requests'], lambda index: client.post(
+        '/shortener/shorten-url/', {'original_url': f'https://new.example.com/{next(new_urls)}'},
+        content_type='application/json', secure=True, **headers[index % len(users)]
+      )),
+      'user urls': (options['requests'], lambda index: client.get(
+        '/shortener/user-urls/', secure=True, **headers[index % len(users)]
+      )),
+      'login': (options['auth_requests'], lambda index: client.post(
+        '/authentication/login/', {'email': users[index % len(users)].email, 'password': BENCHMARK_PASSWORD},
+        content_type='application/json', secure=True
+      )),
+      'token refresh': (options['auth_requests'], refresh),
+    }
+
+    url_cache.clear()
+    results = {}
+    for label, (requests, call) in endpoints.items():
+      results[label] = measure(lambda index: self.check_response(label, call(index)), requests, warmup=min(50, requests))
+    click_aggregator.flush()
+    return results
+
+  def check_response(self, label, response):
+    # A failing endpoint is usually fast, so its timings would pass any baseline.
+    if response.status_code >= 400:
+      raise CommandError(f'{label} returned {response.status_code}: {response.content[:200]!r}')
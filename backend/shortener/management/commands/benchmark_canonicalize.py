@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from shortener.benchmarking import format_table, measure
+from shortener.models import ShortenedUrl
+from shortener.utils import canonicalization_options, canonicalize_url, is_canonical_url, rebuild_url
+
+class Command(BaseCommand):
+  """
+  Benchmarks URL canonicalization over a corpus of real URLs, one per line in --corpus or,
+  by default, the original URLs already stored in the database.
+  It compares canonicalize_url against always parsing and rebuilding, and reports how many URLs took the
+  fast path and how many distinct URLs remain once equivalent ones are merged.
+  """
+  help = 'Measure URL canonicalization cost and its deduplication effect on a URL corpus.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--corpus', help='File with one URL per line, defaults to the stored original URLs.')
+    parser.add_argument('--limit', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=3, help='Passes over the corpus per measurement.')
+
+  def handle(self, *args, **options):
+    urls = self.load_corpus(options['corpus'], options['limit'])
+    if not urls:
+      raise CommandError('The URL corpus is empty.')
+    requests = len(urls) * options['rounds']
+    canonical_options = canonicalization_options()
+
+    results = {
+      'canonicalize_url': measure(lambda index: canonicalize_url(urls[index % len(urls)], canonical_options), requests),
+      'always rebuild': measure(lambda index: rebuild_url(urls[index % len(urls)].strip(), canonical_options), requests),
+    }
+    self.stdout.write(format_table(results))
+
+    fast = sum(1 for url in urls if is_canonical_url(url.strip(), canonical_options))
+    distinct = len(set(url.strip() for url in urls))
+    canonical = len(set(canonicalize_url(url, canonical_options) for url in urls))
+    self.stdout.write(
+      f'{len(urls)} URLs, {fast} ({fast / len(urls):.1%}) on the fast path, '
+      f'{distinct} distinct as given, {canonical} distinct after canonicalization.'
+    )
+
+  def load_corpus(self, path, limit):
+    if path:
+      with open(path, encoding='utf-8') as corpus:
+        return [line.strip() for line, _ in zip(filter(str.strip, corpus), range(limit))]
+    return list(ShortenedUrl.objects.values_list('original_url', flat=True)[:limit])
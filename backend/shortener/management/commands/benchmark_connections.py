@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from shortener.benchmarking import benchmark_databases, format_table, measure, wsgi_get
+from shortener.cache import url_cache
+from shortener.clicks import click_aggregator
+from shortener.instrumentation import database_pool_stats
+from shortener.models import ShortenedUrl
+from shortener.ratelimit import rate_limiter
+
+class Command(BaseCommand):
+  """
+  Benchmarks redirects that miss the cache, so every request queries the default database, with a new connection per
+  request (CONN_MAX_AGE=0), with persistent connections with and without health checks, and on PostgreSQL with
+  psycopg[pool] installed through a connection pool.
+  Requests go through backend.wsgi.application, whose request_started and request_finished signals open and close
+  connections as they would in production, against a throwaway test database.
+  Django never closes an in-memory SQLite test database, so only PostgreSQL shows the full connection setup cost.
+  """
+  help = 'Compare redirect latency with per-request, persistent, health-checked and pooled database connections.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--pool-size', type=int, default=4)
+
+  def handle(self, *args, **options):
+    from backend.wsgi import application
+
+    click_aggregator.background = False
+    rate_limiter.enabled = False
+    connection = connections['default']
+    settings_dict = connection.settings_dict
+    modes = {
+      'new connection': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'pool': None},
+      'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': False, 'pool': None},
+      'persistent checked': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True, 'pool': None},
+    }
+    if connection.vendor == 'postgresql':
+      try:
+        from psycopg_pool import ConnectionPool
+      except ImportError:
+        self.stderr.write('psycopg_pool is not installed, skipping the pooled run.')
+      else:
+        modes['pooled'] = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'pool': {
+          'min_size': options['pool_size'],
+          'max_size': options['pool_size'],
+          'check': ConnectionPool.check_connection,
+        }}
+    else:
+      self.stderr.write(f'Running on {connection.vendor}, use PostgreSQL to measure the full connection setup cost.')
+
+    original = {name: settings_dict.get(name) for name in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    original_pool = settings_dict['OPTIONS'].get('pool')
+    results = {}
+    with benchmark_databases():
+      links = ShortenedUrl.objects.bulk_get_or_create_for_user(
+        [f'https://example.com/{index}' for index in range(options['links'])]
+      )
+      paths = ['/' + shortened_url.short_code for shortened_url, created in links]
+
+      def redirect(index):
+        # Clearing the cache is a dict clear, it keeps every redirect on the database without timing a miss path.
+        url_cache.clear()
+        return wsgi_get(application, paths[index % len(paths)])
+
+      try:
+        for label, mode in modes.items():
+          self.configure(connection, mode)
+          results[label] = measure(redirect, options['requests'])
+          if mode['pool']:
+            self.stdout.write(f'{label}: {database_pool_stats()}')
+      finally:
+        self.configure(connection, {**original, 'pool': original_pool})
+      click_aggregator.flush()
+
+    self.stdout.write(format_table(results))
+
+  def configure(self, connection, mode):
+    connection.close()
+    if connection.vendor == 'postgresql':
+      connection.close_pool()
+    connection.settings_dict['CONN_MAX_AGE'] = mode['CONN_MAX_AGE']
+    connection.settings_dict['CONN_HEALTH_CHECKS'] = mode['CONN_HEALTH_CHECKS']
+    if mode['pool']:
+      connection.settings_dict['OPTIONS']['pool'] = mode['pool']
+    else:
+      connection.settings_dict['OPTIONS'].pop('pool', None)
@@ -0,0 +1,102 @@
+import json
+import tempfile
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.models import User
+from shortener.allocators import sequence_to_code
+from shortener.benchmarking import benchmark_databases, wsgi_request
+from shortener.models import ShortenedUrl
+from shortener.ratelimit import rate_limiter
+from shortener.utils import build_short_url, hash_url
+
+SEED_BATCH_SIZE = 5000
+
+class Command(BaseCommand):
+  """
+  Benchmarks the streaming CSV and NDJSON exports on a user with --rows links, and the streaming import of --rows
+  new URLs from a CSV and an NDJSON file, each into a fresh user.
+  Requests go through backend.wsgi.application against a throwaway test database, and import bodies are read
+  from temporary files, so the request body is never held in memory.
+  With --memory the peak Python allocation of each run is traced as well, which slows the runs down.
+  """
+  help = 'Measure streaming export and import throughput and memory at a large number of links.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--memory', action='store_true', help='Trace the peak memory allocated by each run.')
+
+  def handle(self, *args, **options):
+    from backend.wsgi import application
+
+    rows = options['rows']
+    rate_limiter.enabled = False
+    results = []
+    with benchmark_databases():
+      exporter = self.create_user('export')
+      started = time.perf_counter()
+      self.seed(exporter, rows)
+      self.stdout.write(f'Seeded {rows} links in {time.perf_counter() - started:.1f}s.')
+
+      for label, path in (('export csv', '/shortener/export/csv/'), ('export ndjson', '/shortener/export/ndjson/')):
+        results.append(self.run(label, rows, options['memory'], lambda: wsgi_request(
+          application, 'GET', path, headers=self.auth_headers(exporter)
+        )))
+
+      for label, content_type, write_line in (
+        ('import csv', 'text/csv', lambda index: f'https://import.example.com/{index}\n'),
+        ('import ndjson', 'application/x-ndjson', lambda index: json.dumps(f'https://import.example.com/{index}') + '\n'),
+      ):
+        importer = self.create_user(label.replace(' ', '-'))
+        with tempfile.TemporaryFile() as body:
+          if content_type == 'text/csv':
+            body.write(b'original_url\n')
+          for index in range(rows):
+            body.write(write_line(index).encode())
+          results.append(self.run(label, rows, options['memory'], lambda: wsgi_request(
+            application, 'POST', '/shortener/import/', body=body, content_type=content_type,
+            headers=self.auth_headers(importer)
+          )))
+        imported = ShortenedUrl.objects.filter(user=importer).count()
+        if imported != rows:
+          self.stderr.write(f'{label} imported {imported} of {rows} URLs.')
+
+    self.stdout.write(' '.join(column.rjust(16) for column in ('', 'status', 'rows', 'seconds', 'rows_per_s', 'response_mb', 'peak_memory_mb')))
+    for result in results:
+      self.stdout.write(' '.join(str(value).rjust(16) for value in result))
+
+  def create_user(self, name):
+    return User.objects.create_user(email=f'{name}@example.com', username=name, password='benchmark-password')
+
+  def auth_headers(self, user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+
+  def seed(self, user, rows):
+    for start in range(0, rows, SEED_BATCH_SIZE):
+      batch = []
+      for index in range(start, min(start + SEED_BATCH_SIZE, rows)):
+        original_url = f'https://export.example.com/{index}'
+        short_code = sequence_to_code(index)
+        batch.append(ShortenedUrl(
+          original_url=original_url,
+          url_hash=hash_url(original_url),
+          short_code=short_code,
+          shortened_url=build_short_url(short_code),
+          user=user,
+        ))
+      with transaction.atomic():
+        ShortenedUrl.objects.bulk_create(batch)
+
+  def run(self, label, rows, trace_memory, request):
+    if trace_memory:
+      tracemalloc.start()
+    started = time.perf_counter()
+    status, received = request()
+    elapsed = time.perf_counter() - started
+    peak = '-'
+    if trace_memory:
+      peak = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+      tracemalloc.stop()
+    return label, status, rows, round(elapsed, 2), round(rows / elapsed), round(received / 2 ** 20, 1), peak
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from shortener.benchmarking import (
+  asgi_get,
+  benchmark_databases,
+  format_table,
+  measure,
+  measure_async,
+  measure_threaded,
+  wsgi_get,
+)
+from shortener.cache import url_cache
+from shortener.clicks import click_aggregator
+from shortener.models import ShortenedUrl
+from shortener.ratelimit import parse_rate, rate_limiter
+
+class Command(BaseCommand):
+  """
+  Benchmarks the per-request cost of a redirect through the full middleware stack and through RedirectMiddleware.
+  With --concurrency it also compares backend.wsgi.application served from a thread pool against
+  backend.asgi.application served from a single event loop, both called directly without a test client.
+  Rate limiting is off except for the runs with an unreachable redirect limit, which show its overhead.
+  It runs in-process against a throwaway test database seeded with anonymous links. With REDIS_URL set the shared
+  cache tier, the rate limit counters and the click buffer live in Redis, as they would in production.
+  """
+  help = 'Compare redirect latency through the full middleware stack, the lean redirect path, and WSGI against ASGI.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=0)
+
+  def handle(self, *args, **options):
+    lean_middleware = list(settings.MIDDLEWARE)
+    full_middleware = [name for name in lean_middleware if name != 'shortener.middleware.RedirectMiddleware']
+    requests = options['requests']
+
+    # Clicks are flushed after the run instead of by the background thread, so flushes never overlap the timed requests.
+    click_aggregator.background = False
+    # Every request comes from the same address, a real limit would turn most of them into 429s.
+    rate_limiter.enabled = False
+    with benchmark_databases():
+      links = ShortenedUrl.objects.bulk_get_or_create_for_user(
+        [f'https://example.com/{index}' for index in range(options['links'])]
+      )
+      paths = ['/' + shortened_url.short_code for shortened_url, created in links]
+
+      results = {}
+      for label, middleware in (('full stack', full_middleware), ('lean', lean_middleware)):
+        with override_settings(MIDDLEWARE=middleware):
+          url_cache.clear()
+          client = Client()
+          results[label] = measure(
+            lambda index: client.get(paths[index % len(paths)], secure=True),
+            requests
+          )
+      rate_limiter.enabled = True
+      rate_limiter.rates['redirect'] = parse_rate(f'{requests * 10}/d')
+      results['lean rate limited'] = measure(
+        lambda index: client.get(paths[index % len(paths)], secure=True),
+        requests
+      )
+      rate_limiter.enabled = False
+
+      concurrency = options['concurrency']
+      if concurrency:
+        from backend.asgi import application as asgi_application
+        from backend.wsgi import application as wsgi_application
+
+        # The sequential runs above have warmed the cache, so these measure the steady state of hot links.
+        results[f'wsgi x{concurrency}'] = measure_threaded(
+          lambda index: wsgi_get(wsgi_application, paths[index % len(paths)]),
+          requests,
+          concurrency
+        )
+        results[f'asgi x{concurrency}'] = measure_async(
+          lambda index: asgi_get(asgi_application, paths[index % len(paths)]),
+          requests,
+          concurrency
+        )
+        rate_limiter.enabled = True
+        results[f'asgi x{concurrency} rate limited'] = measure_async(
+          lambda index: asgi_get(asgi_application, paths[index % len(paths)]),
+          requests,
+          concurrency
+        )
+        rate_limiter.enabled = False
+      click_aggregator.flush()
+
+    self.stdout.write(format_table(results))
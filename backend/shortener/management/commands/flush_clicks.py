@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from shortener.clicks import click_aggregator
+
+class Command(BaseCommand):
+  """
+  Drains the click buffer and writes the buffered counts to the database.
+  With the shared cache backend this drains clicks recorded by every worker.
+  With the local backend each worker flushes its own buffer on its interval and at shutdown.
+  """
+  help = 'Flush buffered click counts to the database.'
+
+  def handle(self, *args, **options):
+    total = 0
+    while True:
+      flushed = click_aggregator.flush()
+      if not flushed:
+        break
+      total += flushed
+    self.stdout.write(self.style.SUCCESS(f'Flushed {total} clicks.'))
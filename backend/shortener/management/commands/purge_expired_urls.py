@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from shortener.cache import url_cache
+from shortener.models import FreeShortCode, ShortenedUrl
+from shortener.stats import adjust_user_stats
+
+PURGE_FIELDS = ('pk', 'short_code', 'user_id', 'click_count')
+
+class Command(BaseCommand):
+  """
+  Deletes links past their expiry time and links that used up their clicks, in batches of --batch-size with one
+  transaction per batch, so a large backlog never holds long locks on the links table.
+  Expired links are walked in (expires_at, id) order and click-limited links in id order, each through its partial
+  index and with a keyset cursor, so every batch starts where the previous one stopped instead of rescanning deleted
+  rows. Click events, rollups and stats of the deleted links go with them, and their codes are added to the free code
+  pool when SHORTENER_EXPIRATION['RECYCLE_CODES'] is set. Meant to run on a schedule, e.g. hourly from cron.
+  Rows are deleted with raw DELETEs, since a queryset delete would send post_delete and update the owner's stats once
+  per link. The stats of a batch are adjusted together instead, and its codes dropped from the cache at once.
+  """
+  help = 'Delete expired and used up links in batches and free their short codes.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+
+  def handle(self, *args, **options):
+    now = timezone.now()
+    self.recycle = getattr(settings, 'SHORTENER_EXPIRATION', {}).get('RECYCLE_CODES', False)
+    self.purged = 0
+
+    expired = ShortenedUrl.objects.filter(expires_at__lte=now).order_by('expires_at', 'pk')
+    cursor = None
+    while True:
+      batch = expired if cursor is None else expired.filter(
+        Q(expires_at__gt=cursor[0]) | Q(expires_at=cursor[0], pk__gt=cursor[1])
+      )
+      rows = list(batch.values_list('expires_at', *PURGE_FIELDS)[:options['batch_size']])
+      if not rows:
+        break
+      cursor = rows[-1][:2]
+      self.purge([row[1:] for row in rows], now, options)
+
+    used_up = ShortenedUrl.objects.filter(
+      max_clicks__isnull=False, click_count__gte=F('max_clicks')
+    ).order_by('pk')
+    last_pk = 0
+    while True:
+      rows = list(used_up.filter(pk__gt=last_pk).values_list(*PURGE_FIELDS)[:options['batch_size']])
+      if not rows:
+        break
+      last_pk = rows[-1][0]
+      self.purge(rows, now, options)
+
+    self.stdout.write(self.style.SUCCESS(f'Purged {self.purged} expired links.'))
+
+  def purge(self, rows, now, options):
+    pks = [pk for pk, short_code, user_id, click_count in rows]
+    links, clicks = Counter(), Counter()
+    for pk, short_code, user_id, click_count in rows:
+      links[user_id] -= 1
+      clicks[user_id] -= click_count
+    with transaction.atomic():
+      if self.recycle:
+        FreeShortCode.objects.bulk_create(
+          [FreeShortCode(code=short_code, freed_at=now) for pk, short_code, user_id, click_count in rows],
+          ignore_conflicts=True
+        )
+      # Click events and rollups cascade from the links and have no further relations or signals of their own.
+      for relation in ShortenedUrl._meta.related_objects:
+        relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': pks})._raw_delete(
+          ShortenedUrl.objects.db
+        )
+      self.purged += ShortenedUrl.objects.filter(pk__in=pks)._raw_delete(ShortenedUrl.objects.db)
+      adjust_user_stats({user_id: (links[user_id], clicks[user_id]) for user_id in links})
+    url_cache.delete_many([short_code for pk, short_code, user_id, click_count in rows])
+    self.stdout.write(f'Purged {self.purged} links so far.')
+    if options['sleep']:
+      time.sleep(options['sleep'])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shortener.stats import rebuild_user_stats
+
+class Command(BaseCommand):
+  """
+  Recomputes the per-user link stats from the shortened URLs, repairing drift from interrupted flushes.
+  """
+  help = 'Rebuild the per-user link stats from the shortened URLs.'
+
+  def handle(self, *args, **options):
+    rebuild_user_stats()
+    self.stdout.write(self.style.SUCCESS('Rebuilt user link stats.'))
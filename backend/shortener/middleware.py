@@ -0,0 +1,49 @@
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .views import abuild_redirect_response, build_redirect_response
+
+SHORT_CODE_PATH = re.compile(r'^/([A-Za-z0-9]+)$')
+
+class RedirectMiddleware:
+  """
+  Middleware that answers GET and HEAD requests for /<short_code> directly.
+  It sits right after SecurityMiddleware, so redirects keep the HTTPS redirect and security headers
+  but skip sessions, CSRF, authentication, messages and URL resolution.
+  Every other request passes through untouched.
+  The host is validated against ALLOWED_HOSTS first, as CommonMiddleware would, so a disallowed host gets a 400.
+  Under ASGI it runs as a coroutine and resolves codes with the async cache and ORM, without a thread per request.
+  It is disabled when SHORTENER_LEAN_REDIRECT is false, and redirect_url then serves the codes through the full stack.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    if not getattr(settings, 'SHORTENER_LEAN_REDIRECT', True):
+      raise MiddlewareNotUsed
+    self.get_response = get_response
+    if iscoroutinefunction(self.get_response):
+      markcoroutinefunction(self)
+
+  def match(self, request):
+    if request.method not in ('GET', 'HEAD'):
+      return None
+    match = SHORT_CODE_PATH.match(request.path_info)
+    if match is not None:
+      request.get_host()
+    return match
+
+  def __call__(self, request):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+    match = self.match(request)
+    if match is not None:
+      return build_redirect_response(request, match.group(1))
+    return self.get_response(request)
+
+  async def __acall__(self, request):
+    match = self.match(request)
+    if match is not None:
+      return await abuild_redirect_response(request, match.group(1))
+    return await self.get_response(request)
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 00:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0005_codesequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='shortener_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-18 00:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0006_shortenedurl_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clicked_at', models.DateTimeField()),
+                ('referrer', models.CharField(blank=True, max_length=255)),
+                ('agent_class', models.CharField(choices=[('desktop', 'Desktop'), ('mobile', 'Mobile'), ('tablet', 'Tablet'), ('bot', 'Bot'), ('other', 'Other')], default='other', max_length=10)),
+                ('country', models.CharField(blank=True, max_length=2)),
+                ('shortened_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='click_events', to='shortener.shortenedurl')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('shortened_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shortener.shortenedurl')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('shortened_url', 'bucket'), name='shortener_daily_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('shortened_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shortener.shortenedurl')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('shortened_url', 'bucket'), name='shortener_hourly_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-18 00:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_user_link_stats(apps, schema_editor):
+    ShortenedUrl = apps.get_model('shortener', 'ShortenedUrl')
+    UserLinkStats = apps.get_model('shortener', 'UserLinkStats')
+    totals = ShortenedUrl.objects.filter(user__isnull=False).values('user_id').annotate(
+        links=Count('id'),
+        clicks=Sum('click_count'),
+    )
+    UserLinkStats.objects.bulk_create(
+        [UserLinkStats(user_id=row['user_id'], link_count=row['links'], total_clicks=row['clicks'] or 0) for row in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('shortener', '0007_click_analytics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLinkStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='link_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('link_count', models.IntegerField(default=0)),
+                ('total_clicks', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['user', '-click_count'], name='shortener_user_clicks_idx'),
+        ),
+        migrations.RunPython(backfill_user_link_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 00:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0008_user_link_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='url_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='shortenedurl',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False), models.Q(('url_hash', ''), _negated=True)), fields=('user', 'url_hash'), name='shortener_user_url_hash_unique'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-18 00:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0009_shortenedurl_url_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreeShortCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('freed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='max_clicks',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at', 'id'], name='shortener_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(condition=models.Q(('max_clicks__isnull', False)), fields=['id'], name='shortener_max_clicks_idx'),
+        ),
+    ]
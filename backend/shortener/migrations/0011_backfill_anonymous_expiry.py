@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:10
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 10000
+
+
+def backfill_anonymous_expiry(apps, schema_editor):
+    """
+    Gives anonymous links created before expiration existed the anonymous TTL, counted from now rather than from their
+    creation, so old public links keep working for a full TTL after the upgrade instead of expiring all at once.
+    """
+    ttl = getattr(settings, 'SHORTENER_EXPIRATION', {}).get('ANONYMOUS_TTL')
+    if not ttl:
+        return
+    ShortenedUrl = apps.get_model('shortener', 'ShortenedUrl')
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    pending = ShortenedUrl.objects.filter(user__isnull=True, expires_at__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        pks = list(pending.filter(pk__gt=last_pk).values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        ShortenedUrl.objects.filter(pk__in=pks).update(expires_at=expires_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0010_link_expiration'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_anonymous_expiry, migrations.RunPython.noop),
+    ]
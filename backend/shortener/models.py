@@ -1,20 +1,201 @@
-import random
-import string
+from contextlib import nullcontext
+from datetime import timedelta
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .allocators import get_code_allocator
+from .utils import build_short_url, hash_url
+
+def savepoint_if_needed(using):
+  """
+  Returns a savepoint context inside an outer transaction, where a failed INSERT would otherwise break it,
+  and a no-op context in autocommit mode, where the INSERT is atomic on its own.
+  """
+  if transaction.get_connection(using).in_atomic_block:
+    return transaction.atomic(using=using)
+  return nullcontext()
+
+def anonymous_expiry():
+  """
+  Returns when a link created now without a user expires, or None if SHORTENER_EXPIRATION has no ANONYMOUS_TTL.
+  """
+  ttl = getattr(settings, 'SHORTENER_EXPIRATION', {}).get('ANONYMOUS_TTL')
+  return timezone.now() + timedelta(seconds=ttl) if ttl else None
+
+class ShortenedUrlManager(models.Manager):
+  """
+  Manager for the ShortenedUrl model.
+  It has methods to get the user's existing shortened URLs for original URLs or create them, one at a time or in bulk.
+  Users are passed by id, so callers authenticated from a token never need to load the user row.
+  Existing URLs are matched on the URL digest through the unique (user, url_hash) index, an expired match is deleted
+  and replaced by a new link.
+  """
+  def live(self, now=None):
+    """
+    Returns the links that have neither reached their expiry time nor used up their clicks.
+    """
+    now = now or timezone.now()
+    return self.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now)).exclude(
+      max_clicks__isnull=False, click_count__gte=F('max_clicks')
+    )
+
+  def with_url_hashes(self, user_id, url_hashes):
+    """
+    Returns the user's links with the given URL digests.
+    The query repeats the condition of the partial unique index on (user, url_hash), since SQLite, and PostgreSQL for
+    IN lists of more than 100 values, only use a partial index when the query implies its condition.
+    """
+    return self.filter(user_id=user_id, url_hash__in=url_hashes).exclude(url_hash='')
+
+  def get_or_create_for_user(self, original_url, user_id, expires_at=None, max_clicks=None):
+    url_hash = hash_url(original_url)
+    existing_url = self.with_url_hashes(user_id, [url_hash]).first()
+    if existing_url and existing_url.is_expired():
+      existing_url.delete()
+      existing_url = None
+    if existing_url:
+      return existing_url, False
+    try:
+      with savepoint_if_needed(self.db):
+        return self.create(
+          original_url=original_url, url_hash=url_hash, user_id=user_id, expires_at=expires_at, max_clicks=max_clicks
+        ), True
+    except IntegrityError:
+      # A concurrent request created the same URL for the user first.
+      existing_url = self.with_url_hashes(user_id, [url_hash]).first()
+      if existing_url is None:
+        raise
+      return existing_url, False
+
+  def bulk_get_or_create_for_user(self, original_urls, user_id=None, batch_size=1000, expiries=None):
+    """
+    Bulk variant of get_or_create_for_user, returning a (shortened URL, created) pair for each original URL in order.
+    Existing links of the user are found by URL digest with one query per chunk, codes are allocated in bulk and
+    new rows are inserted with bulk_create, retrying only the rows whose codes collided.
+    expiries optionally holds a dict with the expires_at and max_clicks of each original URL, applied to new links only.
+    Anonymous links are never deduplicated, matching the single create path, and expire after the anonymous TTL.
+    """
+    url_hashes = [hash_url(original_url) for original_url in original_urls]
+    existing = {}
+    if user_id:
+      unique_hashes = list(dict.fromkeys(url_hashes))
+      now = timezone.now()
+      for start in range(0, len(unique_hashes), batch_size):
+        expired = []
+        for shortened_url in self.with_url_hashes(user_id, unique_hashes[start:start + batch_size]):
+          if shortened_url.is_expired(now):
+            expired.append(shortened_url.pk)
+          else:
+            existing[shortened_url.url_hash] = shortened_url
+        if expired:
+          self.filter(pk__in=expired).delete()
+
+    pending = {}
+    new_urls = []
+    limit = None if user_id else anonymous_expiry()
+    for original_url, url_hash, expiry in zip(original_urls, url_hashes, expiries or [{}] * len(original_urls)):
+      if url_hash in existing or (user_id and url_hash in pending):
+        continue
+      # bulk_create skips save(), so the anonymous TTL cap is applied here.
+      expires_at = expiry.get('expires_at')
+      if limit and (expires_at is None or expires_at > limit):
+        expires_at = limit
+      shortened_url = self.model(
+        original_url=original_url, url_hash=url_hash, user_id=user_id,
+        expires_at=expires_at, max_clicks=expiry.get('max_clicks')
+      )
+      new_urls.append(shortened_url)
+      if user_id:
+        pending[url_hash] = shortened_url
+
+    for start in range(0, len(new_urls), batch_size):
+      existing.update(self._bulk_insert_with_codes(new_urls[start:start + batch_size]))
+    new_urls = [shortened_url for shortened_url in new_urls if not user_id or shortened_url.url_hash not in existing]
+    if new_urls:
+      from .cache import url_cache
+      for shortened_url in new_urls:
+        url_cache.forget_missing(shortened_url.short_code)
+    if user_id and new_urls:
+      from .replicas import replicas
+      from .stats import adjust_user_stats
+      adjust_user_stats({user_id: (len(new_urls), 0)})
+      replicas.pin(user_id)
+
+    results = []
+    created_urls = iter(new_urls)
+    for url_hash in url_hashes:
+      if url_hash in existing:
+        results.append((existing[url_hash], False))
+      elif user_id:
+        # Later occurrences of the same URL in the batch resolve to the link created for the first one.
+        existing[url_hash] = pending[url_hash]
+        results.append((existing[url_hash], True))
+      else:
+        results.append((next(created_urls), True))
+    return results
+
+  def _bulk_insert_with_codes(self, shortened_urls):
+    """
+    Inserts a batch of shortened URLs with bulk_create after allocating their codes.
+    On a unique violation only the rows whose codes already exist get new codes before the batch is retried.
+    Rows whose URL a concurrent request created for the same user first are dropped from the batch, and the links that
+    request created are returned by URL digest so the caller can report them as existing.
+    """
+    allocator = get_code_allocator()
+    concurrent = {}
+    for attempt in range(allocator.max_attempts):
+      unassigned = [shortened_url for shortened_url in shortened_urls if not shortened_url.short_code]
+      assigned = {shortened_url.short_code for shortened_url in shortened_urls if shortened_url.short_code}
+      for shortened_url, code in zip(unassigned, allocator.allocate_many(len(unassigned))):
+        while code in assigned:
+          code = allocator.allocate()
+        assigned.add(code)
+        shortened_url.short_code = code
+        shortened_url.shortened_url = build_short_url(code)
+      try:
+        with transaction.atomic(using=self.db):
+          self.bulk_create(shortened_urls)
+        return concurrent
+      except IntegrityError:
+        taken = set(self.filter(short_code__in=assigned).values_list('short_code', flat=True))
+        user_id = shortened_urls[0].user_id
+        created = {}
+        if user_id:
+          created = {
+            shortened_url.url_hash: shortened_url for shortened_url in self.with_url_hashes(
+              user_id, [shortened_url.url_hash for shortened_url in shortened_urls]
+            )
+          }
+        if not (taken or created) or attempt == allocator.max_attempts - 1:
+          raise
+        concurrent.update(created)
+        shortened_urls = [shortened_url for shortened_url in shortened_urls if shortened_url.url_hash not in created]
+        if not shortened_urls:
+          return concurrent
+        # Only the colliding rows get new codes, the rest keep theirs for the next attempt.
+        for shortened_url in shortened_urls:
+          if shortened_url.short_code in taken:
+            shortened_url.short_code = ''
+
 
 class ShortenedUrl(models.Model):
   """
   Model for storing shortened URLs.
-  It contains the original URL, shortened code, shortened URL, click count, creation date and user.
-  It has a method to generate an unique short code and save the model instance.
+  It contains the original URL, its digest, shortened code, shortened URL, click count, creation date and user.
+  A link can expire at a point in time or after a number of clicks, and links without a user always expire after the
+  anonymous TTL. Expired links stop redirecting right away and are deleted later by purge_expired_urls.
+  It has a method to generate a short code and saves the model instance with a unique one.
   It has a many-to-one relationship with the user model (many shortened URLs can belong to one user).
   """
   original_url = models.URLField(max_length=100000)
+  url_hash = models.CharField(max_length=64, blank=True, editable=False)
   short_code = models.CharField(max_length=10, unique=True, blank=True)
   shortened_url = models.URLField(max_length=100000, blank=True)
   click_count = models.PositiveIntegerField(default=0)
   created_at = models.DateTimeField(auto_now_add=True)
+  expires_at = models.DateTimeField(null=True, blank=True)
+  max_clicks = models.PositiveIntegerField(null=True, blank=True)
   user = models.ForeignKey(
     settings.AUTH_USER_MODEL, 
     null=True, 
@@ -22,14 +203,149 @@ class ShortenedUrl(models.Model):
     on_delete=models.SET_NULL
   )
 
+  objects = ShortenedUrlManager()
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['user', '-created_at', '-id'], name='shortener_user_created_idx'),
+      models.Index(fields=['user', '-click_count'], name='shortener_user_clicks_idx'),
+      models.Index(fields=['expires_at', 'id'], condition=Q(expires_at__isnull=False), name='shortener_expires_idx'),
+      models.Index(fields=['id'], condition=Q(max_clicks__isnull=False), name='shortener_max_clicks_idx'),
+    ]
+    constraints = [
+      models.UniqueConstraint(
+        fields=['user', 'url_hash'],
+        condition=Q(user__isnull=False) & ~Q(url_hash=''),
+        name='shortener_user_url_hash_unique'
+      ),
+    ]
+
   def generate_short_code(self):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+    return get_code_allocator().allocate()
+
+  def is_expired(self, now=None) -> bool:
+    if self.max_clicks is not None and self.click_count >= self.max_clicks:
+      return True
+    return self.expires_at is not None and self.expires_at <= (now or timezone.now())
 
   def save(self, *args, **kwargs):
-    if not self.short_code:
-      while True:
-        new_code = self.generate_short_code()
-        if not ShortenedUrl.objects.filter(short_code=new_code).exists():
-          self.short_code = new_code
-          break
-    super().save(*args, **kwargs)
+    if self._state.adding and self.user_id is None:
+      limit = anonymous_expiry()
+      if limit and (self.expires_at is None or self.expires_at > limit):
+        self.expires_at = limit
+    if not self.url_hash:
+      self.url_hash = hash_url(self.original_url)
+    if self.short_code:
+      return super().save(*args, **kwargs)
+
+    # Insert optimistically and let the unique constraint on short_code catch collisions.
+    # The shortened URL is derived from the code up front, so a create is a single INSERT.
+    # A savepoint is only needed to survive a failed INSERT inside an outer transaction.
+    using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+    attempts = get_code_allocator().max_attempts
+    for attempt in range(attempts):
+      self.short_code = self.generate_short_code()
+      self.shortened_url = build_short_url(self.short_code)
+      try:
+        with savepoint_if_needed(using):
+          return super().save(*args, **kwargs)
+      except IntegrityError:
+        collided = ShortenedUrl.objects.using(using).filter(short_code=self.short_code).exists()
+        self.short_code = ''
+        self.shortened_url = ''
+        if not collided or attempt == attempts - 1:
+          raise
+
+
+class FreeShortCode(models.Model):
+  """
+  Model for short codes of purged links, handed out again by the allocator once they have been free for a while.
+  """
+  code = models.CharField(max_length=10, unique=True)
+  freed_at = models.DateTimeField(db_index=True)
+
+  def __str__(self):
+    return self.code
+
+
+class CodeSequence(models.Model):
+  """
+  Model for named counters used by the sequence based short code allocators.
+  Values are reserved in blocks by incrementing the counter with a single UPDATE.
+  """
+  name = models.CharField(max_length=50, unique=True)
+  value = models.BigIntegerField(default=0)
+
+  def __str__(self):
+    return f"{self.name}={self.value}"
+
+
+class ClickEvent(models.Model):
+  """
+  Model for raw click events, written in bulk and never updated.
+  It contains the clicked shortened URL, the click time, the referrer host, the user agent class and the country.
+  Stats are read from the rollup tables, never from this table.
+  """
+  AGENT_CLASSES = [
+    ('desktop', 'Desktop'),
+    ('mobile', 'Mobile'),
+    ('tablet', 'Tablet'),
+    ('bot', 'Bot'),
+    ('other', 'Other'),
+  ]
+
+  shortened_url = models.ForeignKey(ShortenedUrl, on_delete=models.CASCADE, related_name='click_events')
+  clicked_at = models.DateTimeField()
+  referrer = models.CharField(max_length=255, blank=True)
+  agent_class = models.CharField(max_length=10, choices=AGENT_CLASSES, default='other')
+  country = models.CharField(max_length=2, blank=True)
+
+
+class ClickRollup(models.Model):
+  """
+  Abstract model for click counts aggregated per shortened URL and time bucket.
+  Rows are created and incremented as buffered click events are flushed.
+  """
+  shortened_url = models.ForeignKey(ShortenedUrl, on_delete=models.CASCADE, related_name='+')
+  bucket = models.DateTimeField()
+  clicks = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    abstract = True
+
+
+class HourlyClickRollup(ClickRollup):
+  """
+  Model for click counts per shortened URL and hour.
+  """
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['shortened_url', 'bucket'], name='shortener_hourly_rollup_unique'),
+    ]
+
+
+class DailyClickRollup(ClickRollup):
+  """
+  Model for click counts per shortened URL and day.
+  """
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['shortened_url', 'bucket'], name='shortener_daily_rollup_unique'),
+    ]
+
+
+class UserLinkStats(models.Model):
+  """
+  Model for per-user link totals, kept up to date incrementally.
+  It contains the number of links and the total clicks of a user, and when they last changed.
+  The stats endpoints read this row instead of aggregating the user's shortened URLs.
+  """
+  user = models.OneToOneField(
+    settings.AUTH_USER_MODEL,
+    primary_key=True,
+    on_delete=models.CASCADE,
+    related_name='link_stats'
+  )
+  link_count = models.IntegerField(default=0)
+  total_clicks = models.BigIntegerField(default=0)
+  updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,73 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+  """
+  Keyset (cursor) pagination over (created_at, id), newest first.
+  Each page is a single index range scan that continues after the last row of the previous page,
+  so the cost of a page does not grow with its position.
+  The cursor is an opaque token encoding the created_at and id of the last row returned.
+  """
+  page_size = 50
+  max_page_size = 500
+  page_size_query_param = 'page_size'
+  cursor_query_param = 'cursor'
+  ordering = ('-created_at', '-id')
+  invalid_cursor_message = 'Invalid cursor'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    position = self.decode_cursor(request)
+    if position is not None:
+      created_at, pk = position
+      queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    page = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+    self.has_next = len(page) > self.page_size
+    page = page[:self.page_size]
+    self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+    return page
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.query_params[self.page_size_query_param])
+    except (KeyError, ValueError):
+      return self.page_size
+    return min(max(page_size, 1), self.max_page_size)
+
+  def encode_cursor(self, instance) -> str:
+    position = f"{instance.created_at.isoformat()}|{instance.pk}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+    try:
+      created_at, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+      created_at = parse_datetime(created_at)
+      pk = int(pk)
+    except (TypeError, ValueError):
+      raise NotFound(self.invalid_cursor_message)
+    if created_at is None:
+      raise NotFound(self.invalid_cursor_message)
+    return created_at, pk
+
+  def get_next_link(self):
+    if not self.next_cursor:
+      return None
+    url = self.request.build_absolute_uri()
+    return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+  def get_paginated_response(self, data):
+    return Response({
+      'next': self.get_next_link(),
+      'next_cursor': self.next_cursor,
+      'results': data
+    })
@@ -0,0 +1,22 @@
+import json
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class NDJSONParser(BaseParser):
+  """
+  Parser for newline delimited JSON request bodies.
+  It reads the stream line by line and returns the list of decoded values, skipping blank lines.
+  """
+  media_type = 'application/x-ndjson'
+
+  def parse(self, stream, media_type=None, parser_context=None):
+    items = []
+    for line_number, line in enumerate(stream, start=1):
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        items.append(json.loads(line))
+      except ValueError as error:
+        raise ParseError(f'NDJSON parse error on line {line_number}: {error}')
+    return items
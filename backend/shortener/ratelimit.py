@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+from .asynccache import AsyncCache
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_rate(rate):
+  """
+  Parses a rate such as '600/m' or '1000/day' into (requests, window in seconds), or None for no limit.
+  """
+  if not rate:
+    return None
+  requests, period = rate.split('/')
+  return int(requests), DURATIONS[period[0]]
+
+def forwarded_address(value: str, proxies: int = 1) -> str:
+  """
+  Returns the client address from an X-Forwarded-For style header that `proxies` trusted proxies appended to.
+  Each proxy appends the address it received the request from, so the client is the entry `proxies` places from the
+  right. Entries further left were sent by the client itself and can be anything.
+  """
+  addresses = [address.strip() for address in value.split(',')]
+  return addresses[-min(max(proxies, 1), len(addresses))]
+
+def client_ip(meta: dict, header: str = None, proxies: int = 1) -> str:
+  """
+  Returns the client address of a request from the configured proxy header, falling back to REMOTE_ADDR.
+  """
+  if header:
+    value = meta.get('HTTP_' + header.upper().replace('-', '_'), '')
+    if value:
+      return forwarded_address(value, proxies)
+  return meta.get('REMOTE_ADDR', '')
+
+def scope_client_ip(scope, header: str = None, proxies: int = 1) -> str:
+  """
+  ASGI variant of client_ip.
+  """
+  if header:
+    value = dict(scope.get('headers', ())).get(header.lower().encode(), b'').decode('latin-1')
+    if value:
+      return forwarded_address(value, proxies)
+  client = scope.get('client')
+  return client[0] if client else ''
+
+class LocalRateLimitBackend:
+  """
+  Keeps window counters in the memory of the current process, so limits apply per worker.
+  Counters of windows that can no longer be read are pruned every `prune_interval` seconds.
+  """
+  def __init__(self, prune_interval: float = 60):
+    self.prune_interval = prune_interval
+    self._counts = {}
+    self._lock = threading.Lock()
+    self._next_prune = time.monotonic() + prune_interval
+
+  def hit(self, key: str, window: int, ttl: int) -> tuple:
+    """
+    Increments the counter of `window` and returns it together with the counter of the previous window.
+    """
+    now = time.monotonic()
+    with self._lock:
+      if now >= self._next_prune:
+        self._counts = {name: entry for name, entry in self._counts.items() if entry[1] > now}
+        self._next_prune = now + self.prune_interval
+      entry = self._counts.get((key, window))
+      if entry is None:
+        entry = self._counts[(key, window)] = [0, now + ttl]
+      entry[0] += 1
+      previous = self._counts.get((key, window - 1))
+      return entry[0], previous[0] if previous else 0
+
+  async def ahit(self, key: str, window: int, ttl: int) -> tuple:
+    return self.hit(key, window, ttl)
+
+
+class CacheRateLimitBackend:
+  """
+  Keeps window counters in a shared Django cache with atomic incr, so limits apply across workers.
+  """
+  key_prefix = 'shortener:ratelimit:'
+
+  def __init__(self, alias: str = 'default'):
+    self.alias = alias
+
+  @property
+  def cache(self):
+    return caches[self.alias]
+
+  @property
+  def acache(self):
+    return AsyncCache(self.cache)
+
+  def hit(self, key: str, window: int, ttl: int) -> tuple:
+    current_key = f'{self.key_prefix}{key}:{window}'
+    self.cache.add(current_key, 0, timeout=ttl)
+    try:
+      current = self.cache.incr(current_key)
+    except ValueError:
+      self.cache.add(current_key, 1, timeout=ttl)
+      current = 1
+    return current, self.cache.get(f'{self.key_prefix}{key}:{window - 1}', 0)
+
+  async def ahit(self, key: str, window: int, ttl: int) -> tuple:
+    current_key = f'{self.key_prefix}{key}:{window}'
+    cache = self.acache
+    await cache.aadd(current_key, 0, timeout=ttl)
+    try:
+      current = await cache.aincr(current_key)
+    except ValueError:
+      await cache.aadd(current_key, 1, timeout=ttl)
+      current = 1
+    return current, await cache.aget(f'{self.key_prefix}{key}:{window - 1}', 0)
+
+
+class RateLimiter:
+  """
+  Sliding window rate limiter with one rate per scope, such as 'redirect' or 'shorten', and one counter per client.
+  The request count is the current fixed window plus the previous one weighted by how much of it still overlaps the
+  sliding window, which takes two counters per client instead of a log of timestamps.
+  A scope without a rate is not limited and costs nothing.
+  Clients are identified by `ip_header` as set by `trusted_proxies` proxies in front of the app, or by REMOTE_ADDR.
+  """
+  def __init__(self, backend, rates: dict, enabled: bool = True, ip_header: str = None, trusted_proxies: int = 1):
+    self.backend = backend
+    self.rates = {scope: parse_rate(rate) for scope, rate in rates.items()}
+    self.enabled = enabled
+    self.ip_header = ip_header
+    self.trusted_proxies = trusted_proxies
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'SHORTENER_RATE_LIMITS', {})
+    if options.get('BACKEND', 'local') == 'cache':
+      backend = CacheRateLimitBackend(alias=options.get('CACHE_ALIAS', 'default'))
+    else:
+      backend = LocalRateLimitBackend()
+    return cls(
+      backend,
+      options.get('RATES', {}),
+      enabled=options.get('ENABLED', True),
+      ip_header=options.get('IP_HEADER'),
+      trusted_proxies=options.get('TRUSTED_PROXIES', 1),
+    )
+
+  def client_ip(self, meta: dict) -> str:
+    return client_ip(meta, self.ip_header, self.trusted_proxies)
+
+  def scope_client_ip(self, scope) -> str:
+    return scope_client_ip(scope, self.ip_header, self.trusted_proxies)
+
+  def window(self, scope: str):
+    rate = self.rates.get(scope) if self.enabled else None
+    if rate is None:
+      return None
+    limit, duration = rate
+    now = time.time()
+    return limit, duration, int(now // duration), (now % duration) / duration
+
+  def retry_after(self, limit, duration, elapsed, current, previous) -> int:
+    if previous * (1 - elapsed) + current <= limit:
+      return 0
+    return max(1, math.ceil((1 - elapsed) * duration))
+
+  def hit(self, scope: str, ident: str) -> int:
+    """
+    Counts a request of `ident` in `scope` and returns 0 if it is allowed, or the seconds to wait otherwise.
+    """
+    window = self.window(scope)
+    if window is None:
+      return 0
+    limit, duration, index, elapsed = window
+    current, previous = self.backend.hit(f'{scope}:{ident}', index, duration * 2)
+    return self.retry_after(limit, duration, elapsed, current, previous)
+
+  async def ahit(self, scope: str, ident: str) -> int:
+    window = self.window(scope)
+    if window is None:
+      return 0
+    limit, duration, index, elapsed = window
+    current, previous = await self.backend.ahit(f'{scope}:{ident}', index, duration * 2)
+    return self.retry_after(limit, duration, elapsed, current, previous)
+
+
+rate_limiter = RateLimiter.from_settings()
+
+
+class RateLimitThrottle(BaseThrottle):
+  """
+  DRF throttle backed by rate_limiter, keyed by user id for authenticated requests and by client address otherwise.
+  Subclasses set `scope` to pick the rate.
+  """
+  scope = 'api'
+
+  def allow_request(self, request, view):
+    if request.user and request.user.is_authenticated:
+      ident = f'user:{request.user.id}'
+    else:
+      ident = f'ip:{rate_limiter.client_ip(request.META)}'
+    self.wait_seconds = rate_limiter.hit(self.scope, ident)
+    return not self.wait_seconds
+
+  def wait(self):
+    return self.wait_seconds
+
+
+class ShortenRateThrottle(RateLimitThrottle):
+  scope = 'shorten'
@@ -0,0 +1,192 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+from .asynccache import AsyncCache
+
+logger = logging.getLogger(__name__)
+
+# The replica alias that reads in the current context go to, None for the primary.
+current_replica = contextvars.ContextVar('current_replica', default=None)
+
+LAG_QUERIES = {
+  'postgresql': (
+    'SELECT CASE WHEN pg_is_in_recovery() '
+    'THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END'
+  ),
+}
+
+def replication_lag(alias: str) -> float:
+  """
+  Returns how many seconds the replica `alias` is behind its primary, 0 for backends that cannot tell, such as SQLite.
+  The PostgreSQL estimate is the age of the last replayed transaction, so it also grows while the primary is idle.
+  """
+  connection = connections[alias]
+  query = LAG_QUERIES.get(connection.vendor)
+  with connection.cursor() as cursor:
+    cursor.execute(query or 'SELECT 1')
+    return float(cursor.fetchone()[0] or 0) if query else 0.0
+
+
+class ReplicaSet:
+  """
+  Read replicas of the default database, chosen at random for reads that can tolerate a little staleness.
+  Every `check_interval` seconds one thread measures the lag of each replica, replicas behind by more than `max_lag`
+  seconds or failing the check are skipped until a later check finds them healthy again, and reads go to the primary
+  when no replica is healthy.
+  A user who just wrote links is pinned to the primary for `sticky_seconds` through the cache at `cache_alias`, so
+  their own reads see their writes.
+  """
+  key_prefix = 'shortener:replicas:pinned:'
+
+  def __init__(self, aliases, max_lag: float = 5, check_interval: float = 5, sticky_seconds: int = 10,
+               cache_alias: str = 'default'):
+    self.aliases = list(aliases)
+    self.max_lag = max_lag
+    self.check_interval = check_interval
+    self.sticky_seconds = sticky_seconds
+    self.cache_alias = cache_alias
+    self.healthy = list(self.aliases)
+    self._next_check = 0
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls):
+    options = getattr(settings, 'SHORTENER_REPLICAS', {})
+    return cls(
+      [alias for alias in settings.DATABASES if alias.startswith('replica')],
+      max_lag=options.get('MAX_LAG', 5),
+      check_interval=options.get('CHECK_INTERVAL', 5),
+      sticky_seconds=options.get('STICKY_SECONDS', 10),
+      cache_alias=options.get('CACHE_ALIAS', 'default'),
+    )
+
+  @property
+  def cache(self):
+    return caches[self.cache_alias]
+
+  @property
+  def acache(self):
+    return AsyncCache(self.cache)
+
+  def check_due(self) -> bool:
+    return bool(self.aliases) and time.monotonic() >= self._next_check
+
+  def check(self):
+    """
+    Measures the lag of every replica and keeps the ones within max_lag, skipped while another thread is checking.
+    """
+    if not self._lock.acquire(blocking=False):
+      return
+    try:
+      healthy = []
+      for alias in self.aliases:
+        try:
+          lag = replication_lag(alias)
+        except DatabaseError:
+          logger.warning('Read replica %s failed its health check.', alias, exc_info=True)
+          continue
+        if lag <= self.max_lag:
+          healthy.append(alias)
+        else:
+          logger.warning('Read replica %s is %.1f seconds behind, reading from the primary.', alias, lag)
+      self.healthy = healthy
+      self._next_check = time.monotonic() + self.check_interval
+    finally:
+      self._lock.release()
+
+  def mark_failed(self, alias: str):
+    """
+    Skips a replica whose query failed until the next check.
+    """
+    logger.warning('Read from replica %s failed, reading from the primary.', alias, exc_info=True)
+    self.healthy = [healthy for healthy in self.healthy if healthy != alias]
+
+  def pin(self, user_id):
+    if self.aliases and user_id:
+      self.cache.set(f'{self.key_prefix}{user_id}', 1, self.sticky_seconds)
+
+  def choose(self, user_id=None):
+    """
+    Returns the alias of a healthy replica for a read on behalf of `user_id`, or None to read from the primary.
+    """
+    if not self.aliases:
+      return None
+    if self.check_due():
+      self.check()
+    if not self.healthy or (user_id and self.cache.get(f'{self.key_prefix}{user_id}')):
+      return None
+    return random.choice(self.healthy)
+
+  async def achoose(self, user_id=None):
+    if not self.aliases:
+      return None
+    if self.check_due():
+      await sync_to_async(self.check)()
+    if not self.healthy or (user_id and await self.acache.aget(f'{self.key_prefix}{user_id}')):
+      return None
+    return random.choice(self.healthy)
+
+
+replicas = ReplicaSet.from_settings()
+
+def read_from_replica(read, user_id=None, retry_empty: bool = False):
+  """
+  Calls `read()` with its queries routed to a replica, and again on the primary if the replica fails.
+  With `retry_empty` a None result is read again from the primary as well, for lookups of rows that may have been
+  created after the replica's last replay.
+  """
+  alias = replicas.choose(user_id)
+  if alias is None:
+    return read()
+  token = current_replica.set(alias)
+  try:
+    result = read()
+    if result is not None or not retry_empty:
+      return result
+  except DatabaseError:
+    replicas.mark_failed(alias)
+  finally:
+    current_replica.reset(token)
+  return read()
+
+async def aread_from_replica(read, user_id=None, retry_empty: bool = False):
+  """
+  Async variant of read_from_replica for a coroutine function `read`.
+  """
+  alias = await replicas.achoose(user_id)
+  if alias is None:
+    return await read()
+  token = current_replica.set(alias)
+  try:
+    result = await read()
+    if result is not None or not retry_empty:
+      return result
+  except DatabaseError:
+    replicas.mark_failed(alias)
+  finally:
+    current_replica.reset(token)
+  return await read()
+
+
+class ReplicaRouter:
+  """
+  Sends reads made inside read_from_replica to the chosen replica and every other query to the primary.
+  Replicas are copies of the primary, so migrations only run on the primary.
+  """
+  def db_for_read(self, model, **hints):
+    return current_replica.get()
+
+  def db_for_write(self, model, **hints):
+    return 'default'
+
+  def allow_relation(self, obj1, obj2, **hints):
+    return True
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    return db == 'default'
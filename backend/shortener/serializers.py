@@ -1,10 +1,12 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import ShortenedUrl
 
 class ShortenedUrlSerializer(serializers.ModelSerializer):
   """
   Serializer for the ShortenedUrl model.
-  It returns the id, original URL, short code, shortened URL, creation date, click count and user.
+  It returns the id, original URL, short code, shortened URL, creation date, click count, expiry and user.
+  A link can be given an expiry time in the future and a maximum number of clicks.
   """
   class Meta:
     model = ShortenedUrl
@@ -15,6 +17,14 @@ class ShortenedUrlSerializer(serializers.ModelSerializer):
       'shortened_url', 
       'created_at', 
       'click_count', 
+      'expires_at',
+      'max_clicks',
       'user'
     ]
     read_only_fields = ['id', 'short_code', 'created_at', 'click_count', 'user']
+    extra_kwargs = {'max_clicks': {'min_value': 1}}
+
+  def validate_expires_at(self, value):
+    if value is not None and value <= timezone.now():
+      raise serializers.ValidationError('The expiry time must be in the future.')
+    return value
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import url_cache
+from .models import ShortenedUrl
+from .replicas import replicas
+from .stats import adjust_user_stats
+
+"""
+Drops a deleted shortened URL from the redirect cache and from its owner's stats.
+Runs for instance deletes as well as queryset and cascade deletes. purge_expired_urls deletes without it and
+adjusts the stats once per batch.
+"""
+@receiver(post_delete, sender=ShortenedUrl)
+def invalidate_cached_url(sender, instance, **kwargs):
+  if instance.short_code:
+    url_cache.delete(instance.short_code)
+  if instance.user_id:
+    adjust_user_stats({instance.user_id: (-1, -instance.click_count)})
+
+"""
+Counts a newly created shortened URL in its owner's stats.
+Bulk inserts do not send this signal and update the stats themselves.
+"""
+@receiver(post_save, sender=ShortenedUrl)
+def count_created_url(sender, instance, created, **kwargs):
+  if created and instance.user_id:
+    adjust_user_stats({instance.user_id: (1, 0)})
+
+"""
+Clears a newly created short code from this worker's negative cache, in case it was looked up before it existed.
+Bulk inserts do not send this signal and clear their codes themselves.
+"""
+@receiver(post_save, sender=ShortenedUrl)
+def forget_missing_code(sender, instance, created, **kwargs):
+  if created:
+    url_cache.forget_missing(instance.short_code)
+
+"""
+Sends the owner's reads to the primary for a few seconds after they create or delete a link, so they see the change
+even while the replicas lag behind.
+Bulk inserts do not send this signal and pin their owner themselves.
+"""
+@receiver(post_save, sender=ShortenedUrl)
+@receiver(post_delete, sender=ShortenedUrl)
+def pin_owner_to_primary(sender, instance, created=True, **kwargs):
+  if created:
+    replicas.pin(instance.user_id)
@@ -0,0 +1,74 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from .models import ShortenedUrl, UserLinkStats
+
+STATS_CHUNK_SIZE = 500
+
+"""
+Adds link and click deltas to the stats rows of the given users, creating missing rows.
+Takes {user_id: (links, clicks)} and issues one UPDATE per distinct delta.
+A single user costs one UPDATE when the row already exists.
+"""
+def adjust_user_stats(deltas: dict):
+  deltas = {user_id: delta for user_id, delta in deltas.items() if user_id and any(delta)}
+  if not deltas:
+    return
+  now = timezone.now()
+  if len(deltas) == 1:
+    [(user_id, (links, clicks))] = deltas.items()
+    updated = UserLinkStats.objects.filter(user_id=user_id).update(
+      link_count=F('link_count') + links,
+      total_clicks=F('total_clicks') + clicks,
+      updated_at=now,
+    )
+    if updated:
+      return
+
+  by_delta = defaultdict(list)
+  for user_id, delta in deltas.items():
+    by_delta[delta].append(user_id)
+  with transaction.atomic():
+    UserLinkStats.objects.bulk_create(
+      [UserLinkStats(user_id=user_id) for user_id in deltas],
+      ignore_conflicts=True,
+    )
+    for (links, clicks), user_ids in by_delta.items():
+      for start in range(0, len(user_ids), STATS_CHUNK_SIZE):
+        UserLinkStats.objects.filter(user_id__in=user_ids[start:start + STATS_CHUNK_SIZE]).update(
+          link_count=F('link_count') + links,
+          total_clicks=F('total_clicks') + clicks,
+          updated_at=now,
+        )
+
+"""
+Adds flushed click counts to the owners' stats rows.
+Takes {short_code: clicks} and resolves the owners with one query per chunk.
+"""
+def add_clicks_to_user_stats(counts: dict):
+  short_codes = list(counts)
+  clicks_by_user = defaultdict(int)
+  for start in range(0, len(short_codes), STATS_CHUNK_SIZE):
+    owners = ShortenedUrl.objects.filter(
+      short_code__in=short_codes[start:start + STATS_CHUNK_SIZE],
+      user__isnull=False
+    ).values_list('short_code', 'user_id')
+    for short_code, user_id in owners:
+      clicks_by_user[user_id] += counts[short_code]
+  adjust_user_stats({user_id: (0, clicks) for user_id, clicks in clicks_by_user.items()})
+
+"""
+Recomputes every user's stats row from the shortened URLs, repairing any drift.
+"""
+def rebuild_user_stats():
+  totals = ShortenedUrl.objects.filter(user__isnull=False).values('user_id').annotate(
+    links=Count('id'),
+    clicks=Sum('click_count'),
+  )
+  with transaction.atomic():
+    UserLinkStats.objects.all().delete()
+    UserLinkStats.objects.bulk_create(
+      [UserLinkStats(user_id=row['user_id'], link_count=row['links'], total_clicks=row['clicks'] or 0) for row in totals],
+      batch_size=1000,
+    )
@@ -1,3 +1,688 @@
-from django.test import TestCase
+import io
+import json
+import os
+import runpy
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.models import User
+from .analytics import Click, click_series, write_click_events
+from .allocators import RandomCodeAllocator, RecyclingCodeAllocator, SequenceCodeAllocator, is_valid_short_code
+from .asgi import RedirectASGIApplication
+from .asynccache import AsyncCache
+from .cache import UrlCache, alookup_short_code, lookup_short_code, url_cache
+from .checks import check_rate_limit_client_ip, check_replica_stickiness_cache
+from .clicks import CacheClickBuffer, click_aggregator
+from .models import ClickEvent, FreeShortCode, ShortenedUrl, UserLinkStats
+from .ratelimit import LocalRateLimitBackend, RateLimiter, client_ip, forwarded_address, rate_limiter
+from .replicas import ReplicaSet, current_replica, read_from_replica
+from .utils import canonicalize_url, hash_url
 
-# Create your tests here.
+REPLICA = 'replica_test'
+
+def replica_url(short_code: str) -> ShortenedUrl:
+  original_url = f'https://replica.example.com/{short_code}'
+  return ShortenedUrl(original_url=original_url, url_hash=hash_url(original_url), short_code=short_code)
+
+
+class CanonicalizationTests(SimpleTestCase):
+  def test_equivalent_urls_share_a_canonical_form(self):
+    self.assertEqual(canonicalize_url('HTTPS://Example.com:443/path/?b=2&a=1'), 'https://example.com/path?a=1&b=2')
+    self.assertEqual(canonicalize_url('https://example.com/path'), 'https://example.com/path')
+
+  def test_ipv6_hosts_keep_their_brackets(self):
+    self.assertEqual(canonicalize_url('http://[::1]:8080/'), 'http://[::1]:8080/')
+    self.assertEqual(canonicalize_url('http://[2001:DB8::1]:80/a/'), 'http://[2001:db8::1]/a')
+
+
+class ExpirationTests(TestCase):
+  """
+  Links stop redirecting once they reach their expiry time or use up their clicks, and are purged in batches.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='password')
+
+  def setUp(self):
+    url_cache.clear()
+    for patcher in (
+      mock.patch.object(click_aggregator, 'background', False),
+      mock.patch.object(rate_limiter, 'enabled', False),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def shorten(self, data, authenticated=True):
+    return self.client.post(
+      '/shortener/shorten-url/', data, content_type='application/json', secure=True,
+      **(self.headers if authenticated else {})
+    )
+
+  def short_code(self, response):
+    return response.json()['shortened_url'].rsplit('/', 1)[1]
+
+  def test_click_limited_link_stops_at_max_clicks(self):
+    short_code = self.short_code(self.shorten({'original_url': 'https://example.com/limited', 'max_clicks': 2}))
+    statuses = [self.client.get(f'/{short_code}', secure=True).status_code for index in range(3)]
+    click_aggregator.flush()
+    self.assertEqual(statuses, [302, 302, 404])
+    self.assertEqual(ShortenedUrl.objects.get(short_code=short_code).click_count, 2)
+    self.assertEqual(UserLinkStats.objects.get(user=self.user).total_clicks, 2)
+
+  def test_expired_link_stops_redirecting(self):
+    short_code = self.short_code(self.shorten({
+      'original_url': 'https://example.com/expiring', 'expires_at': (timezone.now() + timedelta(hours=1)).isoformat()
+    }))
+    self.assertEqual(self.client.get(f'/{short_code}', secure=True).status_code, 302)
+    ShortenedUrl.objects.filter(short_code=short_code).update(expires_at=timezone.now() - timedelta(seconds=1))
+    url_cache.set(short_code, 'https://example.com/expiring', timezone.now() - timedelta(seconds=1))
+    self.assertIsNone(url_cache.get(short_code))
+    self.assertEqual(self.client.get(f'/{short_code}', secure=True).status_code, 404)
+
+  def test_invalid_expiry_is_rejected(self):
+    response = self.shorten({
+      'original_url': 'https://example.com/', 'expires_at': '2000-01-01T00:00:00Z', 'max_clicks': 0
+    })
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(set(response.json()), {'expires_at', 'max_clicks'})
+
+  @override_settings(SHORTENER_EXPIRATION={'ANONYMOUS_TTL': 3600})
+  def test_anonymous_links_expire_within_the_anonymous_ttl(self):
+    response = self.shorten({
+      'original_url': 'https://example.com/anonymous', 'expires_at': (timezone.now() + timedelta(days=30)).isoformat()
+    }, authenticated=False)
+    expires_at = ShortenedUrl.objects.get(short_code=self.short_code(response)).expires_at
+    self.assertLessEqual(expires_at, timezone.now() + timedelta(seconds=3600))
+
+  def test_bulk_items_keep_their_expiry(self):
+    expires_at = timezone.now() + timedelta(hours=1)
+    response = self.client.post('/shortener/bulk-shorten-url/', [
+      {'original_url': 'https://example.com/bulk-expiring', 'expires_at': expires_at.isoformat()},
+      {'original_url': 'https://example.com/bulk-limited', 'max_clicks': 1},
+      {'original_url': 'https://example.com/bulk-invalid', 'max_clicks': 0},
+    ], content_type='application/json', secure=True, **self.headers)
+    results = response.json()['results']
+    self.assertEqual(response.json()['failed'], 1)
+    self.assertEqual(ShortenedUrl.objects.get(original_url='https://example.com/bulk-expiring').expires_at, expires_at)
+    self.assertEqual(ShortenedUrl.objects.get(original_url='https://example.com/bulk-limited').max_clicks, 1)
+    short_code = results[1]['shortened_url'].rsplit('/', 1)[1]
+    statuses = [self.client.get(f'/{short_code}', secure=True).status_code for index in range(2)]
+    self.assertEqual(statuses, [302, 404])
+
+  def test_expired_link_is_replaced_when_shortened_again(self):
+    first = self.short_code(self.shorten({'original_url': 'https://example.com/again', 'max_clicks': 1}))
+    self.client.get(f'/{first}', secure=True)
+    response = self.shorten({'original_url': 'https://example.com/again'})
+    self.assertEqual(response.status_code, 201)
+    self.assertNotEqual(self.short_code(response), first)
+    self.assertFalse(ShortenedUrl.objects.filter(short_code=first).exists())
+
+  @override_settings(SHORTENER_EXPIRATION={'RECYCLE_CODES': True})
+  def test_purge_deletes_expired_links_in_batches_and_frees_their_codes(self):
+    past = timezone.now() - timedelta(minutes=1)
+    expired = [
+      ShortenedUrl.objects.create(original_url=f'https://example.com/expired/{index}', user=self.user, expires_at=past)
+      for index in range(3)
+    ]
+    used_up = ShortenedUrl.objects.create(
+      original_url='https://example.com/used-up', user=self.user, max_clicks=1, click_count=1
+    )
+    live = ShortenedUrl.objects.create(original_url='https://example.com/live', user=self.user, max_clicks=5)
+
+    output = io.StringIO()
+    call_command('purge_expired_urls', batch_size=2, stdout=output)
+
+    self.assertIn('Purged 4 expired links.', output.getvalue())
+    self.assertEqual(list(ShortenedUrl.objects.values_list('pk', flat=True)), [live.pk])
+    self.assertEqual(
+      set(FreeShortCode.objects.values_list('code', flat=True)),
+      {shortened_url.short_code for shortened_url in [*expired, used_up]}
+    )
+    self.assertEqual(UserLinkStats.objects.get(user=self.user).link_count, 1)
+
+  def test_purge_queries_do_not_grow_with_the_batch(self):
+    past = timezone.now() - timedelta(minutes=1)
+    queries = []
+    for count in (2, 6):
+      links = ShortenedUrl.objects.bulk_get_or_create_for_user(
+        [f'https://example.com/batch/{count}/{index}' for index in range(count)], self.user.id
+      )
+      ShortenedUrl.objects.update(expires_at=past)
+      ClickEvent.objects.bulk_create([
+        ClickEvent(shortened_url=shortened_url, clicked_at=past) for shortened_url, created in links
+      ])
+      with CaptureQueriesContext(connection) as captured:
+        call_command('purge_expired_urls', stdout=io.StringIO())
+      queries.append(len(captured))
+    self.assertEqual(queries[0], queries[1])
+    self.assertFalse(ClickEvent.objects.exists())
+    self.assertEqual(UserLinkStats.objects.get(user=self.user).link_count, 0)
+
+  def test_purge_keeps_codes_out_of_the_pool_unless_recycling_is_enabled(self):
+    ShortenedUrl.objects.create(
+      original_url='https://example.com/expired', user=self.user, expires_at=timezone.now() - timedelta(minutes=1)
+    )
+    call_command('purge_expired_urls', stdout=io.StringIO())
+    self.assertFalse(ShortenedUrl.objects.exists())
+    self.assertFalse(FreeShortCode.objects.exists())
+
+  def test_recycled_codes_are_only_reused_after_the_quarantine(self):
+    now = timezone.now()
+    FreeShortCode.objects.bulk_create([
+      FreeShortCode(code='old001', freed_at=now - timedelta(days=2)),
+      FreeShortCode(code='new001', freed_at=now - timedelta(minutes=1)),
+    ])
+    allocator = RecyclingCodeAllocator(RandomCodeAllocator(), recycle_after=86400, block_size=10)
+    codes = allocator.allocate_many(3)
+    self.assertEqual(codes[0], 'old001')
+    self.assertNotIn('new001', codes)
+    self.assertEqual(list(FreeShortCode.objects.values_list('code', flat=True)), ['new001'])
+
+
+class ShortenTests(TestCase):
+  """
+  New links get a unique code from the configured allocator with a single INSERT.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='password')
+
+  def setUp(self):
+    url_cache.clear()
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def shorten(self, original_url):
+    return self.client.post(
+      '/shortener/shorten-url/', {'original_url': original_url}, content_type='application/json', secure=True,
+      **self.headers
+    )
+
+  def test_new_link_is_written_once(self):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.shorten('https://example.com/single-write')
+    writes = [
+      query['sql'] for query in queries
+      if query['sql'].startswith(('INSERT INTO "shortener_shortenedurl"', 'UPDATE "shortener_shortenedurl"'))
+    ]
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual(len(writes), 1)
+    self.assertTrue(writes[0].startswith('INSERT'))
+
+    with CaptureQueriesContext(connection) as queries:
+      again = self.shorten('https://example.com/single-write')
+    self.assertEqual(again.status_code, 200)
+    self.assertEqual(again.json()['shortened_url'], response.json()['shortened_url'])
+    self.assertFalse([query for query in queries if query['sql'].startswith('INSERT')])
+
+  def test_colliding_code_is_retried_with_a_new_one(self):
+    taken, created = ShortenedUrl.objects.get_or_create_for_user('https://example.com/taken', self.user.id)
+    with mock.patch.object(ShortenedUrl, 'generate_short_code', side_effect=[taken.short_code, 'Fresh1']):
+      shortened_url, created = ShortenedUrl.objects.get_or_create_for_user('https://example.com/new', self.user.id)
+    self.assertTrue(created)
+    self.assertEqual(shortened_url.short_code, 'Fresh1')
+    self.assertEqual(shortened_url.shortened_url.rsplit('/', 1)[1], 'Fresh1')
+
+  def test_sequence_codes_never_repeat_across_leases(self):
+    allocator = SequenceCodeAllocator(block_size=3)
+    codes = allocator.allocate_many(5) + [allocator.allocate() for index in range(4)] + allocator.allocate_many(2)
+    self.assertEqual(len(set(codes)), 11)
+    self.assertTrue(all(is_valid_short_code(code) for code in codes))
+
+
+class RedirectTests(TestCase):
+  """
+  Redirects are served from the cache once a code is loaded, until the link is deleted, and impossible or unknown codes
+  are answered without a query. Clicks are counted in bulk and their events rolled up per hour and day.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='password')
+
+  def setUp(self):
+    url_cache.clear()
+    for patcher in (
+      mock.patch.object(click_aggregator, 'background', False),
+      mock.patch.object(rate_limiter, 'enabled', False),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def create(self, original_url):
+    shortened_url, created = ShortenedUrl.objects.get_or_create_for_user(original_url, self.user.id)
+    return shortened_url.short_code
+
+  def test_redirect_is_cached_until_the_link_is_deleted(self):
+    short_code = self.create('https://example.com/cached')
+    self.assertEqual(self.client.get(f'/{short_code}', secure=True).status_code, 302)
+    with self.assertNumQueries(0):
+      response = self.client.get(f'/{short_code}', secure=True)
+    self.assertEqual(response['Location'], 'https://example.com/cached')
+
+    response = self.client.delete(f'/shortener/delete-url/{short_code}/', secure=True, **self.headers)
+    self.assertEqual(response.status_code, 204)
+    self.assertIsNone(url_cache.get(short_code))
+    self.assertEqual(self.client.get(f'/{short_code}', secure=True).status_code, 404)
+
+  def test_unknown_codes_are_answered_without_repeating_the_query(self):
+    with self.assertNumQueries(0):
+      for path in ('/abc', '/abcdefghijk', '/robots.txt'):
+        self.assertEqual(self.client.get(path, secure=True).status_code, 404)
+    with self.assertNumQueries(1):
+      self.assertEqual(self.client.get('/Later1', secure=True).status_code, 404)
+    with self.assertNumQueries(0):
+      self.assertEqual(self.client.get('/Later1', secure=True).status_code, 404)
+
+    # Creating the code clears its negative entry right away.
+    with mock.patch.object(ShortenedUrl, 'generate_short_code', return_value='Later1'):
+      self.create('https://example.com/later')
+    self.assertEqual(self.client.get('/Later1', secure=True).status_code, 302)
+
+  def test_clicks_are_counted_in_bulk_on_flush(self):
+    click_aggregator.buffer.drain()
+    short_codes = [self.create(f'https://example.com/clicked/{index}') for index in range(3)]
+    for short_code in short_codes + short_codes[:1]:
+      self.client.get(f'/{short_code}', secure=True)
+    self.assertEqual(ShortenedUrl.objects.get(short_code=short_codes[0]).click_count, 0)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(click_aggregator.flush(), 4)
+    updates = [query for query in queries if query['sql'].startswith('UPDATE "shortener_shortenedurl"')]
+    # One UPDATE per distinct increment, not per click or per code.
+    self.assertEqual(len(updates), 2)
+    self.assertEqual(
+      dict(ShortenedUrl.objects.filter(short_code__in=short_codes).values_list('short_code', 'click_count')),
+      {short_codes[0]: 2, short_codes[1]: 1, short_codes[2]: 1}
+    )
+
+  def test_click_events_are_rolled_up_per_hour_and_day(self):
+    short_code = self.create('https://example.com/analytics')
+    day = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+    clicks = [
+      Click(short_code, day + timedelta(hours=10, minutes=5), 'https://news.example.org/a', 'Mozilla (iPhone)', 'de'),
+      Click(short_code, day + timedelta(hours=10, minutes=50), '', 'curl/8.0', ''),
+      Click(short_code, day + timedelta(hours=11), '', '', 'XYZ'),
+      Click(short_code, day + timedelta(days=1, hours=1), '', 'Mozilla (Windows NT 10.0)', ''),
+      Click('Gone00', day, '', '', ''),
+    ]
+    self.assertEqual(write_click_events(clicks[:2]), 2)
+    # The click for a code that no longer exists is discarded.
+    self.assertEqual(write_click_events(clicks[2:]), 2)
+
+    shortened_url = ShortenedUrl.objects.get(short_code=short_code)
+    self.assertEqual(click_series(shortened_url, 'day'), [(day, 3), (day + timedelta(days=1), 1)])
+    self.assertEqual(click_series(shortened_url, 'hour', until=day + timedelta(days=1)), [
+      (day + timedelta(hours=10), 2), (day + timedelta(hours=11), 1)
+    ])
+    self.assertEqual(
+      list(ClickEvent.objects.order_by('clicked_at').values_list('referrer', 'agent_class', 'country')),
+      [('news.example.org', 'mobile', 'DE'), ('', 'bot', ''), ('', 'other', ''), ('', 'desktop', '')]
+    )
+
+
+class LinkStatsTests(TestCase):
+  """
+  The stats endpoints read the precomputed per-user aggregates, which follow creates, clicks and deletes.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='password')
+
+  def setUp(self):
+    url_cache.clear()
+    click_aggregator.buffer.drain()
+    for patcher in (
+      mock.patch.object(click_aggregator, 'background', False),
+      mock.patch.object(rate_limiter, 'enabled', False),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def get(self, path, **headers):
+    return self.client.get(path, secure=True, **self.headers, **headers)
+
+  def test_stats_follow_links_and_clicks(self):
+    short_codes = [
+      ShortenedUrl.objects.get_or_create_for_user(f'https://example.com/stats/{index}', self.user.id)[0].short_code
+      for index in range(3)
+    ]
+    response = self.get('/shortener/stats/')
+    self.assertEqual((response.json()['link_count'], response.json()['total_clicks']), (3, 0))
+    self.assertEqual(self.get('/shortener/stats/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    for short_code in short_codes[1:] + short_codes[1:2]:
+      self.client.get(f'/{short_code}', secure=True)
+    click_aggregator.flush()
+    ShortenedUrl.objects.get(short_code=short_codes[2]).delete()
+
+    updated = self.get('/shortener/stats/', HTTP_IF_NONE_MATCH=response['ETag'])
+    self.assertEqual(updated.status_code, 200)
+    self.assertEqual((updated.json()['link_count'], updated.json()['total_clicks']), (2, 2))
+    top = self.get('/shortener/stats/top/?limit=2').json()['results']
+    self.assertEqual([url['shortened_url'].rsplit('/', 1)[1] for url in top], short_codes[1::-1])
+
+
+class ImportExportTests(TestCase):
+  """
+  A user's links are exported as CSV or NDJSON and imported back from either format.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='password')
+
+  def setUp(self):
+    url_cache.clear()
+    patcher = mock.patch.object(rate_limiter, 'enabled', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+  def export(self, format):
+    response = self.client.get(f'/shortener/export/{format}/', secure=True, **self.headers)
+    return b''.join(response.streaming_content)
+
+  def import_body(self, body, content_type):
+    return self.client.post('/shortener/import/', body, content_type=content_type, secure=True, **self.headers)
+
+  def test_import_is_url_only(self):
+    kept, created = ShortenedUrl.objects.get_or_create_for_user('https://example.com/kept', self.user.id)
+    dropped, created = ShortenedUrl.objects.get_or_create_for_user('https://example.com/dropped', self.user.id)
+    ShortenedUrl.objects.filter(pk=dropped.pk).update(click_count=7)
+    body = self.export('csv')
+    dropped.delete()
+
+    response = self.import_body(body, 'text/csv')
+
+    self.assertEqual(response.json(), {'created': 1, 'existing': 1, 'failed': 0, 'errors': []})
+    self.assertEqual(ShortenedUrl.objects.get(original_url='https://example.com/kept').short_code, kept.short_code)
+    imported = ShortenedUrl.objects.get(original_url='https://example.com/dropped')
+    self.assertNotEqual(imported.short_code, dropped.short_code)
+    self.assertEqual(imported.click_count, 0)
+
+  def test_ndjson_import_deduplicates_through_the_digest_index(self):
+    ShortenedUrl.objects.get_or_create_for_user('https://example.com/a', self.user.id)
+    body = '\n'.join([
+      '"https://example.com/a"', '{"original_url": "https://example.com/b"}', '"https://example.com/b"',
+      'not json', '{"short_code": "Abc123"}',
+    ])
+
+    response = self.import_body(body, 'application/x-ndjson')
+
+    summary = response.json()
+    self.assertEqual((summary['created'], summary['existing'], summary['failed']), (1, 2, 2))
+    self.assertEqual([error['line'] for error in summary['errors']], [4, 5])
+    exported = [json.loads(line) for line in self.export('ndjson').decode().splitlines()]
+    self.assertEqual([row['original_url'] for row in exported], ['https://example.com/b', 'https://example.com/a'])
+    if connection.vendor == 'sqlite':
+      sql, params = ShortenedUrl.objects.with_url_hashes(self.user.id, ['a', 'b']).query.sql_with_params()
+      with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+      self.assertIn('shortener_user_url_hash_unique', plan)
+
+
+class AsyncCacheTests(SimpleTestCase):
+  """
+  Async cache calls outside Django's request handling run off the shared thread Django would queue them on.
+  """
+  async def test_sync_backends_run_in_the_default_executor(self):
+    cache = AsyncCache(caches['default'])
+    threads = []
+    get = cache.cache.get
+    def recording_get(*args, **kwargs):
+      threads.append(threading.current_thread())
+      return get(*args, **kwargs)
+
+    self.assertTrue(cache.threaded)
+    with mock.patch.object(cache.cache, 'get', recording_get):
+      await cache.aset('shortener:test:async', 1, timeout=60)
+      self.assertEqual(await cache.aincr('shortener:test:async', 2), 3)
+      self.assertEqual(await cache.aget('shortener:test:async'), 3)
+    # Neither the event loop's thread nor the main thread, where thread-sensitive calls run under async_to_sync.
+    self.assertNotIn(threads[0], (threading.current_thread(), threading.main_thread()))
+    self.assertEqual(caches['default'].get('shortener:test:async'), 3)
+
+
+@override_settings(SHORTENER_INSTRUMENTATION={'ENABLED': True, 'METRICS_TOKEN': 'secret', 'METRICS_PATH': '/metrics'})
+class MetricsTests(SimpleTestCase):
+  """
+  The metrics are served to requests bearing the metrics token, and their path is never taken for a short code.
+  """
+  async def test_metrics_path_skips_the_redirect_fast_path(self):
+    application = mock.AsyncMock()
+    scope = {
+      'type': 'http', 'method': 'GET', 'scheme': 'https', 'path': '/metrics', 'headers': [(b'host', b'testserver')]
+    }
+    with mock.patch.object(rate_limiter, 'ahit', mock.AsyncMock(return_value=0)) as ahit, \
+        mock.patch.object(url_cache, 'aget', mock.AsyncMock(return_value=None)) as aget:
+      await RedirectASGIApplication(application)(scope, None, None)
+      ahit.assert_not_called()
+      aget.assert_not_called()
+      await RedirectASGIApplication(application)({**scope, 'path': '/abc123'}, None, None)
+      aget.assert_awaited_once_with('abc123')
+    self.assertEqual(application.await_count, 2)
+
+  def test_metrics_are_only_served_with_the_token(self):
+    self.assertEqual(self.client.get('/shortener/stats/', secure=True).status_code, 401)
+
+    self.assertEqual(self.client.get('/metrics', secure=True).status_code, 403)
+    self.assertEqual(self.client.get('/metrics', secure=True, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+    response = self.client.get('/metrics', secure=True, HTTP_AUTHORIZATION='Bearer secret')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+    self.assertIn('http_requests_total{view="get_user_stats",method="GET",status="401"}', response.content.decode())
+    self.assertIn('password_pool_queue_depth', response.content.decode())
+
+
+class ClickBufferTests(SimpleTestCase):
+  """
+  Clicks buffered in a shared cache are drained by any process, and a lost registry slot never strands later codes.
+  """
+  def setUp(self):
+    caches['default'].clear()
+    self.buffer = CacheClickBuffer(alias='default')
+
+  def test_clicks_recorded_in_one_process_are_drained_by_another(self):
+    for short_code in ('first', 'second', 'first'):
+      self.buffer.record(short_code)
+    self.buffer.record('second', clicks=3)
+
+    other = CacheClickBuffer(alias='default')
+    self.assertEqual(other.pending(), 2)
+    self.assertEqual(other.drain(), {'first': 2, 'second': 4})
+    self.assertEqual(self.buffer.drain(), {})
+    self.buffer.record('first')
+    self.assertEqual(other.drain(), {'first': 1})
+
+  def test_drain_skips_a_registry_slot_that_stays_empty(self):
+    self.buffer.record('first')
+    # A writer that died after reserving its slot, with its click counted and its dirty flag set.
+    self.buffer.record('lost')
+    caches['default'].delete(self.buffer._key('registry', 2))
+    self.buffer.record('after', clicks=2)
+
+    self.assertEqual(self.buffer.drain(), {'first': 1})
+    self.assertEqual(self.buffer.drain(), {})
+    self.buffer.slot_grace = 0
+    self.assertEqual(self.buffer.drain(), {'after': 2})
+    self.assertEqual(self.buffer.pending(), 0)
+
+    # Once the dirty flag expires, the next click registers the code again and the stranded count is drained with it.
+    caches['default'].delete(self.buffer._key('dirty', 'lost'))
+    self.buffer.record('lost')
+    self.assertEqual(self.buffer.drain(), {'lost': 2})
+
+
+class PinnedCacheTests(TestCase):
+  """
+  The pinned map is refreshed by a background thread, never by the request whose hit found it due.
+  """
+  def test_refresh_runs_off_the_request_path(self):
+    cache = UrlCache(pin_interval=0)
+    cache.set('abcdef', 'https://example.com/')
+    refreshed = threading.Event()
+    threads = []
+    def refresh_pinned():
+      threads.append(threading.current_thread())
+      refreshed.set()
+
+    with mock.patch.object(cache, 'refresh_pinned', side_effect=refresh_pinned):
+      with self.assertNumQueries(0):
+        self.assertEqual(cache.get('abcdef'), 'https://example.com/')
+      self.assertTrue(refreshed.wait(5))
+    self.assertNotEqual(threads, [threading.current_thread()])
+
+  def test_refresh_is_left_to_the_caller_without_background(self):
+    cache = UrlCache(pin_interval=0, background=False)
+    cache.set('abcdef', 'https://example.com/')
+    with mock.patch.object(cache, 'refresh_pinned') as refresh_pinned:
+      cache.get('abcdef')
+    refresh_pinned.assert_not_called()
+    self.assertIsNone(cache._refresher)
+
+
+class RateLimitKeyingTests(TestCase):
+  """
+  Clients are keyed on the address the trusted proxies appended, not on anything the client put in the header.
+  """
+  def setUp(self):
+    self.limiter = RateLimiter(LocalRateLimitBackend(), {'redirect': '2/m'}, ip_header='X-Forwarded-For')
+    patcher = mock.patch('shortener.views.rate_limiter', self.limiter)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_client_address_is_counted_from_the_right(self):
+    meta = {'HTTP_X_FORWARDED_FOR': '1.1.1.1, 2.2.2.2, 3.3.3.3', 'REMOTE_ADDR': '10.0.0.1'}
+    self.assertEqual(client_ip(meta, 'X-Forwarded-For'), '3.3.3.3')
+    self.assertEqual(client_ip(meta, 'X-Forwarded-For', proxies=2), '2.2.2.2')
+    self.assertEqual(forwarded_address('1.1.1.1', proxies=3), '1.1.1.1')
+    self.assertEqual(client_ip(meta), '10.0.0.1')
+
+  def test_spoofed_forwarded_entries_share_the_client_bucket(self):
+    statuses = [
+      self.client.get('/abcdef', secure=True, HTTP_X_FORWARDED_FOR=f'192.0.2.{index}, 203.0.113.7').status_code
+      for index in range(3)
+    ]
+    self.assertEqual(statuses, [404, 404, 429])
+    response = self.client.get('/abcdef', secure=True, HTTP_X_FORWARDED_FOR='203.0.113.8')
+    self.assertEqual(response.status_code, 404)
+
+  def test_limits_are_only_on_by_default_with_an_ip_header(self):
+    for header, enabled in (('', False), ('X-Forwarded-For', True)):
+      with mock.patch.dict(os.environ, {'SHORTENER_RATE_LIMIT_IP_HEADER': header}):
+        os.environ.pop('SHORTENER_RATE_LIMITS_ENABLED', None)
+        options = runpy.run_path(str(settings.BASE_DIR / 'backend' / 'settings.py'))['SHORTENER_RATE_LIMITS']
+      self.assertEqual(options['ENABLED'], enabled)
+
+  def test_missing_ip_header_is_reported(self):
+    with override_settings(SHORTENER_RATE_LIMITS={'RATES': {'redirect': '600/m'}}):
+      self.assertEqual([warning.id for warning in check_rate_limit_client_ip(None)], ['shortener.W001'])
+    with override_settings(SHORTENER_RATE_LIMITS={'RATES': {'redirect': '600/m'}, 'IP_HEADER': 'X-Forwarded-For'}):
+      self.assertEqual(check_rate_limit_client_ip(None), [])
+
+
+@override_settings(DATABASE_ROUTERS=['shortener.replicas.ReplicaRouter'])
+class ReplicaRoutingTests(TestCase):
+  """
+  Routes reads between the test database and a second SQLite database standing in for a replica.
+  The replica holds other URLs for the same codes, so every read shows which database answered it.
+  """
+  @classmethod
+  def setUpClass(cls):
+    # The replica alias only exists while this test case runs, the test runner never creates or checks it.
+    cls.replica_dir = tempfile.TemporaryDirectory()
+    connections.settings[REPLICA] = connections.configure_settings({
+      'default': connections.settings['default'],
+      REPLICA: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3')},
+    })[REPLICA]
+    call_command('migrate', database=REPLICA, verbosity=0)
+    ShortenedUrl.objects.using(REPLICA).bulk_create([replica_url('both01'), replica_url('both02')])
+    cls.databases = {'default', REPLICA}
+    super().setUpClass()
+
+  @classmethod
+  def tearDownClass(cls):
+    super().tearDownClass()
+    connections[REPLICA].close()
+    del connections[REPLICA]
+    del connections.settings[REPLICA]
+    cls.replica_dir.cleanup()
+
+  @classmethod
+  def setUpTestData(cls):
+    for short_code in ('both01', 'both02', 'prim01'):
+      ShortenedUrl.objects.create(original_url=f'https://primary.example.com/{short_code}', short_code=short_code)
+
+  def setUp(self):
+    url_cache.clear()
+    self.replicas = ReplicaSet([REPLICA], max_lag=5, check_interval=60)
+    patcher = mock.patch('shortener.replicas.replicas', self.replicas)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(self.replicas.cache.clear)
+
+  def read_original_url(self, short_code, user_id=None):
+    return read_from_replica(
+      lambda: ShortenedUrl.objects.filter(short_code=short_code).values_list('original_url', flat=True).first(),
+      user_id=user_id
+    )
+
+  def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+    self.assertEqual(self.read_original_url('both01'), 'https://replica.example.com/both01')
+    self.assertEqual(router.db_for_write(ShortenedUrl), 'default')
+    self.assertFalse(router.allow_migrate(REPLICA, 'shortener'))
+    self.assertEqual(ShortenedUrl.objects.get(short_code='both01').original_url, 'https://primary.example.com/both01')
+
+  def test_lookup_of_a_code_missing_on_the_replica_retries_the_primary(self):
+    self.assertEqual(lookup_short_code('both02'), ('https://replica.example.com/both02', False))
+    self.assertEqual(lookup_short_code('prim01'), ('https://primary.example.com/prim01', False))
+
+  async def test_async_lookup_reads_from_the_replica(self):
+    self.assertEqual(await alookup_short_code('both01'), ('https://replica.example.com/both01', False))
+
+  def test_lagging_replica_is_skipped_until_it_catches_up(self):
+    with mock.patch('shortener.replicas.replication_lag', return_value=60), self.assertLogs('shortener.replicas'):
+      self.replicas.check()
+    self.assertEqual(self.replicas.healthy, [])
+    self.assertEqual(self.read_original_url('both01'), 'https://primary.example.com/both01')
+
+    with mock.patch('shortener.replicas.replication_lag', return_value=1):
+      self.replicas.check()
+    self.assertEqual(self.read_original_url('both01'), 'https://replica.example.com/both01')
+
+  def test_user_who_wrote_reads_from_the_primary(self):
+    self.replicas.pin(1)
+    self.assertEqual(self.read_original_url('both01', user_id=1), 'https://primary.example.com/both01')
+    self.assertEqual(self.read_original_url('both01', user_id=2), 'https://replica.example.com/both01')
+
+  def test_failed_replica_read_falls_back_to_the_primary(self):
+    def read():
+      if current_replica.get() is not None:
+        raise OperationalError('replica unavailable')
+      return 'primary'
+
+    with self.assertLogs('shortener.replicas'):
+      self.assertEqual(read_from_replica(read), 'primary')
+    self.assertEqual(self.replicas.healthy, [])
+
+  def test_per_process_pin_cache_is_reported(self):
+    self.assertEqual([warning.id for warning in check_replica_stickiness_cache(None)], ['shortener.W002'])
+    shared = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'}
+    with mock.patch.dict(settings.CACHES, {'shared': shared}), override_settings(
+      SHORTENER_REPLICAS={'CACHE_ALIAS': 'shared'}
+    ):
+      self.assertEqual(check_replica_stickiness_cache(None), [])
@@ -4,5 +4,13 @@ from django.urls import path
 urlpatterns = [
   path('user-urls/', get_user_urls, name='get_user_urls'),
   path('shorten-url/', shorten_url, name='shorten_url'),
+  path('bulk-shorten-url/', bulk_shorten_url, name='bulk_shorten_url'),
   path('delete-url/<str:short_code>/', delete_url, name='delete_url'),
+  path('export/csv/', export_user_urls_csv, name='export_user_urls_csv'),
+  path('export/ndjson/', export_user_urls_ndjson, name='export_user_urls_ndjson'),
+  path('import/', import_user_urls, name='import_user_urls'),
+  path('stats/', get_user_stats, name='get_user_stats'),
+  path('stats/top/', get_top_urls, name='get_top_urls'),
+  path('stats/hot/', get_hot_urls, name='get_hot_urls'),
+  path('stats/<str:short_code>/', get_url_stats, name='get_url_stats'),
 ]
\ No newline at end of file
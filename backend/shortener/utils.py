@@ -1,8 +1,107 @@
+import hashlib
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
 from django.conf import settings
 
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+DEFAULT_CANONICALIZATION = {
+  'STRIP_TRAILING_SLASH': True,
+  'SORT_QUERY': True,
+  'DROP_FRAGMENT': False,
+  'STRIP_PARAMS': ['fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'yclid'],
+  'STRIP_PARAM_PREFIXES': ['utm_'],
+}
+
 """
 Method for building short url.
 """
 def build_short_url(short_code: str) -> str:
   domain = settings.DEFAULT_DOMAIN.rstrip('/')
-  return f"{domain}/{short_code}"
\ No newline at end of file
+  return f"{domain}/{short_code}"
+
+"""
+Method for reading the canonicalization options, SHORTENER_CANONICALIZATION overrides the defaults.
+"""
+def canonicalization_options() -> dict:
+  return {**DEFAULT_CANONICALIZATION, **getattr(settings, 'SHORTENER_CANONICALIZATION', {})}
+
+"""
+Method for checking with plain string operations whether a URL is already canonical.
+It accepts ASCII URLs without query, fragment, port or credentials, with a lowercase scheme and host
+and a path without a trailing slash. Anything else goes through rebuild_url.
+"""
+def is_canonical_url(url: str, options: dict) -> bool:
+  if not url.isascii() or '?' in url or '#' in url:
+    return False
+  scheme_end = url.find('://')
+  if scheme_end <= 0:
+    return False
+  path_start = url.find('/', scheme_end + 3)
+  if path_start == -1:
+    return False
+  head = url[:path_start]
+  if head != head.lower() or ':' in head[scheme_end + 3:] or '@' in head:
+    return False
+  if options['STRIP_TRAILING_SLASH'] and url.endswith('/') and len(url) - path_start > 1:
+    return False
+  return True
+
+"""
+Method for parsing a URL and rebuilding it in canonical form.
+The scheme and host are lowercased, default ports are dropped, an empty path becomes '/', and depending on the
+options trailing slashes and tracking parameters are removed, query parameters are sorted by name and the
+fragment is dropped.
+"""
+def rebuild_url(url: str, options: dict) -> str:
+  parts = urlsplit(url)
+  scheme = parts.scheme.lower()
+  host = (parts.hostname or '').lower()
+  if ':' in host:
+    # hostname drops the brackets around IPv6 addresses, which the netloc needs.
+    host = f'[{host}]'
+  try:
+    port = parts.port
+  except ValueError:
+    port = None
+  netloc = host
+  if port is not None and port != DEFAULT_PORTS.get(scheme):
+    netloc = f'{host}:{port}'
+  if parts.username is not None:
+    userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+    netloc = f'{userinfo}@{netloc}'
+
+  path = parts.path or '/'
+  if options['STRIP_TRAILING_SLASH'] and len(path) > 1:
+    path = path.rstrip('/') or '/'
+
+  query = parts.query
+  if query:
+    strip_params = set(options['STRIP_PARAMS'])
+    strip_prefixes = tuple(options['STRIP_PARAM_PREFIXES'])
+    params = [
+      (name, value) for name, value in parse_qsl(query, keep_blank_values=True)
+      if name not in strip_params and not name.startswith(strip_prefixes)
+    ]
+    if options['SORT_QUERY']:
+      params.sort(key=lambda param: param[0])
+    query = urlencode(params, quote_via=quote)
+
+  fragment = '' if options['DROP_FRAGMENT'] else parts.fragment
+  return urlunsplit((scheme, netloc, path, query, fragment))
+
+"""
+Method for canonicalizing an original URL, so that equivalent URLs share one digest and one short code.
+URLs that are already canonical are returned as they are without being parsed.
+"""
+def canonicalize_url(url: str, options: dict = None) -> str:
+  options = options or canonicalization_options()
+  url = url.strip()
+  if is_canonical_url(url, options):
+    return url
+  return rebuild_url(url, options)
+
+"""
+Method for hashing an original URL into the fixed-width digest used for deduplication.
+The URL is canonicalized first.
+"""
+def hash_url(original_url: str) -> str:
+  return hashlib.sha256(canonicalize_url(original_url).encode('utf-8')).hexdigest()
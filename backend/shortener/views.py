@@ -1,66 +1,302 @@
-from django.http import HttpResponseRedirect
-from rest_framework.decorators import api_view, permission_classes, renderer_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+import codecs
+import csv
+import io
+import json
+from django.http import HttpResponsePermanentRedirect, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.decorators import api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import empty
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from .analytics import click_from_request, click_series
+from .cache import alookup_short_code, lookup_short_code, url_cache
+from .clicks import aclaim_click, claim_click, click_aggregator
 from .utils import build_short_url
-from .models import ShortenedUrl
+from .models import ShortenedUrl, UserLinkStats
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+from .ratelimit import RateLimitThrottle, ShortenRateThrottle, rate_limiter
+from .replicas import read_from_replica, replicas
 from .serializers import ShortenedUrlSerializer
 
+STREAM_CHUNK_SIZE = 2000
+MAX_TOP_URLS = 100
+MAX_HOT_URLS = 1000
+MAX_STATS_DAYS = 365
+EXPORT_FIELDS = ['original_url', 'short_code', 'shortened_url', 'created_at', 'click_count']
+EXPORT_BUFFER_SIZE = 64 * 1024
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_ERRORS = 100
+
+"""
+Yields the shortened URLs of a queryset as a JSON array, one serialized row at a time.
+"""
+def stream_json_array(queryset):
+  encoder = JSONEncoder()
+  yield '['
+  for index, shortened_url in enumerate(queryset.iterator(chunk_size=STREAM_CHUNK_SIZE)):
+    yield (',' if index else '') + encoder.encode(ShortenedUrlSerializer(shortened_url).data)
+  yield ']'
+
 """
-Gets the shortened URLs for the authenticated user.
+Gets the shortened URLs for the authenticated user, newest first.
+The URLs are returned in pages with keyset pagination, pass the returned next_cursor as the cursor parameter to get the next page.
+Only the serialized columns are loaded.
+The URLs are read from a replica when there is one, unless the user created or deleted a link in the last few seconds.
+If the stream parameter is true, it streams every URL of the user as a single JSON array instead, for full exports.
 If the user is not authenticated, it returns a 401 Unauthorized response.
 """
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_urls(request):
-  user = request.user
-  urls = ShortenedUrl.objects.filter(user=user)
-  serializer = ShortenedUrlSerializer(urls, many=True)
-  return Response(serializer.data, status=status.HTTP_200_OK)
+  urls = ShortenedUrl.objects.filter(user_id=request.user.id).only(*ShortenedUrlSerializer.Meta.fields)
+  if request.query_params.get('stream', '').lower() in ('1', 'true'):
+    # The rows are read after the view returns, so a replica that fails mid-stream is not retried on the primary.
+    return StreamingHttpResponse(
+      stream_json_array(urls.using(replicas.choose(request.user.id)).order_by(*KeysetPagination.ordering)),
+      content_type='application/json'
+    )
+  paginator = KeysetPagination()
+  page = read_from_replica(lambda: paginator.paginate_queryset(urls, request), user_id=request.user.id)
+  serializer = ShortenedUrlSerializer(page, many=True)
+  return paginator.get_paginated_response(serializer.data)
 
 """
 Creates a shortened URL for the given original URL.
 If the user is authenticated, it associates the shortened URL with the user.
 If the user is not authenticated, it creates a public shortened URL that is not associated with any user.
 If the original URL already exists for the user, it returns the existing shortened URL.
-If the original URL does not exist, it creates a new shortened URL.
+If the original URL does not exist, it creates a new shortened URL with a single INSERT.
+An optional expires_at and max_clicks make the link expire, public links always expire within the anonymous TTL.
 If the URL is valid, it returns the shortened URL.
 If the URL is invalid, it returns a 400 Bad Request response with the validation errors.
 """
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RateLimitThrottle, ShortenRateThrottle])
 def shorten_url(request):
   serializer = ShortenedUrlSerializer(data=request.data)
   if serializer.is_valid():
-    user = request.user if request.user.is_authenticated else None
-    existing_url = ShortenedUrl.objects.filter(
-      original_url=serializer.validated_data['original_url'],
-      user=user
-    ).first()
-    if user and existing_url:
-      full_short_url = build_short_url(existing_url.short_code)
-      return Response({
-        'original_url': existing_url.original_url,
-        'shortened_url': full_short_url
-      }, status=status.HTTP_200_OK)
-
-    shortened_url = ShortenedUrl.objects.create(
-      original_url=serializer.validated_data['original_url'],
-      user=user
-    )
-
-    full_short_url = build_short_url(shortened_url.short_code)
+    user_id = request.user.id if request.user.is_authenticated else None
+    original_url = serializer.validated_data['original_url']
+    expiry = {name: serializer.validated_data.get(name) for name in ('expires_at', 'max_clicks')}
+    if user_id:
+      shortened_url, created = ShortenedUrl.objects.get_or_create_for_user(original_url, user_id, **expiry)
+    else:
+      shortened_url, created = ShortenedUrl.objects.create(original_url=original_url, **expiry), True
 
-    shortened_url.shortened_url = full_short_url
-    shortened_url.save()
+    # A click-limited link is never cached, its clicks are claimed on the database at every redirect.
+    if created and shortened_url.max_clicks is None:
+      url_cache.set(shortened_url.short_code, shortened_url.original_url, shortened_url.expires_at)
 
     return Response({
       'original_url': shortened_url.original_url,
-      'shortened_url': full_short_url
-    }, status=status.HTTP_201_CREATED)
+      'shortened_url': build_short_url(shortened_url.short_code),
+      'expires_at': shortened_url.expires_at,
+      'max_clicks': shortened_url.max_clicks
+    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
   return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+"""
+Creates shortened URLs for a batch of original URLs.
+It accepts a JSON list, a JSON object with a "urls" list, or an NDJSON stream, where each item is a URL or an object with an original_url.
+An object can also set expires_at and max_clicks, which apply when its link is created rather than found.
+Every item is validated with the ShortenedUrlSerializer and the valid ones are deduplicated against the user's links and inserted in bulk.
+It returns a result for each item in order, with either the shortened URL or the validation errors.
+If the batch is empty or larger than SHORTENER_BULK_MAX_URLS, it returns a 400 Bad Request response.
+"""
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, NDJSONParser])
+@throttle_classes([RateLimitThrottle, ShortenRateThrottle])
+def bulk_shorten_url(request):
+  items = request.data.get('urls') if isinstance(request.data, dict) else request.data
+  max_urls = getattr(settings, 'SHORTENER_BULK_MAX_URLS', 10000)
+  if not isinstance(items, list) or not items:
+    return Response({'error': 'Expected a non-empty list of URLs'}, status=status.HTTP_400_BAD_REQUEST)
+  if len(items) > max_urls:
+    return Response({'error': f'At most {max_urls} URLs can be shortened per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+  serializer = ShortenedUrlSerializer()
+  results = []
+  valid_urls = []
+  expiries = []
+  for item in items:
+    data = {'original_url': item} if isinstance(item, str) else item
+    try:
+      validated_data = serializer.run_validation(data)
+      original_url = validated_data['original_url']
+      valid_urls.append(original_url)
+      expiries.append({name: validated_data.get(name) for name in ('expires_at', 'max_clicks')})
+      results.append({'original_url': original_url})
+    except ValidationError as error:
+      results.append({'original_url': data.get('original_url') if isinstance(data, dict) else data, 'errors': error.detail})
+
+  # New links are not pushed into the redirect cache, a large batch would evict the links that are actually hot.
+  shortened_urls = iter(ShortenedUrl.objects.bulk_get_or_create_for_user(valid_urls, request.user.id, expiries=expiries))
+  for result in results:
+    if 'errors' not in result:
+      shortened_url, created = next(shortened_urls)
+      result['shortened_url'] = build_short_url(shortened_url.short_code)
+      result['expires_at'] = shortened_url.expires_at
+      result['max_clicks'] = shortened_url.max_clicks
+      result['created'] = created
+
+  return Response({
+    'created': sum(1 for result in results if result.get('created')),
+    'existing': sum(1 for result in results if result.get('created') is False),
+    'failed': sum(1 for result in results if 'errors' in result),
+    'results': results
+  }, status=status.HTTP_200_OK)
+
+"""
+Returns the user's shortened URLs as export rows, newest first, read from the database in chunks.
+"""
+def export_rows(request):
+  rows = ShortenedUrl.objects.filter(user_id=request.user.id).order_by(*KeysetPagination.ordering).values_list(*EXPORT_FIELDS)
+  for original_url, short_code, shortened_url, created_at, click_count in rows.iterator(chunk_size=STREAM_CHUNK_SIZE):
+    yield original_url, short_code, shortened_url, created_at.isoformat(), click_count
+
+"""
+Yields export rows as CSV with a header line, in chunks of about EXPORT_BUFFER_SIZE characters.
+"""
+def stream_csv(rows):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(EXPORT_FIELDS)
+  for row in rows:
+    writer.writerow(row)
+    if buffer.tell() >= EXPORT_BUFFER_SIZE:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  yield buffer.getvalue()
+
+"""
+Yields export rows as newline delimited JSON objects, in chunks of about EXPORT_BUFFER_SIZE characters.
+"""
+def stream_ndjson(rows):
+  lines = []
+  size = 0
+  for row in rows:
+    line = json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+    lines.append(line)
+    size += len(line)
+    if size >= EXPORT_BUFFER_SIZE:
+      yield ''.join(lines)
+      lines = []
+      size = 0
+  yield ''.join(lines)
+
+"""
+Exports every shortened URL of the authenticated user as a CSV file, newest first.
+The rows are streamed while they are read, so memory use does not grow with the number of links.
+If the user is not authenticated, it returns a 401 Unauthorized response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_user_urls_csv(request):
+  response = StreamingHttpResponse(stream_csv(export_rows(request)), content_type='text/csv')
+  response['Content-Disposition'] = 'attachment; filename="links.csv"'
+  return response
+
+"""
+Exports every shortened URL of the authenticated user as newline delimited JSON, newest first.
+The rows are streamed while they are read, so memory use does not grow with the number of links.
+If the user is not authenticated, it returns a 401 Unauthorized response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_user_urls_ndjson(request):
+  response = StreamingHttpResponse(stream_ndjson(export_rows(request)), content_type='application/x-ndjson')
+  response['Content-Disposition'] = 'attachment; filename="links.ndjson"'
+  return response
+
+"""
+Yields (line number, item) pairs from CSV lines with an original_url column, as written by the CSV export.
+"""
+def iter_csv_items(lines):
+  reader = csv.DictReader(lines)
+  if not reader.fieldnames or 'original_url' not in reader.fieldnames:
+    raise ValueError('The CSV header must contain an original_url column')
+  for row in reader:
+    yield reader.line_num, row['original_url']
+
+"""
+Yields (line number, item) pairs from NDJSON lines, where each value is a URL or an object with an original_url.
+Lines that are not valid JSON are yielded as None, which fails validation.
+"""
+def iter_ndjson_items(lines):
+  for line_number, line in enumerate(lines, start=1):
+    line = line.strip()
+    if not line:
+      continue
+    try:
+      yield line_number, json.loads(line)
+    except ValueError:
+      yield line_number, None
+
+"""
+Imports shortened URLs for the authenticated user from a CSV (text/csv) or NDJSON (application/x-ndjson) request body.
+Imports are URL-only: the short_code, shortened_url, created_at and click_count of an export are ignored, since codes
+are only ever assigned by the service. A URL the user already has a link for keeps that link, any other URL gets a new
+short code, so importing an export into an account without those links does not bring back the old codes.
+The body is read as a stream and every IMPORT_CHUNK_SIZE valid URLs are deduplicated against the user's links and
+inserted in bulk, so memory use does not grow with the size of the import. Each chunk is committed on its own.
+It returns the number of created, existing and failed URLs, with the errors of the first MAX_IMPORT_ERRORS failures.
+If the body is empty, of another content type or cannot be decoded, it returns a 400 Bad Request response,
+with the counts of the chunks that were already imported.
+"""
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([])
+@throttle_classes([RateLimitThrottle, ShortenRateThrottle])
+def import_user_urls(request):
+  content_type = request.content_type.split(';')[0].strip()
+  if content_type not in ('text/csv', 'application/x-ndjson'):
+    return Response({'error': 'Expected a text/csv or application/x-ndjson body'}, status=status.HTTP_400_BAD_REQUEST)
+  if request.stream is None:
+    return Response({'error': 'Expected a non-empty body'}, status=status.HTTP_400_BAD_REQUEST)
+
+  lines = codecs.iterdecode(request.stream, 'utf-8')
+  items = iter_csv_items(lines) if content_type == 'text/csv' else iter_ndjson_items(lines)
+  # Only original_url is read from an item, so only that field is validated and the other export columns are ignored.
+  url_field = ShortenedUrlSerializer().fields['original_url']
+  summary = {'created': 0, 'existing': 0, 'failed': 0, 'errors': []}
+  chunk = []
+
+  def import_chunk():
+    for shortened_url, created in ShortenedUrl.objects.bulk_get_or_create_for_user(chunk, request.user.id):
+      summary['created' if created else 'existing'] += 1
+    chunk.clear()
+
+  try:
+    for line_number, item in items:
+      value = item.get('original_url', empty) if isinstance(item, dict) else item
+      try:
+        if not isinstance(value, str) and value is not empty:
+          raise ValidationError(['Expected a URL or an object with an original_url.'])
+        chunk.append(url_field.run_validation(value))
+      except ValidationError as error:
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_IMPORT_ERRORS:
+          summary['errors'].append({'line': line_number, 'errors': {'original_url': error.detail}})
+      if len(chunk) >= IMPORT_CHUNK_SIZE:
+        import_chunk()
+  except (ValueError, csv.Error) as error:
+    import_chunk()
+    return Response({**summary, 'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+  import_chunk()
+  return Response(summary, status=status.HTTP_200_OK)
+
 """
 Deletes the shortened URL associated with the authenticated user.
 If the user is not authenticated, it returns a 401 Unauthorized response.
@@ -70,22 +306,175 @@ If the short code does not exist, it returns a 404 Not Found response.
 @permission_classes([IsAuthenticated])
 def delete_url(request, short_code):
   try:
-    shortened_url = ShortenedUrl.objects.get(short_code=short_code, user=request.user)
+    shortened_url = ShortenedUrl.objects.get(short_code=short_code, user_id=request.user.id)
     shortened_url.delete()
     return Response(status=status.HTTP_204_NO_CONTENT)
   except ShortenedUrl.DoesNotExist:
     return Response({'error': 'Shortened URL not found'}, status=status.HTTP_404_NOT_FOUND)
 
+"""
+Serves a stats response with ETag and Last-Modified validators taken from the user's stats row.
+The row changes whenever a link of the user is created, deleted or clicked, so if the client's copy is still current
+it returns a 304 Not Modified response without computing the stats.
+Otherwise it returns the data produced by build(stats), where stats may be None for a user without links.
+"""
+def conditional_stats_response(request, build, variant=''):
+  stats = UserLinkStats.objects.filter(user_id=request.user.id).first()
+  last_modified = int(stats.updated_at.timestamp()) if stats else None
+  version = int(stats.updated_at.timestamp() * 1000000) if stats else 0
+  etag = f'"{request.user.id}-{version}{variant}"'
+
+  not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+  if not_modified is not None:
+    return not_modified
+
+  response = Response(build(stats), status=status.HTTP_200_OK)
+  response['ETag'] = etag
+  if last_modified is not None:
+    response['Last-Modified'] = http_date(last_modified)
+  patch_cache_control(response, private=True, no_cache=True)
+  return response
+
+def get_int_param(request, name, default, maximum):
+  try:
+    return min(max(int(request.query_params.get(name, default)), 1), maximum)
+  except ValueError:
+    return default
+
+"""
+Gets the link count and total clicks of the authenticated user from the precomputed stats row.
+If the user is not authenticated, it returns a 401 Unauthorized response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_user_stats(request):
+  return conditional_stats_response(request, lambda stats: {
+    'link_count': stats.link_count if stats else 0,
+    'total_clicks': stats.total_clicks if stats else 0,
+    'updated_at': stats.updated_at if stats else None
+  })
+
+"""
+Gets the authenticated user's most clicked shortened URLs, at most `limit` of them (10 by default, up to 100).
+The URLs are read in click order from the (user, click_count) index.
+If the user is not authenticated, it returns a 401 Unauthorized response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_top_urls(request):
+  limit = get_int_param(request, 'limit', 10, MAX_TOP_URLS)
+
+  def build(stats):
+    urls = ShortenedUrl.objects.filter(user_id=request.user.id).order_by('-click_count', '-id').only(
+      *ShortenedUrlSerializer.Meta.fields
+    )[:limit]
+    return {'results': ShortenedUrlSerializer(urls, many=True).data}
+
+  return conditional_stats_response(request, build)
+
+"""
+Gets the click total and click time series of one of the authenticated user's shortened URLs.
+The series is read from the hourly or daily rollups (granularity=hour or day) for the last `days` days (30 by default).
+If the user is not authenticated, it returns a 401 Unauthorized response.
+If the short code does not exist for the user, it returns a 404 Not Found response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_url_stats(request, short_code):
+  shortened_url = ShortenedUrl.objects.filter(short_code=short_code, user_id=request.user.id).only('id', 'click_count').first()
+  if shortened_url is None:
+    return Response({'error': 'Shortened URL not found'}, status=status.HTTP_404_NOT_FOUND)
+  granularity = 'hour' if request.query_params.get('granularity') == 'hour' else 'day'
+  days = get_int_param(request, 'days', 30, MAX_STATS_DAYS)
+  today = timezone.now().date()
+
+  def build(stats):
+    since = timezone.now() - timedelta(days=days)
+    return {
+      'short_code': short_code,
+      'click_count': shortened_url.click_count,
+      'granularity': granularity,
+      'series': [{'bucket': bucket, 'clicks': clicks} for bucket, clicks in click_series(shortened_url, granularity, since)]
+    }
+
+  # The window moves with the date, so the validators change daily even without new clicks.
+  return conditional_stats_response(request, build, variant=f'-{today.isoformat()}')
+
+"""
+Gets the hottest short codes seen by the redirect cache of the process serving the request, at most `limit` of them
+(the pinned size by default, up to 1000), with their estimated hit counts, error bounds and whether they are pinned.
+Counts are decayed at every pin refresh, so they reflect recent traffic.
+If the user is not an admin, it returns a 403 Forbidden response.
+"""
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_hot_urls(request):
+  if url_cache.hot is None:
+    return Response({'pinned_size': 0, 'results': []})
+  limit = get_int_param(request, 'limit', url_cache.pinned_size, MAX_HOT_URLS)
+  return Response({
+    'pinned_size': url_cache.pinned_size,
+    'tracked': len(url_cache.hot),
+    'results': [
+      {'short_code': short_code, 'hits': hits, 'error': error, 'pinned': short_code in url_cache.pinned}
+      for short_code, hits, error, original_url in url_cache.hot.top(limit)
+    ]
+  })
+
+"""
+Returns the 429 Too Many Requests response for a rate limited request, telling the client when to retry.
+"""
+def rate_limited_response(retry_after):
+  response = JsonResponse({'error': 'Too many requests'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+  response['Retry-After'] = str(retry_after)
+  return response
+
+"""
+Builds the redirect response for a short code.
+The original URL is read through the redirect cache and the click and its analytics event are buffered, so a cached link is served without a query.
+A click-limited link is looked up and its click claimed on the database at every redirect, so it never exceeds max_clicks.
+It redirects with 302 Found, or 301 Moved Permanently if SHORTENER_REDIRECT_PERMANENT is set.
+If the short code does not exist, it returns a 404 Not Found JSON response.
+If the client exceeds the redirect rate limit, it returns a 429 Too Many Requests JSON response before any lookup.
+"""
+def build_redirect_response(request, short_code):
+  retry_after = rate_limiter.hit('redirect', rate_limiter.client_ip(request.META))
+  if retry_after:
+    return rate_limited_response(retry_after)
+  original_url, limited = lookup_short_code(short_code)
+  if original_url is None or (limited and not claim_click(short_code)):
+    return JsonResponse({'error': 'Shortened URL not found'}, status=status.HTTP_404_NOT_FOUND)
+  if limited:
+    click_aggregator.record_event(click_from_request(short_code, request))
+  else:
+    click_aggregator.record(short_code, event=click_from_request(short_code, request))
+  if getattr(settings, 'SHORTENER_REDIRECT_PERMANENT', False):
+    return HttpResponsePermanentRedirect(original_url)
+  return HttpResponseRedirect(original_url)
+
+"""
+Async variant of build_redirect_response, used when the app runs under ASGI.
+It never blocks the event loop on a cache hit, so one worker can hold many concurrent redirects.
+"""
+async def abuild_redirect_response(request, short_code):
+  retry_after = await rate_limiter.ahit('redirect', rate_limiter.client_ip(request.META))
+  if retry_after:
+    return rate_limited_response(retry_after)
+  original_url, limited = await alookup_short_code(short_code)
+  if original_url is None or (limited and not await aclaim_click(short_code)):
+    return JsonResponse({'error': 'Shortened URL not found'}, status=status.HTTP_404_NOT_FOUND)
+  if limited:
+    click_aggregator.record_event(click_from_request(short_code, request))
+  else:
+    await click_aggregator.arecord(short_code, event=click_from_request(short_code, request))
+  if getattr(settings, 'SHORTENER_REDIRECT_PERMANENT', False):
+    return HttpResponsePermanentRedirect(original_url)
+  return HttpResponseRedirect(original_url)
+
 """
 Redirects to the original URL based on the short code provided.
+Short codes are normally answered by RedirectMiddleware before the view is reached, this view serves the codes it lets through.
 If the short code does not exist, it returns a 404 Not Found response.
 """
-@renderer_classes([])
 def redirect_url(request, short_code):
-  try:
-    shortened_url = ShortenedUrl.objects.get(short_code=short_code)
-    shortened_url.click_count += 1
-    shortened_url.save()
-    return HttpResponseRedirect(shortened_url.original_url)
-  except ShortenedUrl.DoesNotExist:
-    return Response({'error': 'Shortened URL not found'}, status=status.HTTP_404_NOT_FOUND)
+  return build_redirect_response(request, short_code)